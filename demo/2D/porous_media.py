@@ -0,0 +1,132 @@
+"""
+test: True
+"""
+from six.moves import range
+import numpy as np
+import sympy as sp
+
+import pylbm
+
+X, Y, LA = sp.symbols('X, Y, LA')
+rho, qx, qy = sp.symbols('rho, qx, qy')
+
+def solid_fraction(sol):
+    """
+    fraction of the interior points which are in the solid part
+    """
+    return 1. - sol.domain.get_fluid_cells().shape[0]/np.prod(sol.domain.shape_in)
+
+def run(dx, Tf, generator="cython", sorder=None, skip_solid_cells=True, withPlot=True):
+    """
+    Parameters
+    ----------
+
+    dx: double
+        spatial step
+
+    Tf: double
+        final time
+
+    generator: pylbm generator
+
+    sorder: list
+        storage order
+
+    skip_solid_cells: boolean
+        if True the time step only loops over the fluid points
+
+    withPlot: boolean
+        if True plot the solution otherwise just compute the solution
+
+    """
+    # parameters
+    la = 1. # velocity of the scheme
+    rhoo = 1.
+    uo = 0.05
+    mu = 1.e-3
+    zeta = 10*mu
+    dummy = 3.0/(la*rhoo*dx)
+    s1 = 1.0/(0.5+zeta*dummy)
+    s2 = 1.0/(0.5+mu*dummy)
+    s = [0., 0., 0., s1, s1, s1, s1, s2, s2]
+    dummy = 1./(LA**2*rhoo)
+    qx2 = dummy*qx**2
+    qy2 = dummy*qy**2
+    q2 = qx2+qy2
+    qxy = dummy*qx*qy
+
+    # periodic array of cylinders which fill 60% of the domain
+    ncyl = 8
+    spacing = 1./ncyl
+    radius = np.sqrt(0.6/np.pi)*spacing
+    elements = [pylbm.Circle([(i + .5)*spacing, (j + .5)*spacing], radius, label=0)
+                for i in range(ncyl) for j in range(ncyl)]
+
+    dico = {
+        'box':{'x':[0., 1.], 'y':[0., 1.], 'label':-1},
+        'elements':elements,
+        'space_step':dx,
+        'scheme_velocity':la,
+        'schemes':[
+            {
+                'velocities':list(range(9)),
+                'polynomials':[
+                    1,
+                    LA*X, LA*Y,
+                    3*(X**2+Y**2)-4,
+                    0.5*(9*(X**2+Y**2)**2-21*(X**2+Y**2)+8),
+                    3*X*(X**2+Y**2)-5*X, 3*Y*(X**2+Y**2)-5*Y,
+                    X**2-Y**2, X*Y
+                ],
+                'relaxation_parameters':s,
+                'equilibrium':[
+                    rho,
+                    qx, qy,
+                    -2*rho + 3*q2,
+                    rho - 3*q2,
+                    -qx/LA, -qy/LA,
+                    qx2 - qy2, qxy
+                ],
+                'conserved_moments': [rho, qx, qy],
+                'init': {rho: rhoo, qx: rhoo*uo, qy: 0.},
+            },
+        ],
+        'parameters':{LA: la},
+        'boundary_conditions':{
+            0:{'method':{0: pylbm.bc.BounceBack}},
+        },
+        'generator': generator,
+        'skip_solid_cells': skip_solid_cells,
+    }
+
+    sol = pylbm.Simulation(dico, sorder=sorder)
+
+    if withPlot:
+        # init viewer
+        viewer = pylbm.viewer.matplotlib_viewer
+        fig = viewer.Fig()
+        ax = fig[0]
+        image = ax.image(lambda sol: sol.m[qx].T, (sol,), cmap='jet', clim=[0, uo])
+
+        def update(iframe):
+            sol.run(16)
+            image.set_data(sol.m[qx].T)
+            ax.title = "Solution t={0:f}".format(sol.t)
+
+        # run the simulation
+        fig.animate(update, interval=1)
+        fig.show()
+    else:
+        while sol.t < Tf:
+            sol.one_time_step()
+
+    return sol
+
+if __name__ == '__main__':
+    # compare the time step on all the points and on the fluid points only
+    dx = 1./512
+    for skip_solid_cells in [False, True]:
+        sol = run(dx, 200*dx, skip_solid_cells=skip_solid_cells, withPlot=False)
+        report = sol.time_report()
+        print("skip_solid_cells={0}: solid fraction {1:.2f}, one_time_step {2:.3f}s, MLUPS {3:.1f}".format(
+            skip_solid_cells, solid_fraction(sol), report['phases']['one_time_step']['max'], report['MLUPS']))
@@ -0,0 +1,122 @@
+"""
+test: False
+"""
+from six.moves import range
+import time
+import sympy as sp
+
+import pylbm
+from pylbm.generator import generator
+
+X, Y, Z, LA = sp.symbols('X, Y, Z, LA')
+rho, qx, qy, qz = sp.symbols('rho, qx, qy, qz')
+
+def d2q9(la):
+    """
+    D2Q9 scheme for the Navier-Stokes equations
+    """
+    q2 = (qx**2 + qy**2)/LA**2
+    return {
+        'box':{'x':[0., 1.], 'y':[0., 1.], 'label':0},
+        'space_step':0.01,
+        'scheme_velocity':la,
+        'parameters':{LA: 1.},
+        'schemes':[{
+            'velocities':list(range(9)),
+            'polynomials':[
+                1, LA*X, LA*Y,
+                3*(X**2+Y**2)-4,
+                0.5*(9*(X**2+Y**2)**2-21*(X**2+Y**2)+8),
+                3*X*(X**2+Y**2)-5*X, 3*Y*(X**2+Y**2)-5*Y,
+                X**2-Y**2, X*Y
+            ],
+            'relaxation_parameters':[0., 0., 0., 1.1, 1.1, 1.2, 1.2, 1.8, 1.8],
+            'equilibrium':[
+                rho, qx, qy,
+                -2*rho + 3*q2, rho - 3*q2,
+                -qx/LA, -qy/LA,
+                (qx**2 - qy**2)/LA**2, qx*qy/LA**2
+            ],
+            'conserved_moments':[rho, qx, qy],
+            'init':{rho: 1., qx: 0., qy: 0.},
+        }],
+    }
+
+def d3q19(la):
+    """
+    D3Q19 scheme for the Navier-Stokes equations
+    """
+    r = X**2 + Y**2 + Z**2
+    q2 = (qx**2 + qy**2 + qz**2)/LA**2
+    return {
+        'box':{'x':[0., 1.], 'y':[0., 1.], 'z':[0., 1.], 'label':0},
+        'space_step':0.01,
+        'scheme_velocity':la,
+        'parameters':{LA: 1.},
+        'schemes':[{
+            'velocities':list(range(19)),
+            'polynomials':[
+                1, LA*X, LA*Y, LA*Z,
+                19*r - 30, (21*r**2 - 53*r + 24)/2,
+                (5*r - 9)*X, (5*r - 9)*Y, (5*r - 9)*Z,
+                3*X**2 - r, (3*r - 5)*(3*X**2 - r),
+                Y**2 - Z**2, (3*r - 5)*(Y**2 - Z**2),
+                X*Y, Y*Z, Z*X,
+                (Y**2 - Z**2)*X, (Z**2 - X**2)*Y, (X**2 - Y**2)*Z
+            ],
+            'relaxation_parameters':[0.]*4 + [1.2]*15,
+            'equilibrium':[
+                rho, qx, qy, qz,
+                -11*rho + 19*q2, 3*rho - 11*q2/2,
+                -2*qx/3/LA, -2*qy/3/LA, -2*qz/3/LA,
+                (2*qx**2 - qy**2 - qz**2)/LA**2, -(2*qx**2 - qy**2 - qz**2)/LA**2/2,
+                (qy**2 - qz**2)/LA**2, -(qy**2 - qz**2)/LA**2/2,
+                qx*qy/LA**2, qy*qz/LA**2, qz*qx/LA**2,
+                0, 0, 0
+            ],
+            'conserved_moments':[rho, qx, qy, qz],
+            'init':{rho: 1., qx: 0., qy: 0., qz: 0.},
+        }],
+    }
+
+def d3q27(la):
+    """
+    D3Q27 scheme with the raw moments X**a Y**b Z**c
+    """
+    powers = [(a, b, c) for a in range(3) for b in range(3) for c in range(3)]
+    equilibrium = {(0, 0, 0): rho, (1, 0, 0): qx, (0, 1, 0): qy, (0, 0, 1): qz}
+    return {
+        'box':{'x':[0., 1.], 'y':[0., 1.], 'z':[0., 1.], 'label':0},
+        'space_step':0.01,
+        'scheme_velocity':la,
+        'parameters':{LA: 1.},
+        'schemes':[{
+            'velocities':list(range(27)),
+            'polynomials':[(LA*X)**a*(LA*Y)**b*(LA*Z)**c for a, b, c in powers],
+            'relaxation_parameters':[0.]*4 + [1.5]*23,
+            'equilibrium':[equilibrium.get(p, 0) for p in powers],
+            'conserved_moments':[rho, qx, qy, qz],
+            'init':{rho: 1., qx: 0., qy: 0., qz: 0.},
+        }],
+    }
+
+def setup_time(dico):
+    """
+    return the time to build the scheme and the time to generate its code
+    """
+    t0 = time.time()
+    scheme = pylbm.Scheme(dico)
+    t1 = time.time()
+    scheme.generate('CYTHON', [scheme.dim] + list(range(scheme.dim)), 999)
+    t2 = time.time()
+    generator.routines.clear()
+    return t1 - t0, t2 - t1
+
+if __name__ == '__main__':
+    # the time of the symbolic setup with a numerical
+    # and with a symbolic scheme velocity
+    for scheme in [d2q9, d3q19, d3q27]:
+        for la in [1., LA]:
+            tscheme, tgenerate = setup_time(scheme(la))
+            print("{0} scheme_velocity={1}: Scheme {2:.2f}s, generate {3:.2f}s".format(
+                scheme.__name__, la, tscheme, tgenerate))
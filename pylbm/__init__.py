@@ -11,12 +11,13 @@ import mpi4py.MPI as mpi
 from .domain import Domain
 from .stencil import Stencil
 from .simulation import Simulation
+from .ensemble import Ensemble
 from . import boundary as bc
 from .scheme import Scheme
 from .elements import * #pylint: disable=wildcard-import
 from .geometry import Geometry
 from . import viewer
-from .hdf5 import H5File
+from .hdf5 import H5File, H5TimeSeries
 from .options import options
 
 from .version import version as __version__
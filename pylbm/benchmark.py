@@ -0,0 +1,521 @@
+# Authors:
+#     Loic Gouarin <loic.gouarin@polytechnique.edu>
+#     Benjamin Graille <benjamin.graille@math.u-psud.fr>
+#
+# License: BSD 3 clause
+
+"""
+pylbm benchmark suite
+
+Run standard test cases for several grid sizes, storages and generators
+and report the setup time, the time of the code generation and of the
+compilation, the MLUPS and the memory used. The results can be stored
+using the JSON format to track the performance between the releases::
+
+    python -m pylbm.benchmark --cases D2Q9_cavity --sizes 64 128 --output bench.json
+    python -m pylbm.benchmark --compare bench.json
+
+or with the command pylbm-benchmark. The benchmark can be run with mpirun.
+The compiled modules are cached (see the options --cache-dir and --no-cache
+of pylbm): the compilation time is the loading time of the cached module
+when the case was already compiled.
+"""
+
+import sys
+import json
+import time
+import logging
+import platform
+from collections import OrderedDict
+from argparse import ArgumentParser
+import numpy as np
+import sympy as sp
+import mpi4py.MPI as mpi
+
+from .simulation import Simulation
+from .generator import generator as code_generator
+from . import boundary as bc
+from .elements import Circle
+
+log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+X, Y, Z, LA = sp.symbols('X, Y, Z, LA')
+u, rho, qx, qy, qz = sp.symbols('u, rho, qx, qy, qz')
+
+#pylint: disable=unused-argument
+def _driven_velocity(f, m, *coords):
+    m[qx] = 0.05
+
+def _inflow(f, m, x, y, z):
+    m[qx] = 0.05*(1. - 16.*(y - 0.25)**2)
+
+def _karman_inflow(f, m, x, y):
+    m[rho] = 1.
+    m[qx] = 0.05
+    m[qy] = 0.
+#pylint: enable=unused-argument
+
+def _d2q9(s_mu):
+    q2 = (qx**2 + qy**2)/LA**2
+    return {
+        'velocities':list(range(9)),
+        'polynomials':[
+            1, LA*X, LA*Y,
+            3*(X**2+Y**2)-4,
+            0.5*(9*(X**2+Y**2)**2-21*(X**2+Y**2)+8),
+            3*X*(X**2+Y**2)-5*X, 3*Y*(X**2+Y**2)-5*Y,
+            X**2-Y**2, X*Y
+        ],
+        'relaxation_parameters':[0., 0., 0., 1.1, 1.1, 1.2, 1.2, s_mu, s_mu],
+        'equilibrium':[
+            rho, qx, qy,
+            -2*rho + 3*q2, rho - 3*q2,
+            -qx/LA, -qy/LA,
+            (qx**2 - qy**2)/LA**2, qx*qy/LA**2
+        ],
+        'conserved_moments':[rho, qx, qy],
+    }
+
+def _d3q19(s_mu):
+    r = X**2 + Y**2 + Z**2
+    q2 = (qx**2 + qy**2 + qz**2)/LA**2
+    return {
+        'velocities':list(range(19)),
+        'polynomials':[
+            1, LA*X, LA*Y, LA*Z,
+            19*r - 30, (21*r**2 - 53*r + 24)/2,
+            (5*r - 9)*X, (5*r - 9)*Y, (5*r - 9)*Z,
+            3*X**2 - r, (3*r - 5)*(3*X**2 - r),
+            Y**2 - Z**2, (3*r - 5)*(Y**2 - Z**2),
+            X*Y, Y*Z, Z*X,
+            (Y**2 - Z**2)*X, (Z**2 - X**2)*Y, (X**2 - Y**2)*Z
+        ],
+        'relaxation_parameters':[0.]*4 + [1.2]*5 + [s_mu]*7 + [1.2]*3,
+        'equilibrium':[
+            rho, qx, qy, qz,
+            -11*rho + 19*q2, 3*rho - 11*q2/2,
+            -2*qx/3/LA, -2*qy/3/LA, -2*qz/3/LA,
+            (2*qx**2 - qy**2 - qz**2)/LA**2, -(2*qx**2 - qy**2 - qz**2)/LA**2/2,
+            (qy**2 - qz**2)/LA**2, -(qy**2 - qz**2)/LA**2/2,
+            qx*qy/LA**2, qy*qz/LA**2, qz*qx/LA**2,
+            0, 0, 0
+        ],
+        'conserved_moments':[rho, qx, qy, qz],
+    }
+
+def d1q2_advection(dx):
+    """D1Q2 scheme for the advection equation on the 1D-torus"""
+    scheme = {
+        'velocities':[1, 2],
+        'conserved_moments':[u],
+        'polynomials':[1, LA*X],
+        'relaxation_parameters':[0., 1.9],
+        'equilibrium':[u, 0.25*u],
+        'init':{u: 1.},
+    }
+    return {
+        'box':{'x':[0., 1.], 'label':-1},
+        'space_step':dx,
+        'scheme_velocity':LA,
+        'parameters':{LA: 1.},
+        'schemes':[scheme],
+    }
+
+def d2q9_cavity(dx):
+    """D2Q9 scheme for the lid driven cavity"""
+    scheme = _d2q9(1.8)
+    scheme['init'] = {rho: 1., qx: 0., qy: 0.}
+    return {
+        'box':{'x':[0., 1.], 'y':[0., 1.], 'label':[0, 0, 0, 1]},
+        'space_step':dx,
+        'scheme_velocity':LA,
+        'parameters':{LA: 1.},
+        'schemes':[scheme],
+        'boundary_conditions':{
+            0:{'method':{0: bc.BouzidiBounceBack}},
+            1:{'method':{0: bc.BouzidiBounceBack}, 'value':(_driven_velocity, ())},
+        },
+    }
+
+def d2q9_karman(dx):
+    """D2Q9 scheme for the Karman vortex street behind a circular obstacle"""
+    scheme = _d2q9(1.95)
+    scheme['init'] = {rho: 1., qx: 0.05, qy: 0.}
+    return {
+        'box':{'x':[0., 2.], 'y':[0., 1.], 'label':[0, 1, 0, 0]},
+        'elements':[Circle([.3, 0.5 + 2*dx], 0.125, label=2)],
+        'space_step':dx,
+        'scheme_velocity':LA,
+        'parameters':{LA: 1.},
+        'schemes':[scheme],
+        'boundary_conditions':{
+            0:{'method':{0: bc.BouzidiBounceBack}, 'value':(_karman_inflow, ())},
+            1:{'method':{0: bc.NeumannX}},
+            2:{'method':{0: bc.BouzidiBounceBack}},
+        },
+    }
+
+def d3q19_poiseuille(dx):
+    """D3Q19 scheme for a Poiseuille flow between two planes (periodic in z)"""
+    scheme = _d3q19(1.8)
+    scheme['init'] = {rho: 1., qx: 0., qy: 0., qz: 0.}
+    return {
+        'box':{'x':[0., 1.], 'y':[0., .5], 'z':[0., .25], 'label':[1, 2, 0, 0, -1, -1]},
+        'space_step':dx,
+        'scheme_velocity':LA,
+        'parameters':{LA: 1.},
+        'schemes':[scheme],
+        'boundary_conditions':{
+            0:{'method':{0: bc.BouzidiBounceBack}},
+            1:{'method':{0: bc.BouzidiBounceBack}, 'value':(_inflow, ())},
+            2:{'method':{0: bc.NeumannX}},
+        },
+    }
+
+def d3q19_cavity(dx):
+    """D3Q19 scheme for the lid driven cubic cavity"""
+    scheme = _d3q19(1.8)
+    scheme['init'] = {rho: 1., qx: 0., qy: 0., qz: 0.}
+    return {
+        'box':{'x':[0., 1.], 'y':[0., 1.], 'z':[0., 1.], 'label':[0, 0, 0, 0, 0, 1]},
+        'space_step':dx,
+        'scheme_velocity':LA,
+        'parameters':{LA: 1.},
+        'schemes':[scheme],
+        'boundary_conditions':{
+            0:{'method':{0: bc.BouzidiBounceBack}},
+            1:{'method':{0: bc.BouzidiBounceBack}, 'value':(_driven_velocity, ())},
+        },
+    }
+
+# the test cases with their default numbers of points per unit length
+CASES = OrderedDict([
+    ('D1Q2_advection', (d1q2_advection, [1024, 16384])),
+    ('D2Q9_cavity', (d2q9_cavity, [64, 256])),
+    ('D2Q9_Karman', (d2q9_karman, [64, 128])),
+    ('D3Q19_Poiseuille', (d3q19_poiseuille, [32, 64])),
+    ('D3Q19_cavity', (d3q19_cavity, [16, 48])),
+])
+
+GENERATORS = ['numpy', 'cython', 'loopy']
+
+STORAGES = ['soa', 'aos']
+
+def available_generators():
+    """return the generators which can be used on this machine"""
+    generators = ['numpy', 'cython']
+    try:
+        import loopy #pylint: disable=unused-variable
+        import pyopencl #pylint: disable=unused-variable
+        generators.append('loopy')
+    except ImportError:
+        pass
+    return generators
+
+def get_sorder(storage, dim):
+    """
+    return the storage order of a storage name
+
+    Parameters
+    ----------
+
+    storage : str
+        'soa', 'aos', 'sparse' or the storage order given by
+        comma separated integers (for instance '1,0,2')
+    dim : int
+        the spatial dimension
+
+    Returns
+    -------
+
+    list or None
+        the storage order (None for the sparse storage
+        or if a given order has not the length dim + 1)
+
+    """
+    if storage == 'soa':
+        return list(range(dim + 1))
+    if storage == 'aos':
+        return [dim] + list(range(dim))
+    if storage == 'sparse':
+        return None
+    sorder = [int(i) for i in storage.split(',')]
+    if sorted(sorder) != list(range(dim + 1)):
+        return None
+    return sorder
+
+def run_case(name, size, generator='cython', storage='aos', nsteps=50, warmup=2):
+    """
+    run one test case and measure its performance
+
+    This function must be called by all the processes.
+
+    Parameters
+    ----------
+
+    name : str
+        the name of the case (a key of CASES)
+    size : int
+        the number of points per unit length (the space step is 1/size)
+    generator : str
+        the generator of the code
+    storage : str
+        the storage (see :py:func:`get_sorder<pylbm.benchmark.get_sorder>`)
+    nsteps : int
+        the number of measured time steps
+    warmup : int
+        the number of time steps done before the measure
+
+    Returns
+    -------
+
+    OrderedDict
+        the description of the run, the times in seconds
+        (the maximum over the processes), the MLUPS of the whole domain
+        and the memory in MB (the sum over the processes for the storage
+        of the distribution functions and of the moments, the maximum
+        over the processes for the resident memory)
+
+    """
+    comm = mpi.COMM_WORLD
+    case = CASES[name][0]
+    dico = case(1./size)
+    dico['generator'] = generator
+    sorder = None
+    if storage == 'sparse':
+        dico['storage'] = 'sparse'
+    else:
+        sorder = get_sorder(storage, len(dico['box']) - 1)
+
+    # the routines of the previous cases must not be compiled with this case
+    code_generator.routines.clear()
+
+    comm.Barrier()
+    t_setup = mpi.Wtime()
+    sol = Simulation(dico, sorder=sorder)
+    t_setup = mpi.Wtime() - t_setup
+
+    for _ in range(warmup):
+        sol.one_time_step()
+    comm.Barrier()
+    t_run = mpi.Wtime()
+    for _ in range(nsteps):
+        sol.one_time_step()
+    t_run = mpi.Wtime() - t_run
+
+    arrays = []
+    for storage_array in [sol._F, sol._Fold, sol._m]: #pylint: disable=protected-access
+        if not any(storage_array.array is a for a in arrays):
+            arrays.append(storage_array.array)
+    nbytes = sum(a.nbytes for a in arrays)
+    try:
+        import resource
+        # ru_maxrss is given in kB on Linux and in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        max_rss *= 1 if sys.platform == 'darwin' else 1024
+    except ImportError:
+        max_rss = 0
+
+    values = np.array([t_setup, sol.cpu_time['code_generation'], sol.cpu_time['compilation'], t_run, max_rss])
+    vmax = np.empty_like(values)
+    comm.Allreduce(values, vmax, op=mpi.MAX)
+    npoints = comm.allreduce(int(np.prod(sol.domain.shape_in)), op=mpi.SUM)
+    nbytes = comm.allreduce(int(nbytes), op=mpi.SUM)
+
+    result = OrderedDict()
+    result['case'] = name
+    result['size'] = size
+    result['generator'] = generator
+    result['storage'] = storage
+    result['sorder'] = sorder
+    result['number_of_points'] = int(npoints)
+    result['number_of_iterations'] = nsteps
+    result['setup_time'] = float(vmax[0])
+    result['code_generation_time'] = float(vmax[1])
+    result['compilation_time'] = float(vmax[2])
+    result['run_time'] = float(vmax[3])
+    result['MLUPS'] = sol.nmembers*npoints*nsteps/vmax[3]/1e6 if vmax[3] > 0 else 0.
+    result['storage_memory'] = nbytes/2.**20
+    result['max_rss'] = float(vmax[4])/2.**20
+    return result
+
+def run(cases=None, sizes=None, generators=None, storages=None, nsteps=50, warmup=2, filename=None):
+    """
+    run the benchmark
+
+    This function must be called by all the processes.
+
+    Parameters
+    ----------
+
+    cases : list, optional
+        the names of the cases (default is all the cases of CASES)
+    sizes : list, optional
+        the numbers of points per unit length
+        (default is the sizes given in CASES for each case)
+    generators : list, optional
+        the generators (default is the available generators)
+    storages : list, optional
+        the storages (default is ['soa', 'aos'])
+    nsteps : int
+        the number of measured time steps
+    warmup : int
+        the number of time steps done before the measure
+    filename : str, optional
+        if given, the results are written in this file using
+        the JSON format (by the process 0)
+
+    Returns
+    -------
+
+    dict
+        the description of the machine and the list of the results
+        of :py:func:`run_case<pylbm.benchmark.run_case>`
+
+    Notes
+    -----
+
+    The combinations which can not be run are skipped: the generators
+    which are not available, the sparse storage with other generators than
+    Cython or with several processes and the storage orders which have not
+    the dimension of the case.
+
+    """
+    from .version import version
+
+    comm = mpi.COMM_WORLD
+    cases = list(CASES.keys()) if cases is None else cases
+    available = available_generators()
+    generators = available if generators is None else generators
+    storages = STORAGES if storages is None else storages
+
+    for name in cases:
+        if name not in CASES:
+            log.error('Unknown benchmark case %s (available cases: %s)', name, ', '.join(CASES.keys()))
+            sys.exit()
+
+    report = OrderedDict()
+    report['pylbm_version'] = version
+    report['date'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    report['python'] = platform.python_version()
+    report['machine'] = platform.platform()
+    report['processor'] = platform.processor()
+    report['number_of_processes'] = comm.Get_size()
+    report['results'] = []
+
+    for name in cases:
+        case, default_sizes = CASES[name]
+        dim = len(case(1.)['box']) - 1
+        for size in default_sizes if sizes is None else sizes:
+            for generator in generators:
+                if generator.lower() not in available:
+                    log.warning('The generator %s is not available', generator)
+                    continue
+                for storage in storages:
+                    if storage == 'sparse':
+                        if generator.lower() != 'cython' or comm.Get_size() > 1:
+                            continue
+                    elif get_sorder(storage, dim) is None:
+                        continue
+                    result = run_case(name, size, generator, storage, nsteps, warmup)
+                    report['results'].append(result)
+                    if comm.Get_rank() == 0:
+                        print(_format(result))
+
+    if filename is not None and comm.Get_rank() == 0:
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=4)
+    return report
+
+def _key(result):
+    return (result['case'], result['size'], result['generator'], result['storage'])
+
+def _format(result):
+    return '{0:18} {1:6d} {2:7} {3:8} setup {4:7.2f}s compilation {5:7.2f}s {6:9.3f} MLUPS {7:9.1f} MB'.format(
+        result['case'], result['size'], result['generator'], result['storage'],
+        result['setup_time'], result['compilation_time'], result['MLUPS'], result['storage_memory'])
+
+def compare(reference, report, tolerance=0.1):
+    """
+    compare the MLUPS of two reports
+
+    Parameters
+    ----------
+
+    reference : dict
+        the reference report (given by :py:func:`run<pylbm.benchmark.run>`)
+    report : dict
+        the new report
+    tolerance : float
+        the relative loss of MLUPS considered as a regression
+
+    Returns
+    -------
+
+    list
+        the tuples (case, size, generator, storage, reference MLUPS, new MLUPS, ratio)
+        of the runs which are in the two reports
+    list
+        the same tuples for the regressions
+
+    """
+    references = dict((_key(r), r) for r in reference['results'])
+    comparison, regressions = [], []
+    for result in report['results']:
+        ref = references.get(_key(result), None)
+        if ref is None:
+            continue
+        ratio = result['MLUPS']/ref['MLUPS'] if ref['MLUPS'] > 0 else float('inf')
+        value = _key(result) + (ref['MLUPS'], result['MLUPS'], ratio)
+        comparison.append(value)
+        if ratio < 1. - tolerance:
+            regressions.append(value)
+    return comparison, regressions
+
+def main(args=None):
+    """
+    command line interface of the benchmark
+
+    Returns 1 if a regression is found with the option --compare, 0 otherwise.
+    """
+    parser = ArgumentParser(description='pylbm benchmark suite')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES.keys()),
+                        help='the test cases (default: all)')
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        help='the numbers of points per unit length (default: depends on the case)')
+    parser.add_argument('--generators', nargs='+', type=str.lower, choices=GENERATORS,
+                        help='the generators (default: the available generators)')
+    parser.add_argument('--storages', nargs='+', default=STORAGES,
+                        help="the storages: soa, aos, sparse or a storage order "
+                             "given by comma separated integers (default: soa aos)")
+    parser.add_argument('--nsteps', type=int, default=50,
+                        help='the number of measured time steps (default: 50)')
+    parser.add_argument('--warmup', type=int, default=2,
+                        help='the number of time steps done before the measure (default: 2)')
+    parser.add_argument('-o', '--output', dest='output',
+                        help='write the results in this JSON file')
+    parser.add_argument('--compare', dest='reference',
+                        help='compare the MLUPS with the results of this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='the relative loss of MLUPS considered as a regression (default: 0.1)')
+    # the other options are the options of pylbm (see pylbm.options)
+    opts, _ = parser.parse_known_args(args)
+
+    report = run(opts.cases, opts.sizes, opts.generators, opts.storages,
+                 opts.nsteps, opts.warmup, opts.output)
+
+    if opts.reference is None:
+        return 0
+    with open(opts.reference) as f:
+        reference = json.load(f)
+    comparison, regressions = compare(reference, report, opts.tolerance)
+    if mpi.COMM_WORLD.Get_rank() == 0:
+        print('comparison with {0} (pylbm {1})'.format(opts.reference, reference.get('pylbm_version', '?')))
+        for case, size, generator, storage, ref, new, ratio in comparison:
+            print('{0:18} {1:6d} {2:7} {3:8} {4:9.3f} -> {5:9.3f} MLUPS ({6:+6.1f}%){7}'.format(
+                case, size, generator, storage, ref, new, 100*(ratio - 1.),
+                ' REGRESSION' if ratio < 1. - opts.tolerance else ''))
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,7 +12,9 @@ import collections
 import logging
 import types
 import numpy as np
+import mpi4py.MPI as mpi
 from six.moves import range
+import sympy as sp
 from sympy import symbols, IndexedBase, Idx, Eq
 
 from .storage import Array
@@ -24,8 +26,22 @@ log = logging.getLogger(__name__) #pylint: disable=invalid-name
 class BoundaryVelocity:
     """
     Indices and distances for the label and the velocity ksym
+
+    Parameters
+    ----------
+    domain : Domain
+        the simulation domain
+    label : int
+        the label of the border
+    ksym : int
+        the index of the unique velocity
+    ind : tuple, optional
+        the spatial indices of the points of domain.flag[num] equal to the label
+        where num is the index of the symmetric velocity (computed if not given)
+    distance : ndarray, optional
+        the distances of these points (computed if not given)
     """
-    def __init__(self, domain, label, ksym):
+    def __init__(self, domain, label, ksym, ind=None, distance=None):
         self.label = label
         # on cherche les points de l'exterieur qui ont une vitesse qui rentre (indice ksym)
         # sur un bord labelise par label
@@ -38,11 +54,75 @@ class BoundaryVelocity:
         v = self.v.get_symmetric()
         num = domain.stencil.unum2index[v.num]
 
-        ind = np.where(domain.flag[num] == self.label)
+        if ind is None:
+            ind = np.where(domain.flag[num] == self.label)
+            distance = domain.distance[(num,) + ind]
         self.indices = np.array(ind)
         if self.indices.size != 0:
             self.indices += np.asarray(v.v)[:, np.newaxis]
-        self.distance = np.array(domain.distance[(num,) + ind])
+        self.distance = np.array(distance)
+
+def scan_flags(domain):
+    """
+    Scan the flags of the domain once and group the border points by label.
+
+    Parameters
+    ----------
+    domain : Domain
+        the simulation domain
+
+    Returns
+    -------
+    list
+        for each unique velocity num, a dictionary whose keys are the labels
+        and values the spatial indices of the points of domain.flag[num]
+        equal to this label (in the order of np.where) and their distances
+
+    """
+    shape = domain.flag.shape[1:]
+    segments = []
+    for num in range(domain.flag.shape[0]):
+        flag = domain.flag[num].ravel()
+        points = np.flatnonzero(flag != domain.valin)
+        labels = flag[points]
+        # the stable sort keeps the order of the points for each label
+        order = np.argsort(labels, kind='mergesort')
+        points, labels = points[order], labels[order]
+        distance = domain.distance[num].ravel()[points]
+        segment = {}
+        for label in np.unique(labels):
+            start, end = np.searchsorted(labels, [label, label + 1])
+            segment[label] = (np.unravel_index(points[start:end], shape), distance[start:end])
+        segments.append(segment)
+    return segments
+
+def morton_order(indices):
+    """
+    Sort points by their Morton index (Z-order curve).
+
+    Parameters
+    ----------
+    indices : ndarray
+        the non negative spatial indices of the points, of shape (dim, number of points)
+
+    Returns
+    -------
+    ndarray
+        the permutation which sorts the points: the points close in space
+        are close in the permutation and the stable sort keeps the order
+        of the points with the same indices
+    """
+    dim, npoints = indices.shape
+    code = np.zeros(npoints, dtype=np.uint64)
+    if npoints == 0:
+        return np.arange(0)
+    nbits = int(np.max(indices)).bit_length()
+    for b in range(nbits):
+        for d in range(dim):
+            # the first axis gives the most significant bit of each level
+            bit = ((indices[d] >> b) & 1).astype(np.uint64)
+            code |= bit << np.uint64(b*dim + dim - 1 - d)
+    return np.argsort(code, kind='mergesort')
 
 class Boundary:
     """
@@ -57,7 +137,9 @@ class Boundary:
             - key is a label
             - value are again a dictionnary with
                 + "method" key that gives the boundary method class used (Bounce_back, Anti_bounce_back, ...)
-                + "value_bc" key that gives the value on the boundary
+                + "value" key that gives the value on the boundary
+                + "update_every" key that gives the number of time steps between two
+                  evaluations of a value which depends on the time (default is 1)
 
     Attributes
     ----------
@@ -69,59 +151,164 @@ class Boundary:
         list of boundary methods used in the LBM scheme
         The list contains Boundary_method instance.
 
+    setup_time : float
+        the time spent to build the tables of the boundary points
+
+    nbytes : int
+        the memory used by the tables of the boundary points (in bytes)
+
+    Notes
+    -----
+
+    The flags of the domain are read once: the border points are grouped
+    by label for each velocity and the tables of each method are allocated
+    with their final size before being filled. The tables are stored
+    with 32-bit integers and the conditions of each method are sorted
+    by the Morton index of their points (see :py:func:`morton_order`)
+    so that the boundary kernels go through the memory with
+    a good locality.
+
+    The methods can also be applied by a single generated routine
+    (see :py:meth:`generate<pylbm.boundary.Boundary.generate>`).
+
     """
     #pylint: disable=too-many-locals
     def __init__(self, domain, dico):
+        t_begin = mpi.Wtime()
         self.domain = domain
+        stencil = self.domain.stencil
+        empty = tuple(np.empty(0, dtype=np.intp) for _ in range(domain.dim)), np.empty(0, dtype=domain.distance.dtype)
 
         # build the list of indices for each unique velocity and for each label
+        segments = scan_flags(self.domain)
         self.bv_per_label = {}
         for label in self.domain.list_of_labels():
             dummy_bv = []
-            for k in range(self.domain.stencil.unvtot):
-                dummy_bv.append(BoundaryVelocity(self.domain, label, k))
+            for k in range(stencil.unvtot):
+                num = stencil.unum2index[stencil.unique_velocities[k].get_symmetric().num]
+                dummy_bv.append(BoundaryVelocity(self.domain, label, k, *segments[num].get(label, empty)))
             self.bv_per_label[label] = dummy_bv
+        del segments
 
         # build the list of boundary informations for each stencil and each label
         dico_bound = dico.get('boundary_conditions', {})
-        stencil = self.domain.stencil
 
-        istore = collections.OrderedDict() # important to set the boundary conditions always in the same way !!!
-        ilabel = {}
-        distance = {}
+        sizes = collections.OrderedDict() # important to set the boundary conditions always in the same way !!!
         value_bc = {}
+        update_every = {}
+        blocks = []
 
-        #pylint: disable=too-many-nested-blocks
         for label in self.domain.list_of_labels():
             if label in [-1, -2]: # periodic or interface conditions
                 pass
             else: # non periodic conditions
                 value_bc[label] = dico_bound[label].get('value', None)
+                update_every[label] = dico_bound[label].get('update_every', 1)
                 methods = dico_bound[label]['method']
                 # for each method get the list of points, the labels and the distances
                 # where the distribution function must be updated on the boundary
                 for k, v in methods.items():
                     for inumk, numk in enumerate(stencil.num[k]):
-                        if self.bv_per_label[label][stencil.unum2index[numk]].indices.size != 0:
-                            indices = self.bv_per_label[label][stencil.unum2index[numk]].indices
-                            distance_tmp = self.bv_per_label[label][stencil.unum2index[numk]].distance
-                            velocity = (inumk + stencil.nv_ptr[k])*np.ones(indices.shape[1], dtype=np.int32)[np.newaxis, :]
-                            ilabel_tmp = label*np.ones(indices.shape[1], dtype=np.int32)
-                            istore_tmp = np.concatenate([velocity, indices])
-                            if istore.get(v, None) is None:
-                                istore[v] = istore_tmp.copy()
-                                ilabel[v] = ilabel_tmp.copy()
-                                distance[v] = distance_tmp.copy()
-                            else:
-                                istore[v] = np.concatenate([istore[v], istore_tmp], axis=1)
-                                ilabel[v] = np.concatenate([ilabel[v], ilabel_tmp])
-                                distance[v] = np.concatenate([distance[v], distance_tmp])
+                        bv = self.bv_per_label[label][stencil.unum2index[numk]]
+                        if bv.indices.size != 0:
+                            blocks.append((v, label, inumk + stencil.nv_ptr[k], bv))
+                            sizes[v] = sizes.get(v, 0) + bv.indices.shape[1]
+
+        # allocate the tables with their final size and fill them
+        istore, ilabel, distance = {}, {}, {}
+        label_type = np.result_type(np.int32, self.domain.list_of_labels())
+        for v, size in sizes.items():
+            istore[v] = np.empty((domain.dim + 1, size), dtype=np.int32)
+            ilabel[v] = np.empty(size, dtype=label_type)
+            distance[v] = np.empty(size, dtype=domain.distance.dtype)
+        offset = dict.fromkeys(sizes, 0)
+        for v, label, velocity, bv in blocks:
+            start, end = offset[v], offset[v] + bv.indices.shape[1]
+            istore[v][0, start:end] = velocity
+            istore[v][1:, start:end] = bv.indices
+            ilabel[v][start:end] = label
+            distance[v][start:end] = bv.distance
+            offset[v] = end
+        for v in sizes:
+            order = morton_order(istore[v][1:])
+            istore[v], ilabel[v], distance[v] = istore[v][:, order], ilabel[v][order], distance[v][order]
+
+        self.nbytes = sum(a[v].nbytes for a in [istore, ilabel, distance] for v in sizes)
+        self.setup_time = mpi.Wtime() - t_begin
+        log.info('Boundary tables: %d points, %.3f MB, built in %.3f s',
+                 sum(sizes.values()), self.nbytes/2.**20, self.setup_time)
 
         # for each method create the instance associated
         self.methods = []
         backend = dico.get("generator", "cython").upper()
-        for k in list(istore.keys()):
+        for k in sizes:
             self.methods.append(k(istore[k], ilabel[k], distance[k], stencil, value_bc, domain.distance.shape, backend))
+            for label in self.methods[-1].update_every:
+                self.methods[-1].update_every[label] = update_every[label]
+
+    @property
+    def name(self):
+        """
+        the name of the fused boundary conditions.
+        """
+        return 'fused {}'.format(', '.join(method.name for method in self.methods))
+
+    def generate(self, sorder):
+        """
+        Generate one routine which applies all the boundary methods
+        one after the other in the order of the list methods.
+
+        The arguments of the method i have the suffix _i
+        except the distribution functions and the sizes of the domain.
+
+        Parameters
+        ----------
+        sorder : list
+            the order of nv, nx, ny and nz
+        """
+        loops = [method.loop(sorder, '_{}'.format(i)) for i, method in enumerate(self.methods)]
+        generator.add_routine(('boundary_conditions', loops))
+
+    def bind(self, ff, conditions=None, parity=None):
+        """
+        Return the routine generated by
+        :py:meth:`generate<pylbm.boundary.Boundary.generate>`
+        with all its arguments set.
+
+        Parameters
+        ----------
+        ff : array
+            The distribution functions
+        conditions : list, optional
+            the indices of the conditions applied for each method
+            (default is None which means all the conditions)
+        parity : str, optional
+            the parity of the next step of the in-place transport
+            (see :py:meth:`BoundaryMethod.bind<pylbm.boundary.BoundaryMethod.bind>`)
+        """
+        from .symbolic import bind_genfunction
+
+        return bind_genfunction(generator.module.boundary_conditions, self.get_args(ff, conditions, parity))
+
+    def get_args(self, ff, conditions=None, parity=None):
+        """
+        Return the arguments of the routine generated by
+        :py:meth:`generate<pylbm.boundary.Boundary.generate>`
+        (see :py:meth:`bind<pylbm.boundary.Boundary.bind>`).
+
+        Returns
+        -------
+        dict
+            the arguments (name: value)
+        """
+        args = {}
+        for i, method in enumerate(self.methods):
+            method_args = method.get_args(ff, None if conditions is None else conditions[i], parity)
+            for name, value in method_args.items():
+                if name not in ['f', 'nx', 'ny', 'nz']:
+                    name += '_{}'.format(i)
+                args[name] = value
+        return args
 
 
 #pylint: disable=protected-access
@@ -149,8 +336,31 @@ class BoundaryMethod:
         indices of points needed to compute the boundary condition
     value_bc : dictionnary
        the prescribed values on the border
+    routine_name : str
+       the name of the generated routine
+    update_every : dictionnary
+       the number of time steps between two evaluations of the values
+       which depend on the time
+    time_dependent : list
+       the labels whose value depends on the time
+
+    Notes
+    -----
+
+    The value of a label is
+
+    - a function (or a tuple with a function and its extra arguments)
+      which sets the moments m on the border from the coordinates:
+      the function depends on the time if it has an argument named t,
+    - a dictionary whose keys are conserved moments and values sympy
+      expressions of the coordinates x, y, z (the symbols with these names)
+      and of the time (the symbol of the key 'time' of the parameters, t by default):
+      with the Cython generators, a generated function computes the
+      equilibrium on the border.
 
     """
+    routine_name = None
+
     def __init__(self, istore, ilabel, distance, stencil, value_bc, nspace, backend):
         self.istore = istore
         self.feq = np.zeros((stencil.nv_ptr[-1], istore.shape[1]))
@@ -160,21 +370,75 @@ class BoundaryMethod:
         self.stencil = stencil
         self.iload = []
         self.value_bc = {}
+        self.update_every = {}
         for k in np.unique(self.ilabel):
             self.value_bc[k] = value_bc[k]
+            self.update_every[k] = 1
         self.nspace = nspace
         self.backend = backend
+        self.time_dependent = []
+        self._kstore = istore[0]
+        self._values = {}
+        self._values_names = {}
+        self._values_functions = {}
+        self._nmembers = 1
+
+    @property
+    def name(self):
+        """
+        the name of the method followed by its labels.
+        """
+        return '{} {}'.format(self.__class__.__name__, [int(k) for k in np.unique(self.ilabel)])
+
+    def set_sparse(self, ff):
+        """
+        Replace the spatial indices of istore and iload by the indices
+        of the points in a sparse storage.
+
+        Parameters
+        ----------
+        ff : Sparse
+            the sparse storage of the distribution functions
+        """
+        self.istore = np.array([self.istore[0], ff.get_index(self.istore[1:].T)], dtype=np.int32)
+        for i in range(len(self.iload)):
+            self.iload[i] = np.array([self.iload[i][0], ff.get_index(self.iload[i][1:].T)], dtype=np.int32)
+
+    def set_inplace(self):
+        """
+        Compute the indices used after the even steps of the in-place
+        transport (see :py:meth:`Scheme.generate<pylbm.scheme.Scheme.generate>`).
+
+        After an even step, the value of the velocity k at the point x
+        is stored in the symmetric velocity at the point x + c_k:
+        istore_odd and iload_odd are istore and iload where each place
+        is moved accordingly. Must be called before fix_iload.
+        """
+        ns = self.stencil.nv_ptr[-1]
+        ksym = self.stencil.get_symmetric()
+        v = self.stencil.get_all_velocities()
+
+        def move(indices):
+            k = indices[0] % ns
+            return np.concatenate([(indices[0] - k + ksym[k])[np.newaxis, :], indices[1:] + v[k].T]).astype(np.int32)
+
+        self.istore_odd = move(self.istore) #pylint: disable=attribute-defined-outside-init
+        self.iload_odd = [move(iload) for iload in self.iload] #pylint: disable=attribute-defined-outside-init
 
     def fix_iload(self):
         """
-        Transpose iload and istore.
+        Transpose iload and istore so that the indices of each condition
+        are contiguous in memory.
 
-        Must be fix in a future version.
+        The tables are already 32-bit integers sorted by
+        the Morton index of the points (see :py:class:`Boundary`).
         """
-        # Fixme : store in a good way and in the right type istore and iload
         for i in range(len(self.iload)):
             self.iload[i] = np.ascontiguousarray(self.iload[i].T, dtype=np.int32)
         self.istore = np.ascontiguousarray(self.istore.T, dtype=np.int32)
+        if hasattr(self, 'istore_odd'):
+            self.istore_odd = np.ascontiguousarray(self.istore_odd.T, dtype=np.int32) #pylint: disable=attribute-defined-outside-init
+            self.iload_odd = [np.ascontiguousarray(iload.T, dtype=np.int32) for iload in self.iload_odd] #pylint: disable=attribute-defined-outside-init
 
     #pylint: disable=too-many-locals
     def prepare_rhs(self, simulation):
@@ -187,6 +451,7 @@ class BoundaryMethod:
             simulation class
 
         """
+        from .symbolic import getargspec
 
         nv = simulation._m.nv
         sorder = simulation._m.sorder
@@ -195,6 +460,20 @@ class BoundaryMethod:
 
         gpu_support = True if self.backend == "LOOPY" else False
 
+        # the equilibrium of all the members of an ensemble
+        self.feq = np.zeros((nv, self.istore.shape[1]))
+
+        # the additional terms have the type of the distribution functions
+        dtype = simulation._F.array.dtype
+        self.rhs = self.rhs.astype(dtype)
+        if hasattr(self, 's'):
+            self.s = self.s.astype(dtype) #pylint: disable=attribute-defined-outside-init
+
+        # the velocities of the conditions of one member of an ensemble
+        self._kstore = self.istore[0].copy()
+        self._values = {}
+        self._values_functions = {}
+        self.time_dependent = []
         for key, value in self.value_bc.items():
             if value is not None:
                 indices = np.where(self.ilabel == key)
@@ -208,50 +487,249 @@ class BoundaryMethod:
                     x = simulation.domain.coords_halo[i][self.istore[i + 1, indices]]
                     x += s*v[k, i]*simulation.domain.dx
                     x = x.ravel()
-                    for j in range(1, simulation.domain.dim): #pylint: disable=unused-variable
+                    for j in range(1, len(nspace)): #pylint: disable=unused-variable
                         x = x[:, np.newaxis]
                     coords += (x,)
 
-                m = Array(nv, nspace, 0, sorder, gpu_support=gpu_support)
-                m.set_conserved_moments(simulation.scheme.consm)
+                # the arrays are kept to evaluate again the values which depend on the time
+                m = Array(nv, nspace, 0, sorder, dtype=simulation._m.array.dtype, gpu_support=gpu_support)
+                m.set_conserved_moments(simulation._m.consm)
 
-                f = Array(nv, nspace, 0, sorder, gpu_support=gpu_support)
-                f.set_conserved_moments(simulation.scheme.consm)
+                f = Array(nv, nspace, 0, sorder, dtype=dtype, gpu_support=gpu_support)
+                f.set_conserved_moments(simulation._m.consm)
 
                 #TODO add error message and more tests
-                if isinstance(value, types.FunctionType):
-                    value(f, m, *coords)
-                elif isinstance(value, tuple):
-                    if len(value) != 2:
-                        log.error("""Function set in boundary must be the function name or a tuple
-                                       of size 2 with function name and extra args.""")
-                    args = coords + value[1]
-                    value[0](f, m, *args)
-                simulation.scheme.equilibrium(m)
-                simulation.scheme.m2f(m, f)
-
-                if self.backend.upper() == "LOOPY":
-                    f.array_cpu[...] = f.array.get()
-                self.feq[:, indices[0]] = f.swaparray.reshape((nv, indices[0].size))
-
-    def _get_istore_iload_symb(self, dim):
+                if isinstance(value, tuple) and len(value) != 2:
+                    log.error("""Function set in boundary must be the function name or a tuple
+                                   of size 2 with function name and extra args.""")
+                if isinstance(value, dict):
+                    value, time_dependent = self._lambdify_values(value, simulation.scheme, simulation.domain.dim)
+                    if time_dependent:
+                        self.time_dependent.append(key)
+                    if key in self._values_names and nv == self.stencil.nv_ptr[-1]:
+                        self._values_functions[key] = (getattr(generator.module, self._values_names[key]),
+                                                       np.empty((nv, indices[0].size), dtype=dtype),
+                                                       {'xb{}'.format(d): np.ascontiguousarray(x.ravel(), dtype=dtype)
+                                                        for d, x in enumerate(coords)})
+                else:
+                    function = value[0] if isinstance(value, tuple) else value
+                    if 't' in getargspec(function).args:
+                        self.time_dependent.append(key)
+                self._values[key] = (indices[0], coords, m, f, value)
+                self._set_feq(key, simulation.scheme, simulation.t)
+
+    @staticmethod
+    def _lambdify_values(value, scheme, dim):
+        """
+        return the numpy functions of the coordinates and of the time
+        which compute the moments given by the sympy expressions of value
+        and True if one of them depends on the time.
+        """
+        from .scheme import param_to_tuple
+
+        pk, pv = param_to_tuple(scheme.param)
+        space = symbols('x, y, z')[:dim]
+        variables = list(space) + [scheme.symb_t]
+        functions = {}
+        time_dependent = False
+        for moment, expr in value.items():
+            expr = sp.sympify(expr).subs(list(zip(pk, pv)))
+            # the space variables are found by their names
+            expr = expr.subs([(symb, space['xyz'.index(symb.name)]) for symb in expr.free_symbols
+                              if symb.name in 'xyz'[:dim]])
+            time_dependent |= scheme.symb_t in expr.free_symbols
+            functions[moment] = sp.lambdify(variables, expr, 'numpy')
+        return functions, time_dependent
+
+    def _set_feq(self, key, scheme, t):
+        """
+        compute the equilibrium on the border of the label key at the time t
+        in the arrays built by prepare_rhs.
+        """
+        indices, coords, m, f, value = self._values[key]
+        nv = m.nv
+
+        function = self._values_functions.get(key, None)
+        if function is not None:
+            # the generated function computes the equilibrium on the border
+            from .symbolic import bind_genfunction
+            feq, xb = function[1:]
+            args = {'feq': feq, 't': t, 'ncond': indices.size}
+            args.update(xb)
+            bind_genfunction(function[0], args)()
+            self.feq[:, indices] = feq
+            return
+
+        m.array[...] = 0
+        if isinstance(value, types.FunctionType):
+            args = coords
+            function = value
+        elif isinstance(value, dict):
+            for moment, func in value.items():
+                m[moment] = func(*(coords + (t,)))
+            function = None
+        elif isinstance(value, tuple):
+            args = coords + value[1]
+            function = value[0]
+        if function is not None:
+            if key in self.time_dependent:
+                function(f, m, *args, t=t)
+            else:
+                function(f, m, *args)
+        scheme.equilibrium(m)
+        scheme.m2f(m, f)
+
+        if self.backend.upper() == "LOOPY":
+            f.array_cpu[...] = f.array.get()
+        self.feq[:, indices] = f.swaparray.reshape((nv, indices.size))
+
+    def generate_values(self, scheme, dim):
+        """
+        Generate the functions which compute the equilibrium on the border
+        of the labels whose value is given by sympy expressions.
+
+        Parameters
+        ----------
+        scheme : Scheme
+            the scheme of the simulation
+        dim : int
+            the spatial dimension
+        """
+        from .generator import For
+        from .scheme import param_to_tuple
+        from .symbolic import ix
+
+        self._values_names = {}
+        if self.backend.upper() not in ['CYTHON', 'CYTHON_OMP']:
+            return
+        pk, pv = param_to_tuple(scheme.param)
+        ns = int(self.stencil.nv_ptr[-1])
         ncond = symbols('ncond', integer=True)
+        idx = Idx(ix, (0, ncond))
+        feq = IndexedBase('feq', [ns, ncond])
+        t = symbols('t')
+        space = {name: IndexedBase('xb{}'.format(d), [ncond])[idx] for d, name in enumerate('xyz'[:dim])}
+        for key, value in self.value_bc.items():
+            if not isinstance(value, dict):
+                continue
+            # the equilibrium computed from the conserved moments on the border
+            subs = [(moment, sp.sympify(value.get(moment, 0)))
+                    for moment in scheme.consm]
+            eq = (scheme.invM*scheme.EQ.subs(subs, simultaneous=True)).subs(list(zip(pk, pv)))
+            eq = eq.subs([(symb, space[symb.name]) for symb in eq.free_symbols if symb.name in space])
+            eq = eq.subs(scheme.symb_t, t)
+            if not eq.free_symbols:
+                # the constant values are computed once by prepare_rhs
+                continue
+            name = 'feq_{}_{}'.format(self.__class__.__name__, int(key))
+            generator.add_routine((name, For(idx, Eq(sp.Matrix([feq[k, idx] for k in range(ns)]), eq))))
+            self._values_names[key] = name
+
+    def update_rhs(self, scheme, t, nt):
+        """
+        Evaluate again the values which depend on the time
+        and update the additional terms in place.
+
+        Parameters
+        ----------
+        scheme : Scheme
+            the scheme of the simulation
+        t : double
+            the time
+        nt : int
+            the number of the time step: the value of a label is evaluated
+            every update_every time steps
+
+        Returns
+        -------
+        bool
+            True if the additional terms are modified
+        """
+        labels = [key for key in self.time_dependent if nt % self.update_every[key] == 0]
+        for key in labels:
+            self._set_feq(key, scheme, t)
+        if labels:
+            self._set_rhs_members()
+        return len(labels) > 0
+
+    def _set_rhs_members(self):
+        """
+        compute the additional terms of each member of an ensemble
+        in the parts of rhs with the method set_rhs.
+        """
+        ns = self.stencil.nv_ptr[-1]
+        ncond = self._kstore.size
+        feq, rhs, istore = self.feq, self.rhs, self.istore
+        self.istore = self._kstore[np.newaxis, :]
+        for b in range(self._nmembers):
+            self.feq = feq[b*ns:(b + 1)*ns]
+            self.rhs = rhs[b*ncond:(b + 1)*ncond]
+            self.set_rhs() #pylint: disable=no-member
+        self.feq, self.rhs, self.istore = feq, rhs, istore
+
+    def set_members(self, nmembers):
+        """
+        Replicate the conditions for each member of an ensemble.
 
-        istore = symbols('istore', integer=True)
+        The distribution functions of the member b follow the ones
+        of the previous members: the velocity indices of istore and iload
+        are shifted by b times the number of velocities and the additional
+        terms are computed with the equilibrium of the member b.
+        Must be called after prepare_rhs.
+
+        Parameters
+        ----------
+        nmembers : int
+            the number of members of the ensemble
+        """
+        ns = self.stencil.nv_ptr[-1]
+        istore = []
+        iload = [[] for _ in self.iload]
+        shift = np.zeros((self.istore.shape[0], 1), dtype=self.istore.dtype)
+        for b in range(nmembers):
+            shift[0] = b*ns
+            istore.append(self.istore + shift)
+            for i, il in enumerate(self.iload):
+                iload[i].append(il + shift)
+        self._nmembers = nmembers
+        self.rhs = np.tile(self.rhs, nmembers)
+        self._set_rhs_members()
+        self.istore = np.concatenate(istore, axis=1)
+        self.iload = [np.concatenate(il, axis=1) for il in iload]
+        self.ilabel = np.tile(self.ilabel, nmembers)
+        self.distance = np.tile(self.distance, nmembers)
+        if hasattr(self, 's'):
+            self.s = np.tile(self.s, nmembers) #pylint: disable=attribute-defined-outside-init
+
+    def _get_istore_iload_symb(self, dim, suffix=''):
+        ncond = symbols('ncond' + suffix, integer=True)
+
+        istore = symbols('istore' + suffix, integer=True)
         istore = IndexedBase(istore, [ncond, dim+1])
 
         iload = []
         for i in range(len(self.iload)):
-            iloads = symbols('iload%d'%i, integer=True)
+            iloads = symbols('iload%d'%i + suffix, integer=True)
             iload.append(IndexedBase(iloads, [ncond, dim+1]))
         return istore, iload, ncond
 
     @staticmethod
-    def _get_rhs_dist_symb(ncond):
-        rhs = IndexedBase('rhs', [ncond])
-        dist = IndexedBase('dist', [ncond])
+    def _get_rhs_dist_symb(ncond, suffix=''):
+        rhs = IndexedBase('rhs' + suffix, [ncond])
+        dist = IndexedBase('dist' + suffix, [ncond])
         return rhs, dist
 
+    def generate(self, sorder):
+        """
+        Generate the numerical code.
+
+        Parameters
+        ----------
+        sorder : list
+            the order of nv, nx, ny and nz
+        """
+        generator.add_routine((self.routine_name, self.loop(sorder))) #pylint: disable=no-member
+
     def update(self, ff):
         """
         Update distribution functions with this boundary condition.
@@ -262,31 +740,69 @@ class BoundaryMethod:
         ff : array
             The distribution functions
         """
-        from .symbolic import call_genfunction
+        self.bind(ff)()
 
-        args = self._get_args(ff)
-        call_genfunction(self.function, args) #pylint: disable=no-member
+    def bind(self, ff, conditions=None, parity=None):
+        """
+        Return the function which updates the distribution functions
+        with this boundary condition with all its arguments set.
 
-    #pylint: disable=possibly-unused-variable
-    def _get_args(self, ff):
-        dim = len(ff.nspace)
-        nx = ff.nspace[0]
-        if dim > 1:
-            ny = ff.nspace[1]
-        if dim > 2:
-            nz = ff.nspace[2]
+        Parameters
+        ----------
 
-        f = ff.array
+        ff : array
+            The distribution functions
+        conditions : ndarray, optional
+            the indices of the conditions applied by the function
+            (default is None which means all the conditions)
+        parity : str, optional
+            'odd' if the function is called before an odd step of the
+            in-place transport: the indices computed by
+            :py:meth:`set_inplace<pylbm.boundary.BoundaryMethod.set_inplace>`
+            are used (default is None)
+        """
+        from .symbolic import bind_genfunction
 
-        for i in range(len(self.iload)):
-            exec('iload{i} = self.iload[{i}]'.format(i=i)) #pylint: disable=exec-used
+        return bind_genfunction(self.function, self.get_args(ff, conditions, parity)) #pylint: disable=no-member
+
+    def get_args(self, ff, conditions=None, parity=None):
+        """
+        Return the arguments of the generated function of this
+        boundary condition (see :py:meth:`bind<pylbm.boundary.BoundaryMethod.bind>`).
 
-        istore = self.istore
-        rhs = self.rhs
+        Returns
+        -------
+        dict
+            the arguments (name: value)
+        """
+        args = self._get_args(ff)
+        if parity == 'odd':
+            args['istore'] = self.istore_odd
+            for i, iload in enumerate(self.iload_odd):
+                args['iload{}'.format(i)] = iload
+        if conditions is not None:
+            for name in ['istore', 'rhs', 'dist'] + ['iload{}'.format(i) for i in range(len(self.iload))]:
+                if name in args:
+                    args[name] = np.ascontiguousarray(args[name][conditions])
+            args['ncond'] = conditions.size
+        return args
+
+    def _get_args(self, ff):
+        args = {'nx': ff.nspace[0],
+                'f': ff.array,
+                'istore': self.istore,
+                'rhs': self.rhs,
+                'ncond': self.istore.shape[0],
+               }
+        if len(ff.nspace) > 1:
+            args['ny'] = ff.nspace[1]
+        if len(ff.nspace) > 2:
+            args['nz'] = ff.nspace[2]
+        for i, iload in enumerate(self.iload):
+            args['iload{}'.format(i)] = iload
         if hasattr(self, 's'):
-            dist = self.s
-        ncond = istore.shape[0]
-        return locals()
+            args['dist'] = self.s
+        return args
 
     def move2gpu(self):
         """
@@ -317,6 +833,8 @@ class BounceBack(BoundaryMethod):
     .. plot:: codes/bounce_back.py
 
     """
+    routine_name = 'bounce_back'
+
     def set_iload(self):
         """
         Compute the indices that are needed (symmertic velocities and space indices).
@@ -325,7 +843,7 @@ class BounceBack(BoundaryMethod):
         ksym = self.stencil.get_symmetric()[k][np.newaxis, :]
         v = self.stencil.get_all_velocities()
         indices = self.istore[1:] + v[k].T
-        self.iload.append(np.concatenate([ksym, indices]))
+        self.iload.append(np.concatenate([ksym, indices]).astype(np.int32))
 
     def set_rhs(self):
         """
@@ -336,29 +854,32 @@ class BounceBack(BoundaryMethod):
         self.rhs[:] = self.feq[k, np.arange(k.size)] - self.feq[ksym, np.arange(k.size)]
 
     #pylint: disable=too-many-locals
-    def generate(self, sorder):
+    def loop(self, sorder, suffix=''):
         """
-        Generate the numerical code.
+        Return the loop over the conditions.
 
         Parameters
         ----------
         sorder : list
             the order of nv, nx, ny and nz
+        suffix : str, optional
+            the suffix of the names of the arguments (default is '')
         """
         from .generator import For
-        from .symbolic import nx, ny, nz, indexed, ix
+        from .symbolic import nx, ny, nz, indexed
 
         ns = int(self.stencil.nv_ptr[-1])
-        dim = self.stencil.dim
+        dim = len(sorder) - 1
 
-        istore, iload, ncond = self._get_istore_iload_symb(dim)
-        rhs, _ = self._get_rhs_dist_symb(ncond)
+        istore, iload, ncond = self._get_istore_iload_symb(dim, suffix)
+        rhs, _ = self._get_rhs_dist_symb(ncond, suffix)
 
+        ix = symbols('ix' + suffix, integer=True)
         idx = Idx(ix, (0, ncond))
         fstore = indexed('f', [ns, nx, ny, nz], index=[istore[idx, k] for k in range(dim+1)], permutation=sorder)
         fload = indexed('f', [ns, nx, ny, nz], index=[iload[0][idx, k] for k in range(dim+1)], permutation=sorder)
 
-        generator.add_routine(('bounce_back', For(idx, Eq(fstore, fload + rhs[ix]))))
+        return For(idx, Eq(fstore, fload + rhs[ix]))
 
     @property
     def function(self):
@@ -375,6 +896,8 @@ class BouzidiBounceBack(BoundaryMethod):
     .. plot:: codes/Bouzidi.py
 
     """
+    routine_name = 'Bouzidi_bounce_back'
+
     def __init__(self, istore, ilabel, distance, stencil, value_bc, nspace, backend):
         super(BouzidiBounceBack, self).__init__(istore, ilabel, distance, stencil, value_bc, nspace, backend)
         self.s = np.empty(self.istore.shape[1])
@@ -387,8 +910,8 @@ class BouzidiBounceBack(BoundaryMethod):
         ksym = self.stencil.get_symmetric()[k]
         v = self.stencil.get_all_velocities()
 
-        iload1 = np.zeros(self.istore.shape, dtype=np.int)
-        iload2 = np.zeros(self.istore.shape, dtype=np.int)
+        iload1 = np.zeros(self.istore.shape, dtype=np.int32)
+        iload2 = np.zeros(self.istore.shape, dtype=np.int32)
 
         mask = self.distance < .5
         iload1[0, mask] = ksym[mask]
@@ -416,30 +939,33 @@ class BouzidiBounceBack(BoundaryMethod):
         self.rhs[:] = self.feq[k, np.arange(k.size)] - self.feq[ksym, np.arange(k.size)]
 
     #pylint: disable=too-many-locals
-    def generate(self, sorder):
+    def loop(self, sorder, suffix=''):
         """
-        Generate the numerical code.
+        Return the loop over the conditions.
 
         Parameters
         ----------
         sorder : list
             the order of nv, nx, ny and nz
+        suffix : str, optional
+            the suffix of the names of the arguments (default is '')
         """
         from .generator import For
-        from .symbolic import nx, ny, nz, indexed, ix
+        from .symbolic import nx, ny, nz, indexed
 
         ns = int(self.stencil.nv_ptr[-1])
-        dim = self.stencil.dim
+        dim = len(sorder) - 1
 
-        istore, iload, ncond = self._get_istore_iload_symb(dim)
-        rhs, dist = self._get_rhs_dist_symb(ncond)
+        istore, iload, ncond = self._get_istore_iload_symb(dim, suffix)
+        rhs, dist = self._get_rhs_dist_symb(ncond, suffix)
 
+        ix = symbols('ix' + suffix, integer=True)
         idx = Idx(ix, (0, ncond))
         fstore = indexed('f', [ns, nx, ny, nz], index=[istore[idx, k] for k in range(dim+1)], permutation=sorder)
         fload0 = indexed('f', [ns, nx, ny, nz], index=[iload[0][idx, k] for k in range(dim+1)], permutation=sorder)
         fload1 = indexed('f', [ns, nx, ny, nz], index=[iload[1][idx, k] for k in range(dim+1)], permutation=sorder)
 
-        generator.add_routine(('Bouzidi_bounce_back', For(idx, Eq(fstore, dist[idx]*fload0 + (1-dist[idx])*fload1 + rhs[idx]))))
+        return For(idx, Eq(fstore, dist[idx]*fload0 + (1-dist[idx])*fload1 + rhs[idx]))
 
     @property
     def function(self):
@@ -456,6 +982,8 @@ class AntiBounceBack(BounceBack):
     .. plot:: codes/anti_bounce_back.py
 
     """
+    routine_name = 'anti_bounce_back'
+
     def set_rhs(self):
         """
         Compute and set the additional terms to fix the boundary values.
@@ -465,29 +993,32 @@ class AntiBounceBack(BounceBack):
         self.rhs[:] = self.feq[k, np.arange(k.size)] + self.feq[ksym, np.arange(k.size)]
 
     #pylint: disable=too-many-locals
-    def generate(self, sorder):
+    def loop(self, sorder, suffix=''):
         """
-        Generate the numerical code.
+        Return the loop over the conditions.
 
         Parameters
         ----------
         sorder : list
             the order of nv, nx, ny and nz
+        suffix : str, optional
+            the suffix of the names of the arguments (default is '')
         """
         from .generator import For
-        from .symbolic import nx, ny, nz, indexed, ix
+        from .symbolic import nx, ny, nz, indexed
 
         ns = int(self.stencil.nv_ptr[-1])
-        dim = self.stencil.dim
+        dim = len(sorder) - 1
 
-        istore, iload, ncond = self._get_istore_iload_symb(dim)
-        rhs, _ = self._get_rhs_dist_symb(ncond)
+        istore, iload, ncond = self._get_istore_iload_symb(dim, suffix)
+        rhs, _ = self._get_rhs_dist_symb(ncond, suffix)
 
+        ix = symbols('ix' + suffix, integer=True)
         idx = Idx(ix, (0, ncond))
         fstore = indexed('f', [ns, nx, ny, nz], index=[istore[idx, k] for k in range(dim+1)], permutation=sorder)
         fload = indexed('f', [ns, nx, ny, nz], index=[iload[0][idx, k] for k in range(dim+1)], permutation=sorder)
 
-        generator.add_routine(('anti_bounce_back', For(idx, Eq(fstore, -fload + rhs[idx]))))
+        return For(idx, Eq(fstore, -fload + rhs[idx]))
 
     @property
     def function(self):
@@ -503,6 +1034,8 @@ class BouzidiAntiBounceBack(BouzidiBounceBack):
     .. plot:: codes/Bouzidi.py
 
     """
+    routine_name = 'Bouzidi_anti_bounce_back'
+
     def set_rhs(self):
         """
         Compute and set the additional terms to fix the boundary values.
@@ -512,30 +1045,33 @@ class BouzidiAntiBounceBack(BouzidiBounceBack):
         self.rhs[:] = self.feq[k, np.arange(k.size)] + self.feq[ksym, np.arange(k.size)]
 
     #pylint: disable=too-many-locals
-    def generate(self, sorder):
+    def loop(self, sorder, suffix=''):
         """
-        Generate the numerical code.
+        Return the loop over the conditions.
 
         Parameters
         ----------
         sorder : list
             the order of nv, nx, ny and nz
+        suffix : str, optional
+            the suffix of the names of the arguments (default is '')
         """
         from .generator import For
-        from .symbolic import nx, ny, nz, indexed, ix
+        from .symbolic import nx, ny, nz, indexed
 
         ns = int(self.stencil.nv_ptr[-1])
-        dim = self.stencil.dim
+        dim = len(sorder) - 1
 
-        istore, iload, ncond = self._get_istore_iload_symb(dim)
-        rhs, dist = self._get_rhs_dist_symb(ncond)
+        istore, iload, ncond = self._get_istore_iload_symb(dim, suffix)
+        rhs, dist = self._get_rhs_dist_symb(ncond, suffix)
 
+        ix = symbols('ix' + suffix, integer=True)
         idx = Idx(ix, (0, ncond))
         fstore = indexed('f', [ns, nx, ny, nz], index=[istore[idx, k] for k in range(dim+1)], permutation=sorder)
         fload0 = indexed('f', [ns, nx, ny, nz], index=[iload[0][idx, k] for k in range(dim+1)], permutation=sorder)
         fload1 = indexed('f', [ns, nx, ny, nz], index=[iload[1][idx, k] for k in range(dim+1)], permutation=sorder)
 
-        generator.add_routine(('Bouzidi_anti_bounce_back', For(idx, Eq(fstore, -dist[idx]*fload0 + (1-dist[idx])*fload1 + rhs[idx]))))
+        return For(idx, Eq(fstore, -dist[idx]*fload0 + (1-dist[idx])*fload1 + rhs[idx]))
 
     @property
     def function(self):
@@ -546,6 +1082,8 @@ class Neumann(BoundaryMethod):
     Boundary condition of type Neumann
 
     """
+    routine_name = 'neumann'
+
     def set_rhs(self):
         """
         Compute and set the additional terms to fix the boundary values.
@@ -559,31 +1097,34 @@ class Neumann(BoundaryMethod):
         k = self.istore[0]
         v = self.stencil.get_all_velocities()
         indices = self.istore[1:] + v[k].T
-        self.iload.append(np.concatenate([k[np.newaxis, :], indices]))
+        self.iload.append(np.concatenate([k[np.newaxis, :], indices]).astype(np.int32))
 
     #pylint: disable=too-many-locals
-    def generate(self, sorder):
+    def loop(self, sorder, suffix=''):
         """
-        Generate the numerical code.
+        Return the loop over the conditions.
 
         Parameters
         ----------
         sorder : list
             the order of nv, nx, ny and nz
+        suffix : str, optional
+            the suffix of the names of the arguments (default is '')
         """
         from .generator import For
-        from .symbolic import nx, ny, nz, indexed, ix
+        from .symbolic import nx, ny, nz, indexed
 
         ns = int(self.stencil.nv_ptr[-1])
-        dim = self.stencil.dim
+        dim = len(sorder) - 1
 
-        istore, iload, ncond = self._get_istore_iload_symb(dim)
+        istore, iload, ncond = self._get_istore_iload_symb(dim, suffix)
 
+        ix = symbols('ix' + suffix, integer=True)
         idx = Idx(ix, (0, ncond))
         fstore = indexed('f', [ns, nx, ny, nz], index=[istore[idx, k] for k in range(dim+1)], permutation=sorder)
         fload = indexed('f', [ns, nx, ny, nz], index=[iload[0][idx, k] for k in range(dim+1)], permutation=sorder)
 
-        generator.add_routine(('neumann', For(idx, Eq(fstore, fload))))
+        return For(idx, Eq(fstore, fload))
 
     @property
     def function(self):
@@ -603,7 +1144,7 @@ class NeumannX(Neumann):
         v = self.stencil.get_all_velocities()
         indices = self.istore[1:].copy()
         indices[0] += v[k].T[0]
-        self.iload.append(np.concatenate([k[np.newaxis, :], indices]))
+        self.iload.append(np.concatenate([k[np.newaxis, :], indices]).astype(np.int32))
 
 class NeumannY(Neumann):
     """
@@ -618,7 +1159,7 @@ class NeumannY(Neumann):
         v = self.stencil.get_all_velocities()
         indices = self.istore[1:].copy()
         indices[1] += v[k].T[1]
-        self.iload.append(np.concatenate([k[np.newaxis, :], indices]))
+        self.iload.append(np.concatenate([k[np.newaxis, :], indices]).astype(np.int32))
 
 class NeumannZ(Neumann):
     """
@@ -633,4 +1174,4 @@ class NeumannZ(Neumann):
         v = self.stencil.get_all_velocities()
         indices = self.istore[1:].copy()
         indices[1] += v[k].T[2]
-        self.iload.append(np.concatenate([k[np.newaxis, :], indices]))
+        self.iload.append(np.concatenate([k[np.newaxis, :], indices]).astype(np.int32))
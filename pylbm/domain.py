@@ -446,6 +446,69 @@ class Domain:
         labels = np.unique(self.box_label)
         return np.union1d(labels, self.geom.list_of_elements_labels())
 
+    def get_fluid_cells(self):
+        """
+        Get the indices of the interior points which are in the fluid part.
+
+        The indices are given in the whole domain with the halo points
+        and are sorted with the x index varying the slowest.
+
+        Returns
+        -------
+
+        ndarray
+            an integer array of shape (number of fluid points, dim)
+
+        """
+        halo_size = np.asarray(self.stencil.vmax, dtype=np.int32)
+        phys_domain = tuple([slice(h, -h) for h in halo_size])
+        cells = np.argwhere(self.in_or_out[phys_domain] == self.valin) + halo_size
+        return np.ascontiguousarray(cells, dtype=np.int32)
+
+    def get_sparse_cells(self, extra_cells=None):
+        """
+        Get the points which must be stored by a sparse storage.
+
+        These are the interior fluid points, the points used by the
+        transport phase on the fluid points, the points given by extra_cells
+        and the periodic images of the fictitious points among them.
+
+        Parameters
+        ----------
+
+        extra_cells : ndarray, optional
+            the indices of other points which must be stored
+            (the points used by the boundary conditions),
+            array of shape (number of points, dim)
+
+        Returns
+        -------
+
+        ndarray
+            the indices of the points, array of shape (number of points, dim)
+            where the fluid points are first
+        int
+            the number of fluid points
+
+        """
+        fluid = self.get_fluid_cells()
+        shape = np.asarray(self.shape_halo)
+        halo_size = np.asarray(self.stencil.vmax, dtype=np.int32)
+        v = self.stencil.get_all_velocities()
+
+        others = [(fluid[:, np.newaxis, :] - v[np.newaxis, :, :]).reshape((-1, self.dim))]
+        if extra_cells is not None:
+            others.append(np.asarray(extra_cells).reshape((-1, self.dim)))
+        others = np.concatenate(others).astype(np.int32)
+        images = (others - halo_size) % (shape - 2*halo_size) + halo_size
+
+        mask = np.zeros(shape, dtype=bool)
+        mask[tuple(others.T)] = True
+        mask[tuple(images.T)] = True
+        mask[tuple(fluid.T)] = False
+        cells = np.concatenate([fluid, np.argwhere(mask)])
+        return np.ascontiguousarray(cells, dtype=np.int32), fluid.shape[0]
+
     #pylint: disable=too-many-locals, too-many-branches, too-many-nested-blocks, too-many-statements
     def visualize(self,
                   viewer_app=viewer.matplotlib_viewer,
@@ -0,0 +1,150 @@
+# Authors:
+#     Loic Gouarin <loic.gouarin@polytechnique.edu>
+#     Benjamin Graille <benjamin.graille@math.u-psud.fr>
+#
+# License: BSD 3 clause
+
+"""
+pylbm ensemble of simulations
+"""
+
+import sys
+import logging
+import numpy as np
+import sympy as sp
+
+from .simulation import Simulation
+
+log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+class Ensemble(Simulation):
+    """
+    create an ensemble of simulations which only differ by the values
+    of their parameters or by their initial conditions
+
+    The domain, the boundary conditions and the generated code are built once
+    and all the members are computed together by each generated function.
+
+    Parameters
+    ----------
+
+    dico : dictionary
+      the dictionary of the simulation: the values of the key 'parameters'
+      are the default values of the members
+    members : list of dictionaries
+      the description of each member with the optional `key:value`
+
+      - parameters : dictionary of the values of the parameters of this member
+      - init : dictionary of the initial conditions of this member
+        (same format as the key 'init' of the schemes)
+
+    sorder : list, optional
+      the storage order
+    dtype : optional argument 'float64' or 'float32' (default value is 'float64')
+    check_inverse : bool, optional
+    moments_dtype : optional argument 'float64' or 'float32'
+      (see :py:class:`Simulation<pylbm.simulation.Simulation>`)
+
+    Attributes
+    ----------
+
+    nmembers : int
+      the number of members
+    member_parameters : dict
+      the values of the parameters of each member:
+      the keys are the symbols and the values the arrays of size nmembers
+
+    and the attributes of :py:class:`Simulation<pylbm.simulation.Simulation>`
+
+    Notes
+    -----
+
+    The relaxation parameters can differ between the members
+    if they are defined with symbols of the key 'parameters'.
+    The scheme velocity and the space step must be the same
+    for all the members since they share the time step, as well as
+    the parameters of the polynomials since they share the moments matrices.
+
+    The distribution functions and the moments of the member b
+    are stored after the ones of the previous members along the axis
+    of the velocities: the conserved moments get an additional first
+    axis for the members.
+
+    Only the Cython generators are available.
+
+    Examples
+    --------
+
+    >>> ens = Ensemble(dico, [{'parameters': {s1: 1.5}}, {'parameters': {s1: 1.8}}])
+    >>> ens.run(100)
+    >>> ens.m[rho][1]
+
+    returns the density of the second member.
+    """
+    def __init__(self, dico, members, sorder=None, dtype='float64', check_inverse=False,
+                 moments_dtype=None):
+        self.nmembers = len(members)
+        if self.nmembers == 0:
+            log.error('Ensemble: the list of members is empty')
+            sys.exit()
+
+        generator = dico.get('generator', "CYTHON").upper()
+        if generator not in ['CYTHON', 'CYTHON_OMP']:
+            log.error('Ensemble: only the Cython generators are available')
+            sys.exit()
+
+        param = dico.get('parameters', None)
+        param = {} if param is None else param
+        # the parameters of the moments matrices are substituted by the scheme
+        shared = [dico.get('scheme_velocity', None), dico.get('space_step', None)]
+        for scheme in dico['schemes']:
+            for p in scheme.get('polynomials', []):
+                shared += list(sp.sympify(p).free_symbols)
+        names = []
+        for member in members:
+            for k in member.get('parameters', {}):
+                if k not in param:
+                    log.error("Ensemble: the parameter %s is not in the key 'parameters'", k)
+                    sys.exit()
+                if k in shared:
+                    log.error('Ensemble: the parameter %s must be the same for all the members', k)
+                    sys.exit()
+                if k not in names:
+                    names.append(k)
+
+        self.members = members
+        self.member_parameters = {k: np.array([float(m.get('parameters', {}).get(k, param[k])) for m in members],
+                                              dtype=dtype)
+                                  for k in names}
+        self._member_parameters = self.member_parameters
+
+        super(Ensemble, self).__init__(dico, sorder=sorder, dtype=dtype, check_inverse=check_inverse,
+                                       moments_dtype=moments_dtype)
+
+    def _get_conserved_moments(self):
+        """
+        return the indices of the conserved moments of all the members.
+        """
+        ns = self.scheme.stencil.nv_ptr[-1]
+        return {k: [v + b*ns for b in range(self.nmembers)] for k, v in self.scheme.consm.items()}
+
+    def _get_initial_values(self):
+        """
+        return the pairs (index in the array to initialize, initial value)
+        of all the members.
+        """
+        ns = self.scheme.stencil.nv_ptr[-1]
+        values = []
+        for b, member in enumerate(self.members):
+            init = dict(self.scheme.init)
+            if 'init' in member:
+                init.update(self.scheme.set_initialization([{'init': member['init']}]))
+            values += [(k + b*ns, v) for k, v in init.items()]
+        return values
+
+    def __str__(self):
+        s = super(Ensemble, self).__str__()
+        s += "Ensemble of {0:d} members\n".format(self.nmembers)
+        for k, v in self.member_parameters.items():
+            s += "\t {0}: {1}\n".format(k, v)
+        return s
@@ -5,9 +5,11 @@ import sys
 import os
 import shutil
 import tempfile
+from importlib.machinery import EXTENSION_SUFFIXES
 from subprocess import STDOUT, CalledProcessError, check_output
 
 from .codegen import get_code_generator
+from .cache import cache_key, load_module, get_module_cache
 
 class CodeWrapError(Exception):
     pass
@@ -17,29 +19,59 @@ class CodeWrapper(object):
     """Base Class for code wrappers"""
     _module_name = "wrapped_module"
     _module_counter = 0
+    _module_extension = None
 
     @property
     def filename(self):
-        return "%s_%s" % (self._module_name, CodeWrapper._module_counter)
+        return self.module_name
 
     @property
     def module_name(self):
+        if self.key is not None:
+            return "%s_%s" % (self._module_name, self.key[:16])
         return "%s_%s" % (self._module_name, CodeWrapper._module_counter)
 
-    def __init__(self, generator, filepath=None, flags=[], verbose=False):
+    def __init__(self, generator, filepath=None, flags=[], verbose=False, cache=None):
         """
         generator -- the code generator to use
+        cache -- the ModuleCache where the built modules are stored
         """
         self.generator = generator
         self.filepath = filepath
         self.flags = flags
         self.verbose = verbose
+        self.cache = cache
+        self.key = None
+
+    @property
+    def build_flags(self):
+        """flags used to build the module (part of the cache key)"""
+        return list(self.flags)
 
     def _generate_code(self, routines):
-        self.generator.write(
-            routines, self.filename, True, True, False)
+        return self.generator.write(
+            routines, self._module_name, False, True, False)[0][1]
+
+    def _module_files(self, workdir):
+        """return the files of the built module in workdir"""
+        return [os.path.join(workdir, f) for f in os.listdir(workdir)
+                if f.split('.')[0] == self.module_name and f.endswith(self._module_extension)]
 
     def wrap_code(self, routines):
+        source = self._generate_code(routines)
+        self.key = cache_key(source, self.generator.__class__.__name__, self.build_flags)
+
+        # the same module is already imported
+        if self.module_name in sys.modules:
+            return sys.modules[self.module_name]
+
+        if self.cache is not None:
+            path = self.cache.lookup(self.key, self.module_name)
+            if path is not None:
+                if self.verbose:
+                    print(source)
+                return load_module(self.module_name, path)
+
         workdir = self.filepath or tempfile.mkdtemp("_sympy_compile")
         if not os.access(workdir, os.F_OK):
             os.mkdir(workdir)
@@ -49,9 +81,12 @@ class CodeWrapper(object):
         try:
             sys.path.append(workdir)
             self._prepare_files(routines)
-            self._generate_code(routines)
+            with open("%s.%s" % (self.filename, self.generator.code_extension), "w") as f:
+                f.write(source)
             self._process_files(routines)
             mod = __import__(self.module_name)
+            if self.cache is not None:
+                self.cache.store(self.key, self._module_files(workdir))
         finally:
             sys.path.remove(workdir)
             CodeWrapper._module_counter += 1
@@ -80,6 +115,14 @@ class CodeWrapper(object):
 
 
 class CythonCodeWrapper(CodeWrapper):
+    _module_extension = tuple(EXTENSION_SUFFIXES)
+    compile_args = ['-O3', '-w']
+    link_args = []
+
+    @property
+    def build_flags(self):
+        return self.compile_args + self.link_args + list(self.flags)
+
     @property
     def command(self):
         bld = open(self.filename + '.pyxbld', "w")
@@ -89,13 +132,10 @@ def make_ext(modname, pyxfilename):
 
     return Extension(name = modname,
                      sources=[pyxfilename],
-                     #extra_compile_args = ['-O3', '-fopenmp, '-w'],
-                     #extra_link_args= ['-fopenmp'])
-                     extra_compile_args = ['-O3', '-w']
-                     #extra_compile_args = ['-O3', '-fopenmp', '-w'],
-                     #extra_link_args= ['-fopenmp'])
+                     extra_compile_args = {compile_args},
+                     extra_link_args = {link_args}
                     )
-                    """
+                    """.format(compile_args=self.compile_args, link_args=self.link_args)
         bld.write(code)
         bld.close()
         bld = open('build.py', 'w')
@@ -117,7 +157,13 @@ import {module_name}
     def _prepare_files(self, routines):
         pass
 
+class CythonOMPCodeWrapper(CythonCodeWrapper):
+    compile_args = ['-O3', '-fopenmp', '-w']
+    link_args = ['-fopenmp']
+
 class PythonCodeWrapper(CodeWrapper):
+    _module_extension = '.py'
+
     @property
     def command(self):
         return []
@@ -132,16 +178,17 @@ class PythonCodeWrapper(CodeWrapper):
 def get_code_wrapper(backend):
     CodeWrapClass = {"NUMPY" : PythonCodeWrapper,
                      "CYTHON": CythonCodeWrapper,
+                     "CYTHON_OMP": CythonOMPCodeWrapper,
                      "LOOPY": PythonCodeWrapper}.get(backend.upper())
     if CodeWrapClass is None:
         raise ValueError("Language '%s' is not supported." % backend)
     return CodeWrapClass
 
 def autowrap(routines, backend='cython', tempdir=None, args=None, flags=[],
-    verbose=False):
+    verbose=False, cache=None, settings=None):
 
-    code_generator = get_code_generator(backend, "project")
+    code_generator = get_code_generator(backend, "project", settings)
     CodeWrapperClass = get_code_wrapper(backend)
-    code_wrapper = CodeWrapperClass(code_generator, tempdir, flags, verbose)
+    code_wrapper = CodeWrapperClass(code_generator, tempdir, flags, verbose, cache)
 
     return code_wrapper.wrap_code(routines)
@@ -0,0 +1,262 @@
+# Authors:
+#     Loic Gouarin <loic.gouarin@polytechnique.edu>
+#     Benjamin Graille <benjamin.graille@math.u-psud.fr>
+#
+# License: BSD 3 clause
+
+"""
+Persistent cache of the modules built from the generated code
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import logging
+import tempfile
+import importlib.util
+
+import numpy as np
+
+from ..options import options
+
+log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+def cache_key(source, backend, flags=()):
+    """
+    Compute the key of a generated module.
+
+    The key takes into account everything that can modify
+    the compiled module: the generated source, the backend,
+    the compiler flags and the Python and NumPy ABI.
+
+    Parameters
+    ----------
+
+    source : str
+        the generated source code
+    backend : str
+        the backend used to build the module
+    flags : list
+        the compiler flags
+
+    Returns
+    -------
+
+    str
+        the hexadecimal digest of all these informations
+
+    """
+    sha = hashlib.sha256()
+    infos = [backend.upper(),
+             ' '.join(flags),
+             sys.version,
+             sys.platform,
+             np.__version__,
+            ]
+    try:
+        import Cython
+        infos.append(Cython.__version__)
+    except ImportError:
+        pass
+    for info in infos:
+        sha.update(info.encode())
+        sha.update(b'\0')
+    sha.update(source.encode())
+    return sha.hexdigest()
+
+def load_module(module_name, path):
+    """
+    Import a module from its file.
+
+    Parameters
+    ----------
+
+    module_name : str
+        the name of the module
+    path : str
+        the path of the module file (.py or compiled extension)
+
+    Returns
+    -------
+
+    module
+        the imported module
+
+    """
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[module_name] = module
+    return module
+
+class ModuleCache:
+    """
+    Content addressed cache of the generated modules.
+
+    Each entry is a directory named by the key of the module
+    which contains the module file. The modification time of an entry
+    is updated each time it is used and the least recently used
+    entries are removed when the size of the cache exceeds max_size.
+
+    Parameters
+    ----------
+
+    path : str
+        the directory of the cache
+    max_size : int
+        the maximum size of the cache in bytes
+
+    Attributes
+    ----------
+
+    path : str
+        the directory of the cache
+    max_size : int
+        the maximum size of the cache in bytes
+
+    """
+    def __init__(self, path, max_size=512*1024**2):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_size = max_size
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    def lookup(self, key, module_name):
+        """
+        Find the module file of an entry.
+
+        Parameters
+        ----------
+
+        key : str
+            the key of the entry
+        module_name : str
+            the name of the module
+
+        Returns
+        -------
+
+        str
+            the path of the module file or None if the entry
+            is not in the cache
+
+        """
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            return None
+        for filename in os.listdir(entry):
+            if filename.split('.')[0] == module_name and not filename.endswith(('.pyx', '.c')):
+                try:
+                    os.utime(entry)
+                except OSError:
+                    pass
+                log.info("load %s from the cache %s", module_name, entry)
+                return os.path.join(entry, filename)
+        return None
+
+    def store(self, key, files):
+        """
+        Add an entry in the cache.
+
+        Parameters
+        ----------
+
+        key : str
+            the key of the entry
+        files : list
+            the paths of the files to store
+
+        """
+        try:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            # copy the files in a temporary directory and rename it
+            # to have an atomic creation of the entry
+            # (other processes can build the same module)
+            tmpdir = tempfile.mkdtemp(prefix='.tmp_', dir=self.path)
+            for filename in files:
+                shutil.copy2(filename, tmpdir)
+            try:
+                os.rename(tmpdir, self._entry(key))
+            except OSError:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+        except OSError as error:
+            log.warning("unable to store the generated module in the cache %s: %s", self.path, error)
+            return
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        Return the entries of the cache sorted from the least
+        recently used to the most recently used.
+
+        Returns
+        -------
+
+        list
+            the list of tuples (key, size in bytes)
+
+        """
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        for key in os.listdir(self.path):
+            entry = self._entry(key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = 0
+            for filename in os.listdir(entry):
+                size += os.path.getsize(os.path.join(entry, filename))
+            entries.append((os.path.getmtime(entry), key, size))
+        entries.sort()
+        return [(key, size) for _, key, size in entries]
+
+    @property
+    def size(self):
+        """
+        the size of the cache in bytes.
+        """
+        return sum([size for _, size in self.entries()])
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until
+        the size of the cache is lower than max_size.
+
+        Parameters
+        ----------
+
+        keep : str
+            the key of an entry which must not be removed
+            default is None
+
+        """
+        entries = self.entries()
+        total = sum([size for _, size in entries])
+        for key, size in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            log.info("remove %s from the cache %s", key, self.path)
+            total -= size
+
+    def clear(self):
+        """
+        Remove all the entries of the cache.
+        """
+        for key, _ in self.entries():
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+
+def get_module_cache():
+    """
+    Return the cache defined by the command line options
+    or None if the cache is disabled.
+    """
+    opts = options()
+    if not opts.use_cache:
+        return None
+    return ModuleCache(opts.cache_dir, int(opts.cache_size*1024**2))
@@ -1,6 +1,8 @@
 # FIXME: make pylint happy !
 #pylint: disable=all
 
+import copy
+import logging
 from sympy.utilities.codegen import CodeGen, CodeGenError, ResultBase, Result, InputArgument, InOutArgument, OutputArgument
 from sympy.core import Symbol, S, Expr, Tuple, Equality, Function, sympify
 from sympy.core.compatibility import is_sequence, StringIO, string_types
@@ -11,14 +13,20 @@ from sympy.tensor import Idx, Indexed, IndexedBase
 from sympy.matrices import (MatrixSymbol, ImmutableMatrix, MatrixBase,
                             MatrixExpr, MatrixSlice)
 from sympy.core.basic import Basic
+from sympy.core.function import count_ops
 
 default_settings = {'export': True}
 
 from .ast import For, If
+from .cse import cse_instructions
+from .tiling import tile_loops
+from .counter import count_flops, count_memory_accesses
 from .printing.cython import cython_code, CythonCodePrinter
 from .printing.numpy import numpy_code, NumpyCodePrinter
 from .printing.loopy import loopy_code, LoopyCodePrinter
 
+log = logging.getLogger(__name__)
+
 class Routine(object):
     """Generic description of evaluation routine for set of expressions.
 
@@ -100,6 +108,18 @@ class Routine(object):
 
     __repr__ = __str__
 
+    @property
+    def flops(self):
+        """Returns the number of floating point operations of one iteration
+        of the loops of the routine."""
+        return count_flops(self.instructions)
+
+    @property
+    def memory_accesses(self):
+        """Returns the loads and the stores of each array done by one iteration
+        of the loops of the routine."""
+        return count_memory_accesses(self.instructions)
+
     @property
     def variables(self):
         """Returns a set of all variables possibly used in the routine.
@@ -178,10 +198,50 @@ class LBMCodeGen(CodeGen):
 
     The .write() method inherited from CodeGen will output a code file <prefix>.pyx.
 
+    The floating point types are given by the setting
+    {'dtype': {'default': ..., 'local': ..., name: ...}} where the values are
+    'float32' or 'float64': 'default' is the type of the real arguments,
+    'local' the type of the local variables (default is the type 'default')
+    and the other keys give the type of the argument with this name.
+
+    The common subexpressions of the routines created with the setting
+    {'cse': True} are computed once in local variables
+    (see :py:func:`cse_instructions<pylbm.generator.cse.cse_instructions>`).
+
+    The nested loops of the routines created with the setting
+    {'tiling': True} are traversed by tiles
+    (see :py:func:`tile_loops<pylbm.generator.tiling.tile_loops>`).
+
     """
 
     code_extension = None
 
+    _ctypes = {'float32': 'float',
+               'float64': 'double',
+              }
+
+    def __init__(self, project="project", settings=None):
+        super(LBMCodeGen, self).__init__(project)
+        self.codegen_settings = {} if settings is None else settings
+        self.dtypes = {'default': 'float64'}
+        self.dtypes.update(self.codegen_settings.get('dtype', {}))
+
+    def _get_dtype(self, name=None):
+        """Return the type of the real argument name or of the
+        local variables if name is None."""
+        if name is None:
+            return self.dtypes.get('local', self.dtypes['default'])
+        return self.dtypes.get(str(name), self.dtypes['default'])
+
+    def _get_ctype(self, arg=None):
+        """Return the C type of an argument or of the local variables if arg is None."""
+        if arg is None:
+            return self._ctypes[self._get_dtype()]
+        ctype = arg.get_datatype('C')
+        if ctype == 'double':
+            return self._ctypes[self._get_dtype(arg.name)]
+        return ctype
+
     def routine(self, name, expr, argument_sequence, local_vars, settings):
         """Specialized Routine creation for Cython."""
 
@@ -218,13 +278,16 @@ class LBMCodeGen(CodeGen):
                 except KeyError:
                     pass
 
-        idx_order = sorted(idx_vars, key=lambda x: score_table[x])
+        idx_order = sorted(idx_vars, key=lambda x: (score_table[x], str(x)))
 
         # local variables
         local_vars = set() if local_vars is None else set(local_vars)
 
         # symbols that should be arguments
         symbols = expressions.free_symbols - idx_vars - local_vars - symbol_idx_vars
+        # the bounds of the loops which are not given by the shape of an array
+        for i in idx_vars:
+            symbols.update(i.lower.free_symbols | i.upper.free_symbols)
 
         new_symbols = set([])
         new_symbols.update(symbols)
@@ -240,6 +303,20 @@ class LBMCodeGen(CodeGen):
 
         output_args, instructions = extract(expressions, symbols)
 
+        if settings.get('cse', False):
+            # common subexpressions in the blocks of assignments
+            ops = count_ops(instructions)
+            instructions, temps = cse_instructions(instructions, local_vars)
+            local_vars.update(temps)
+            log.info('%s: %d -> %d operations per point with the common subexpression elimination',
+                     name, ops, count_ops(instructions))
+
+        if settings.get('tiling', False):
+            # the nested loops are traversed by tiles whose sizes are arguments
+            instructions, tile_indices, tile_sizes = tile_loops(instructions)
+            idx_order += tile_indices
+            symbols.update(tile_sizes)
+
         arg_list = []
 
         # setup input argument list
@@ -354,6 +431,13 @@ class CythonCodeGen(LBMCodeGen):
     def code_generator(self, expr, assign_to=None, **settings):
         return cython_code(expr, assign_to, **settings)
 
+    def _call_printer(self, routine):
+        code_lines = []
+        for instruction in routine.instructions:
+            constants, not_supported, expr = self.code_generator(instruction, human=False, real=self._get_ctype())
+            code_lines.append("%s\n" % (expr))
+        return code_lines
+
     def _get_header(self):
         code_lines = ["#!python\n",
                       "#cython: boundscheck=False\n",
@@ -400,16 +484,16 @@ class CythonCodeGen(LBMCodeGen):
                     # If it is a scalar
                     if isinstance(arg, ResultBase):
                         # if it is an output
-                        args.append((arg.get_datatype('C'), "*%s" % name))
+                        args.append((self._get_ctype(arg), "*%s" % name))
                     else:
                         # if it is an output
-                        args.append((arg.get_datatype('C'), name))
+                        args.append((self._get_ctype(arg), name))
                 else:
                     if not export and len(arg.dimensions) == 1:
                         # if the dimension is 1
-                        args.append((arg.get_datatype('C'), "*%s" % name))
+                        args.append((self._get_ctype(arg), "*%s" % name))
                     else:
-                        args.append((arg.get_datatype('C') + '[' + ', '.join([':']*len(arg.dimensions)) + ':1]', "%s" % name))
+                        args.append((self._get_ctype(arg) + '[' + ', '.join([':']*len(arg.dimensions)) + ':1]', "%s" % name))
 
         args = ", ".join([ "%s %s" % t for t in args])
         code_list.append("%s(%s)%s\n" % (routine.name, args, ":" if export else " nogil:"))
@@ -422,12 +506,13 @@ class CythonCodeGen(LBMCodeGen):
 
     def _declare_globals(self, routine):
         args = []
-        for g in routine.local_vars:
+        # sort the local variables to always generate the same code
+        for g in sorted(routine.local_vars, key=str):
             if isinstance(g, Symbol):
-                args.append("cdef double %s\n"%(self._get_symbol(g)))
+                args.append("cdef %s %s\n"%("int" if g.is_integer else self._get_ctype(), self._get_symbol(g)))
             else:
                 shape = [d for d in g.shape if d!=1]
-                args.append("cdef double %s[%s]\n"%(self._get_symbol(g), ','.join("%s"%s for s in shape)))
+                args.append("cdef %s %s[%s]\n"%(self._get_ctype(), self._get_symbol(g), ','.join("%s"%s for s in shape)))
         return ["".join(args)]
 
     def _declare_locals(self, routine):
@@ -454,6 +539,54 @@ class CythonCodeGen(LBMCodeGen):
     dump_fns = [dump_pyx]
 
 
+class CythonOMPCodeGen(CythonCodeGen):
+    """Generator for Cython code using OpenMP.
+
+    The outermost loop of the routines with the setting parallel is
+    a prange loop. The local matrices are declared as scalars in order to
+    be private to each thread.
+
+    The OpenMP options are given by the settings
+    {'openmp': {'num_threads': ..., 'schedule': ..., 'chunksize': ...}}.
+
+    """
+
+    _default_openmp = {'num_threads': None,
+                       'schedule': 'static',
+                       'chunksize': None,
+                      }
+
+    def __init__(self, project="project", settings=None):
+        super(CythonOMPCodeGen, self).__init__(project, settings)
+        self.openmp = dict(self._default_openmp)
+        self.openmp.update(self.codegen_settings.get('openmp', {}))
+
+    def _get_header(self):
+        code_lines = super(CythonOMPCodeGen, self)._get_header()
+        return code_lines[:-1] + ["from cython.parallel cimport prange\n"] + code_lines[-1:]
+
+    def _call_printer(self, routine):
+        openmp = dict(self.openmp, parallel=routine.settings.get('parallel', False))
+        code_lines = []
+        for instruction in routine.instructions:
+            constants, not_supported, expr = self.code_generator(instruction, human=False, openmp=openmp, real=self._get_ctype())
+            code_lines.append("%s\n" % (expr))
+        return code_lines
+
+    def _declare_globals(self, routine):
+        args = []
+        for g in sorted(routine.local_vars, key=str):
+            if isinstance(g, Symbol):
+                args.append("cdef %s %s\n"%("int" if g.is_integer else self._get_ctype(), self._get_symbol(g)))
+            else:
+                size = 1
+                for d in g.shape:
+                    size *= d
+                name = self._get_symbol(g)
+                args.append("cdef %s %s\n"%(self._get_ctype(), ', '.join("%s_%d"%(name, i) for i in range(size))))
+        return ["".join(args)]
+
+
 class NumpyCodeGen(LBMCodeGen):
     """Generator for Cython code.
 
@@ -589,15 +722,17 @@ class LoopyCodeGen(LBMCodeGen):
                     dtype = arg.get_datatype('PYTHON')
                     if dtype == 'int':
                         dtype = 'np.int32'
+                    else:
+                        dtype = 'np.%s'%self._get_dtype(arg.name)
                     args.append('lp.GlobalArg("{name}", dtype={dtype}, shape="{shape}")'.format(name=name, dtype=dtype, shape=", ".join(dims)))
                 else:
                     args.append('lp.ValueArg("{name}", dtype={dtype})'.format(name=name, dtype=arg.get_datatype('PYTHON')))
-        for i, arg in enumerate(routine.local_vars):
+        for i, arg in enumerate(sorted(routine.local_vars, key=str)):
             if isinstance(arg, Symbol):
-                args.append('lp.TemporaryVariable("{name}", dtype=float)'.format(name=self._get_symbol(arg)))    
+                args.append('lp.TemporaryVariable("{name}", dtype=np.{dtype})'.format(name=self._get_symbol(arg), dtype=self._get_dtype()))
             else:
                 dims = [d for d in arg.shape if d!=1]
-                args.append('lp.TemporaryVariable("{name}", dtype=float, shape="{shape}")'.format(name=self._get_symbol(arg), shape=','.join("%s"%s for s in dims)))
+                args.append('lp.TemporaryVariable("{name}", dtype=np.{dtype}, shape="{shape}")'.format(name=self._get_symbol(arg), dtype=self._get_dtype(), shape=','.join("%s"%s for s in dims)))
 
         code_list.append('[')
         args = ",\n".join(args)
@@ -660,13 +795,14 @@ class LoopyCodeGen(LBMCodeGen):
     # functions it has to call.
     dump_fns = [dump_py]
 
-def get_code_generator(language, project):
+def get_code_generator(language, project, settings=None):
     CodeGenClass = {"NUMPY" : NumpyCodeGen,
                     "CYTHON": CythonCodeGen,
+                    "CYTHON_OMP": CythonOMPCodeGen,
                     "LOOPY": LoopyCodeGen}.get(language.upper())
     if CodeGenClass is None:
         raise ValueError("Language '%s' is not supported." % language)
-    return CodeGenClass(project)
+    return CodeGenClass(project, settings)
 
 def codegen(name_expr, language, prefix=None, project="project",
             to_files=False, header=True, empty=True, argument_sequence=None,
@@ -701,3 +837,62 @@ def make_routine(name_expr, argument_sequence=None, local_vars=None, settings={}
                                              local_vars, settings))
 
     return routines
+
+def make_loop_routine(name, steps, nloops):
+    """
+    Return a routine which repeats nloops times the instructions
+    of other routines.
+
+    Parameters
+    ==========
+
+    name : string
+        Name of the routine.
+
+    steps : list
+        The couples (routine, dictionary) in the order of their instructions
+        where the dictionary renames some arguments of the routine.
+
+    nloops : Symbol
+        The integer argument which gives the number of loops.
+
+    The arguments with the same name are the same argument of the new routine,
+    the local variables and the indices of the loops are shared.
+    An argument renamed with a new name is a copy of the argument
+    of the routine.
+
+    """
+    arguments = {}
+    for routine, _ in steps:
+        for arg in routine.arguments:
+            arguments.setdefault(str(arg.name), arg)
+
+    instructions = []
+    used = {}
+    local_vars = {}
+    idx_vars = {}
+    for routine, renames in steps:
+        subs = {}
+        for arg in routine.arguments:
+            new_name = renames.get(str(arg.name), str(arg.name))
+            if new_name in arguments:
+                subs[arg.name] = arguments[new_name].name
+            else:
+                subs[arg.name] = Symbol(new_name, **arg.name.assumptions0)
+        for arg in routine.arguments:
+            new_name = str(subs[arg.name])
+            if new_name not in arguments:
+                new_arg = copy.copy(arg)
+                new_arg._name = subs[arg.name]
+                if arg.dimensions:
+                    new_arg.dimensions = [tuple(sympify(d).xreplace(subs) for d in dim) for dim in arg.dimensions]
+                arguments[new_name] = new_arg
+            used[new_name] = arguments[new_name]
+        instructions += [instruction.xreplace(subs) for instruction in routine.instructions]
+        local_vars.update((str(v), v) for v in routine.local_vars)
+        idx_vars.update((str(i.label), i) for i in routine.idx_vars)
+
+    it = Idx(Symbol('it', integer=True), (0, nloops))
+    arg_list = [used[arg_name] for arg_name in sorted(used)] + [InputArgument(nloops)]
+    idx_order = [it] + [i for i_name, i in sorted(idx_vars.items()) if i_name not in local_vars]
+    return Routine(name, arg_list, [For(it, instructions)], idx_order, set(local_vars.values()))
@@ -0,0 +1,134 @@
+# FIXME: make pylint happy !
+#pylint: disable=all
+
+"""
+Static count of the floating point operations and of the memory
+accesses of the routines.
+"""
+
+import collections
+import sympy as sp
+from sympy.core import Add, Mul, Pow, Eq
+from sympy.core.function import Function
+from sympy.core.relational import Relational
+from sympy.tensor import Indexed
+from sympy.matrices import MatrixBase
+from sympy.matrices.expressions.matexpr import MatrixElement, MatrixExpr
+
+from .ast import For, If
+
+
+def count_flops(expr):
+    """
+    return the number of floating point operations of an expression
+    or of a list of instructions.
+
+    The index arithmetic of the arrays is not counted, a multiplication by -1
+    is a subtraction, x**n with n integer is computed with n-1 multiplications.
+    For the instructions, the operations of one iteration of the loops
+    are counted.
+    """
+    if isinstance(expr, (list, tuple, sp.Tuple)):
+        return sum(count_flops(e) for e in expr)
+    if isinstance(expr, For):
+        return count_flops(expr.expr)
+    if isinstance(expr, If):
+        return sum(count_flops(e) for c, e in expr.statement)
+    if isinstance(expr, Eq):
+        rhs = expr.rhs
+        if isinstance(rhs, (MatrixBase, MatrixExpr)):
+            return sum(count_flops(rhs[i, j]) for i in range(rhs.shape[0]) for j in range(rhs.shape[1]))
+        return count_flops(rhs)
+    if isinstance(expr, MatrixBase):
+        return sum(count_flops(e) for e in expr)
+    if not isinstance(expr, sp.Basic) or expr.is_Atom or isinstance(expr, (Indexed, MatrixElement)):
+        return 0
+
+    if isinstance(expr, Add):
+        ops = len(expr.args) - 1
+    elif isinstance(expr, Mul):
+        args = [a for a in expr.args if a != -1]
+        ops = len(args) - 1
+        flops = 0
+        for a in args:
+            if isinstance(a, Pow) and a.exp.is_Integer and a.exp < 0:
+                # the division replaces the multiplication
+                flops += count_flops(1/a)
+            else:
+                flops += count_flops(a)
+        if all(isinstance(a, Pow) and a.exp.is_Integer and a.exp < 0 for a in args):
+            ops += 1
+        return ops + flops
+    elif isinstance(expr, Pow):
+        ops = 1
+        if expr.exp.is_Integer:
+            ops = abs(int(expr.exp)) - 1 + (1 if expr.exp < 0 else 0)
+        return ops + count_flops(expr.base)
+    elif isinstance(expr, Function):
+        ops = 1
+    else:
+        ops = 0
+    return ops + sum(count_flops(a) for a in expr.args)
+
+
+def _elements(lhs, rhs):
+    """return the pairs (lhs, rhs) of each element of an assignment"""
+    if isinstance(lhs, (MatrixBase, MatrixExpr)):
+        return [(lhs[i, j], rhs[i, j]) for i in range(lhs.shape[0]) for j in range(lhs.shape[1])]
+    return [(lhs, rhs)]
+
+
+def count_memory_accesses(instructions):
+    """
+    return the loads and the stores of the arrays done by one iteration
+    of the loops of a list of instructions.
+
+    Each element of an array is counted once for the loads and once for
+    the stores. The local variables are not counted.
+
+    Returns
+    -------
+
+    OrderedDict
+        the keys are the names of the arrays and the values the dictionaries
+        {'loads': number of elements loaded, 'stores': number of elements stored,
+        'integer': True if the array is an integer array}
+
+    """
+    loads, stores = collections.OrderedDict(), collections.OrderedDict()
+
+    def read(expr):
+        if isinstance(expr, Indexed):
+            loads.setdefault(expr, None)
+            for i in expr.indices:
+                read(i)
+        elif isinstance(expr, sp.Basic):
+            for a in expr.args:
+                read(a)
+
+    def visit(instructions):
+        for instruction in instructions:
+            if isinstance(instruction, For):
+                visit(instruction.expr)
+            elif isinstance(instruction, If):
+                for c, e in instruction.statement:
+                    read(c)
+                    visit(e)
+            elif isinstance(instruction, Relational):
+                for lhs, rhs in _elements(instruction.lhs, instruction.rhs):
+                    read(rhs)
+                    if isinstance(lhs, Indexed):
+                        stores.setdefault(lhs, None)
+                        for i in lhs.indices:
+                            read(i)
+
+    visit(instructions)
+    accesses = collections.OrderedDict()
+    for kind, elements in [('loads', loads), ('stores', stores)]:
+        for e in elements:
+            label = e.base.label
+            name = str(label)
+            if name not in accesses:
+                accesses[name] = {'loads': 0, 'stores': 0, 'integer': bool(label.is_integer)}
+            accesses[name][kind] += 1
+    return accesses
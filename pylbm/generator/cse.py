@@ -0,0 +1,385 @@
+# FIXME: make pylint happy !
+#pylint: disable=all
+
+"""
+Common subexpression elimination in the body of the loops of the routines.
+
+The straight-line blocks of assignments of a routine are rewritten
+in three steps:
+
+- the reads of the local variables are replaced by the values they hold
+  and the loads of the arrays by scalar temporaries (a store in an array
+  invalidates the loads of the same location),
+- the linear combinations are reordered to exploit the symmetric pairs:
+  two columns k, k' which only differ by a sign give the sum and the
+  difference f_k + f_k', f_k - f_k' (transport of the symmetric velocities),
+  two rows which only differ by the sign of some coefficients give
+  e + o and e - o (reconstruction of the distribution functions),
+- sympy cse is applied on the whole block.
+
+The temporaries are new local variables of the routine.
+"""
+
+import collections
+import functools
+import sympy as sp
+from sympy.core import Symbol, Add, Eq
+from sympy.core.evaluate import evaluate
+from sympy.utilities.iterables import numbered_symbols
+from sympy.tensor import Indexed
+from sympy.matrices import MatrixBase, MatrixSymbol, MatrixSlice
+from sympy.matrices.expressions.matexpr import MatrixElement, MatrixExpr
+from sympy.matrices.expressions.matmul import MatMul
+
+from .ast import For, If
+
+
+def _provably_distinct(ind1, ind2):
+    """return True if the two tuples of indices are different for all the values of the loop indices"""
+    for i1, i2 in zip(ind1, ind2):
+        d = sp.sympify(i1 - i2)
+        if d.is_Number and d != 0:
+            return True
+    return False
+
+
+class _Block(object):
+    """
+    rewrite a straight-line block of assignments.
+
+    Parameters
+    ----------
+
+    local_vars : set
+        the local variables of the routine
+    live : set
+        the symbols used outside the block: the final values
+        of the other local variables are not stored
+    symbols : iterator
+        the generator of the temporaries
+
+    """
+    def __init__(self, local_vars, live, symbols):
+        self.local_vars = local_vars
+        self.live = live
+        self.symbols = symbols
+        # the definitions of the temporaries
+        self.defs = collections.OrderedDict()
+        # the loads of the arrays and the values of the local variables
+        self.loads = collections.OrderedDict()
+        self.load_syms = set()
+        self.current = collections.OrderedDict()
+        # the initial values of the local variables
+        self.placeholders = {}
+        # the stores in the arrays (lhs, value, loads to do before)
+        self.roots = []
+        # the values computed by a same matrix assignment
+        self.groups = []
+
+    def new_symbol(self, integer=False):
+        name = next(self.symbols).name
+        return Symbol(name, integer=True) if integer else Symbol(name, real=True)
+
+    def is_local(self, expr):
+        if isinstance(expr, MatrixElement):
+            return expr.parent in self.local_vars
+        if isinstance(expr, Symbol):
+            return expr in self.local_vars and not expr.is_integer
+        return False
+
+    def read(self, expr):
+        """return expr where the loads and the local variables are replaced by symbols"""
+        if isinstance(expr, Indexed):
+            return self.load(expr)
+        if self.is_local(expr):
+            if expr not in self.current:
+                sym = self.new_symbol()
+                self.placeholders[sym] = expr
+                self.current[expr] = sym
+            return self.current[expr]
+        if isinstance(expr, (MatrixElement, Symbol)) or not expr.args:
+            return expr
+        args = [self.read(a) for a in expr.args]
+        if all(a is b for a, b in zip(args, expr.args)):
+            return expr
+        return expr.func(*args)
+
+    def load(self, expr):
+        value = self.loads.get(expr, None)
+        if value is None:
+            value = self.new_symbol(integer=bool(expr.base.label.is_integer))
+            self.defs[value] = expr
+            self.load_syms.add(value)
+            self.loads[expr] = value
+        return value
+
+    def value(self, expr):
+        """return a symbol holding the value of expr"""
+        if expr.is_Atom:
+            return expr
+        sym = self.new_symbol()
+        self.defs[sym] = expr
+        return sym
+
+    def store(self, lhs, value):
+        if self.loads.get(lhs, None) == value and self.defs.get(value, None) == lhs:
+            # the value is already in the array
+            return
+        invalidated = []
+        for key in list(self.loads.keys()):
+            if key.base == lhs.base and not _provably_distinct(key.indices, lhs.indices):
+                if self.loads[key] in self.load_syms:
+                    invalidated.append(self.loads[key])
+                del self.loads[key]
+        self.loads[lhs] = value
+        self.roots.append((lhs, value, invalidated))
+
+    def assign(self, lhs, rhs):
+        """assign rhs to lhs (row by row for the matrices)"""
+        if isinstance(rhs, MatMul):
+            # the explicit product is much faster than the computation of each entry
+            rhs = functools.reduce(lambda a, b: a*b, [a.as_explicit() if isinstance(a, MatrixExpr) else a
+                                                     for a in rhs.args])
+        if isinstance(lhs, (MatrixBase, MatrixSymbol, MatrixSlice)):
+            pairs = [(lhs[i, j], rhs[i, j]) for i in range(lhs.shape[0]) for j in range(lhs.shape[1])]
+        else:
+            pairs = [(lhs, rhs)]
+        group = []
+        for l, r in pairs:
+            value = self.value(self.read(r))
+            if self.is_local(l):
+                self.current[l] = value
+            else:
+                self.store(l, value)
+            if value in self.defs and value not in self.load_syms:
+                group.append(value)
+        if len(group) > 1:
+            self.groups.append(group)
+
+    def pair_columns(self, group):
+        """use the sums and the differences of the symbols which have the same or
+        the opposite coefficients in all the rows"""
+        coeffs = [self.defs[v].as_coefficients_dict() for v in group]
+        linear, others = [], set()
+        for d in coeffs:
+            for t in d:
+                if isinstance(t, Symbol):
+                    if t not in linear:
+                        linear.append(t)
+                else:
+                    others |= t.free_symbols
+        linear = [t for t in linear if t not in others]
+
+        paired = set()
+        for i, a in enumerate(linear):
+            if a in paired:
+                continue
+            for b in linear[i+1:]:
+                if b in paired:
+                    continue
+                signs = []
+                for d in coeffs:
+                    ca, cb = d.get(a, 0), d.get(b, 0)
+                    if ca == 0 and cb == 0:
+                        continue
+                    if cb == ca:
+                        signs.append(1)
+                    elif cb == -ca:
+                        signs.append(-1)
+                    else:
+                        break
+                else:
+                    if len(signs) < 2:
+                        continue
+                    s = self.value(a + b) if 1 in signs else None
+                    dif = self.value(a - b) if -1 in signs else None
+                    for d in coeffs:
+                        ca, cb = d.pop(a, 0), d.pop(b, 0)
+                        if ca != 0:
+                            d[s if cb == ca else dif] = ca
+                    paired.update([a, b])
+                    break
+        if paired:
+            for v, d in zip(group, coeffs):
+                self.defs[v] = Add(*[c*t for t, c in d.items()])
+
+    def pair_rows(self, group):
+        """write the rows which only differ by the signs of some coefficients
+        as e + o and e - o"""
+        coeffs = [self.defs[v].as_coefficients_dict() for v in group]
+        paired = set()
+        for i, vi in enumerate(group):
+            di = coeffs[i]
+            if vi in paired or len(di) < 3:
+                continue
+            for j in range(i+1, len(group)):
+                vj, dj = group[j], coeffs[j]
+                if vj in paired or set(di) != set(dj):
+                    continue
+                even, odd = [], []
+                for t, c in di.items():
+                    if dj[t] == c:
+                        even.append(c*t)
+                    elif dj[t] == -c:
+                        odd.append(c*t)
+                    else:
+                        break
+                else:
+                    if not even or not odd:
+                        continue
+                    e, o = self.value(Add(*even)), self.value(Add(*odd))
+                    self.defs[vi] = e + o
+                    self.defs[vj] = e - o
+                    paired.update([vi, vj])
+                    break
+
+    def rewrite(self):
+        """return the instructions of the block"""
+        for group in self.groups:
+            self.pair_columns(group)
+            self.pair_rows(group)
+
+        # the final values of the local variables used outside the block
+        outputs = []
+        for l, v in self.current.items():
+            if (l.parent if isinstance(l, MatrixElement) else l) in self.live and self.placeholders.get(v, None) != l:
+                outputs.append((l, v))
+        values = [v for _, v, _ in self.roots] + [v for _, v in outputs]
+
+        # remove the unused definitions
+        used = set()
+        stack = [s for v in values for s in v.free_symbols]
+        while stack:
+            v = stack.pop()
+            if v in self.defs and v not in used:
+                used.add(v)
+                stack.extend(self.defs[v].free_symbols)
+        defs = collections.OrderedDict((k, v) for k, v in self.defs.items() if k in used)
+
+        # cse on the definitions which are not loads
+        keys = [k for k in defs if k not in self.load_syms]
+        if keys:
+            replacements, reduced = sp.cse([defs[k] for k in keys], symbols=self.symbols)
+            for k, r in zip(keys, reduced):
+                defs[k] = r
+            temps = collections.OrderedDict(replacements)
+            temps.update(defs)
+            defs = temps
+
+        # inline the temporaries used once except the loads
+        # which must be done before a store
+        count = collections.Counter()
+        for e in list(defs.values()) + values:
+            if isinstance(e, Symbol):
+                count[e] += 1
+            else:
+                count.update(e.free_symbols)
+        pinned = set(s for _, _, loads in self.roots for s in loads)
+        inlined = set(k for k in defs if count[k] <= 1 and k not in pinned)
+        memo = {}
+        def expand(expr):
+            subs = {}
+            for s in expr.free_symbols:
+                if s in inlined:
+                    if s not in memo:
+                        memo[s] = expand(defs[s])
+                    subs[s] = memo[s]
+                elif s in self.placeholders:
+                    subs[s] = self.placeholders[s]
+            with evaluate(False):
+                return expr.xreplace(subs)
+
+        instructions = []
+        emitted = []
+        def emit(expr):
+            for s in sorted(expr.free_symbols, key=str):
+                if s in inlined:
+                    emit(defs[s])
+                elif s in defs and s not in emitted:
+                    emitted.append(s)
+                    emit(defs[s])
+                    instructions.append(Eq(s, expand(defs[s]), evaluate=False))
+
+        for lhs, value, loads in self.roots:
+            for s in loads:
+                emit(s)
+            emit(value)
+            instructions.append(Eq(lhs, expand(value), evaluate=False))
+        for lhs, value in outputs:
+            emit(value)
+            instructions.append(Eq(lhs, expand(value), evaluate=False))
+        return instructions, emitted
+
+
+def cse_instructions(instructions, local_vars):
+    """
+    apply the common subexpression elimination on the blocks of assignments
+    of a list of instructions.
+
+    Parameters
+    ----------
+
+    instructions : list
+        the instructions (Eq, For and If)
+    local_vars : set
+        the local variables
+
+    Returns
+    -------
+
+    list
+        the new instructions
+    list
+        the temporaries which are new local variables
+
+    """
+    exclude = [s for s in sp.Tuple(*instructions).free_symbols if isinstance(s, Symbol)]
+    symbols = numbered_symbols('tmp', real=True, exclude=exclude)
+    temps = []
+
+    def is_barrier(instruction):
+        if not isinstance(instruction, Eq):
+            return True
+        lhs = instruction.lhs
+        if isinstance(lhs, Symbol):
+            return lhs.is_integer or lhs not in local_vars
+        return False
+
+    def rewrite(instructions, outside):
+        new_instructions = []
+        run = []
+
+        def others(instruction):
+            # the symbols used in the other instructions
+            live = set(outside)
+            for other in instructions:
+                if other is not instruction and not any(other is r for r in run):
+                    live |= other.free_symbols
+            return live
+
+        def flush():
+            if run:
+                block = _Block(local_vars, others(None), symbols)
+                for r in run:
+                    block.assign(r.lhs, r.rhs)
+                new, new_temps = block.rewrite()
+                new_instructions.extend(new)
+                temps.extend(new_temps)
+                del run[:]
+
+        for instruction in instructions:
+            if isinstance(instruction, For):
+                flush()
+                new_instructions.append(For(instruction.index, rewrite(instruction.expr, others(instruction))))
+            elif isinstance(instruction, If):
+                flush()
+                new_instructions.append(If(*[(c, rewrite(e, others(instruction))) for c, e in instruction.statement]))
+            elif is_barrier(instruction):
+                flush()
+                new_instructions.append(instruction)
+            else:
+                run.append(instruction)
+        flush()
+        return new_instructions
+
+    return rewrite(list(instructions), set()), temps
@@ -2,20 +2,83 @@
 #pylint: disable=all
 
 import collections
-from .codegen import make_routine
+import numpy as np
+from .codegen import make_routine, make_loop_routine
 from .autowrap import autowrap
+from .cache import get_module_cache
 
 class Generator(object):
 
     def __init__(self):
         self.routines = collections.OrderedDict()
         self.module = None
+        self.dtypes = {'default': 'float64'}
+        # the names of the arguments of the functions of the module
+        self.arguments = {}
 
     def add_routine(self, name_expr, argument_sequence=None, local_vars=None, settings={}):
         self.routines[name_expr[0]] = make_routine(name_expr, argument_sequence, local_vars, settings)[0]
 
-    def compile(self, backend="cython", verbose=False):
-        self.module = autowrap(self.routines.values(), backend, verbose=verbose)
+    def add_loop(self, name, steps, nloops):
+        """
+        add a routine which repeats nloops times the instructions
+        of routines already added.
+
+        Parameters
+        ----------
+
+        name : str
+            the name of the routine
+        steps : list
+            the couples (name of a routine, dictionary) in the order of
+            their instructions where the dictionary renames some arguments
+            of the routine (for example {'f': 'f_new', 'f_new': 'f'})
+        nloops : sympy.Symbol
+            the integer argument which gives the number of loops
+
+        """
+        self.routines[name] = make_loop_routine(name, [(self.routines[routine], renames)
+                                                       for routine, renames in steps], nloops)
+
+    def count_operations(self):
+        """
+        return the floating point operations and the memory accesses
+        of one iteration of the loops of each routine.
+
+        The sizes of the elements are given by the dtypes of the last
+        compilation, the integer arrays are int32.
+
+        Returns
+        -------
+
+        OrderedDict
+            the keys are the names of the routines and the values the dictionaries
+            {'flops': ..., 'loads': ..., 'stores': ..., 'bytes': ...}
+
+        """
+        operations = collections.OrderedDict()
+        for name, routine in self.routines.items():
+            loads, stores, nbytes = 0, 0, 0
+            for array, accesses in routine.memory_accesses.items():
+                if accesses['integer']:
+                    itemsize = 4
+                else:
+                    itemsize = np.dtype(self.dtypes.get(array, self.dtypes['default'])).itemsize
+                loads += accesses['loads']
+                stores += accesses['stores']
+                nbytes += itemsize*(accesses['loads'] + accesses['stores'])
+            operations[name] = {'flops': routine.flops,
+                                'loads': loads,
+                                'stores': stores,
+                                'bytes': nbytes}
+        return operations
+
+    def compile(self, backend="cython", verbose=False, settings=None):
+        if settings is not None and 'dtype' in settings:
+            self.dtypes = settings['dtype']
+        self.module = autowrap(self.routines.values(), backend, verbose=verbose,
+                               cache=get_module_cache(), settings=settings)
+        self.arguments = {}
 
 generator = Generator()
 
@@ -89,6 +89,8 @@ class CythonCodePrinter(CodePrinter):
         'dereference': set(),
         'error_on_reserved': False,
         'reserved_word_suffix': '_',
+        'openmp': None,
+        'real': 'double',
     }
 
     def __init__(self, settings={}):
@@ -230,6 +232,13 @@ class CythonCodePrinter(CodePrinter):
             return 'pow(%s, %s)' % (self._print(expr.base),
                                  self._print(expr.exp))
 
+    def _print_Float(self, expr):
+        value = super(CythonCodePrinter, self)._print_Float(expr)
+        if self._settings['real'] != 'double':
+            # avoid the promotion to double of the computations
+            return "<{0}>{1}".format(self._settings['real'], value)
+        return value
+
     def _print_Rational(self, expr):
         return self._print(expr.evalf(self._settings["precision"]))
 
@@ -242,6 +251,23 @@ class CythonCodePrinter(CodePrinter):
     def _print_Idx(self, expr):
         return self._print(expr.label)
 
+    def _print_Min(self, expr):
+        if len(expr.args) == 1:
+            return self._print(expr.args[0])
+        return "min(%s, %s)" % (self._print(expr.args[0]), self._print(expr.func(*expr.args[1:])))
+
+    def _print_Max(self, expr):
+        if len(expr.args) == 1:
+            return self._print(expr.args[0])
+        return "max(%s, %s)" % (self._print(expr.args[0]), self._print(expr.func(*expr.args[1:])))
+
+    def _print_floor(self, expr):
+        # the integer division of the bounds of the loops (cdivision)
+        num, den = expr.args[0].as_numer_denom()
+        if num.is_integer and den.is_integer and not den.is_Number:
+            return "(%s)//(%s)" % (self._print(num), self._print(den))
+        return "floor(%s)" % self._print(expr.args[0])
+
     def _print_Exp1(self, expr):
         return "M_E"
 
@@ -316,6 +342,10 @@ class CythonCodePrinter(CodePrinter):
         return self._print(_piecewise)
 
     def _print_MatrixElement(self, expr):
+        if self._settings['openmp'] is not None:
+            # local matrices are stored as scalars to be private in the prange loops
+            return "{0}_{1}".format(expr.parent, expr.j +
+                    expr.i*expr.parent.shape[1])
         return "{0}[{1}]".format(expr.parent, expr.j +
                 expr.i*expr.parent.shape[1])
 
@@ -328,17 +358,33 @@ class CythonCodePrinter(CodePrinter):
         else:
             return name
 
+    def _get_prange_options(self, openmp):
+        options = ["nogil=True"]
+        for key in ['schedule', 'chunksize', 'num_threads']:
+            if openmp.get(key, None) is not None:
+                options.append("%s=%r"%(key, openmp[key]))
+        return ", ".join(options)
+
     def _print_For(self, expr):
         lines = []
         index = expr.index
-        for i in index:
-            lines.append("for %s in range(%s, %s):"%(i.label, i.lower, i.upper))
+        openmp = self._settings['openmp']
+        for ii, i in enumerate(index):
+            if ii == 0 and openmp is not None and openmp['parallel']:
+                lines.append("for %s in prange(%s, %s, %s):"%(i.label, self._print(i.lower), self._print(i.upper),
+                                                              self._get_prange_options(openmp)))
+            else:
+                lines.append("for %s in range(%s, %s):"%(i.label, self._print(i.lower), self._print(i.upper)))
+        if openmp is not None:
+            # only the outermost loop is parallel
+            self._settings['openmp'] = dict(openmp, parallel=False)
         for e in expr.expr:
             temp1, temp2, addlines = self.doprint(e)
             if isinstance(addlines, str):
                 lines.append(addlines)
             else:
                 lines += addlines
+        self._settings['openmp'] = openmp
         for i in index:
             lines.append("#end")
         return "\n".join(lines)
@@ -0,0 +1,75 @@
+# FIXME: make pylint happy !
+#pylint: disable=all
+
+"""
+Loop tiling of the routines.
+
+The nested loops over the space of a routine
+
+    for ix in range(lx, ux):
+        for iy in range(ly, uy):
+            ...
+
+are traversed by tiles
+
+    for b_ix in range(0, (ux - lx + tile_ix - 1)//tile_ix):
+        for b_iy in range(0, (uy - ly + tile_iy - 1)//tile_iy):
+            for ix in range(lx + b_ix*tile_ix, min(lx + (b_ix + 1)*tile_ix, ux)):
+                for iy in range(ly + b_iy*tile_iy, min(ly + (b_iy + 1)*tile_iy, uy)):
+                    ...
+
+where the tile sizes tile_ix, tile_iy, ... are new integer arguments of the
+routine: the tile sizes can be changed without generating a new code and
+a tile size equal to the number of points of an axis gives the original loop.
+"""
+
+import sympy as sp
+from sympy.core import Symbol
+from sympy.tensor import Idx
+
+from .ast import For
+
+
+def tile_loops(instructions):
+    """
+    tile the outermost nested loops of a list of instructions.
+
+    Only the loops over at least two indices are tiled.
+
+    Parameters
+    ----------
+
+    instructions : list
+        the instructions (Eq, For and If)
+
+    Returns
+    -------
+
+    list
+        the new instructions
+    list
+        the indices of the loops over the tiles
+    list
+        the tile sizes which are new arguments
+
+    """
+    new_instructions = []
+    tile_indices = []
+    tile_sizes = []
+    for instruction in instructions:
+        if not isinstance(instruction, For) or len(instruction.index) < 2:
+            new_instructions.append(instruction)
+            continue
+
+        outer, inner = [], []
+        for i in instruction.index:
+            size = Symbol('tile_{}'.format(i.label), integer=True)
+            b = Idx(Symbol('b_{}'.format(i.label), integer=True),
+                    (0, sp.floor((i.upper - i.lower + size - 1)/size)))
+            outer.append(b)
+            inner.append(Idx(i.label, (i.lower + b*size, sp.Min(i.lower + (b + 1)*size, i.upper))))
+            if size not in tile_sizes:
+                tile_sizes.append(size)
+                tile_indices.append(b)
+        new_instructions.append(For(outer, [For(inner, instruction.expr)]))
+    return new_instructions, tile_indices, tile_sizes
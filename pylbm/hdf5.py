@@ -9,7 +9,8 @@ HDF5 module
 """
 import os
 import logging
-from six.moves import range
+import threading
+from six.moves import range, queue
 import numpy as np
 import h5py
 import mpi4py.MPI as mpi
@@ -19,10 +20,41 @@ log = logging.getLogger(__name__) #pylint: disable=invalid-name
 class H5File:
     """
     class to manage hfd5 and xdmf file.
+
+    Parameters
+    ----------
+
+    mpi_topo : MpiTopology
+        the topology of the processes
+    filename : string
+        the name of the file without the suffix
+    path : string
+        the directory of the file (default is '')
+    timestep : int
+        the suffix of the file, None for no suffix (default is 0)
+    init_xdmf : bool
+        not used (default is False)
+    asynchronous : bool
+        if True, the fields are copied in buffers and written by a
+        background thread: the simulation can go on during the writing
+        (default is False)
+
+    Notes
+    -----
+
+    If h5py is built with MPI, all the processes write their part of the
+    fields in the file with collective writes. Otherwise, the fields are
+    sent to the process 0 which writes them.
+
+    With asynchronous, use :py:meth:`wait<pylbm.hdf5.H5File.wait>`
+    to be sure that the files are written after
+    :py:meth:`save<pylbm.hdf5.H5File.save>`. With several processes,
+    the asynchronous writing needs an MPI library initialized with
+    MPI_THREAD_MULTIPLE: the fields are written synchronously otherwise.
     """
-    def __init__(self, mpi_topo, filename, path='', timestep=0, init_xdmf=False):
+    def __init__(self, mpi_topo, filename, path='', timestep=0, init_xdmf=False, asynchronous=False):
         self.timestep = timestep
-        prefix = '_{}'.format(timestep)
+        prefix = '' if timestep is None else '_{}'.format(timestep)
         self.path = path
         self.filename = filename + prefix
         self.h5filename = filename + prefix + '.h5'
@@ -35,21 +67,73 @@ class H5File:
         self.global_size = None
         self.xdmf_file = None
 
+        # the parallel version of h5py writes the file with MPI-IO
+        self.parallel = h5py.get_config().mpi and mpi_topo.cartcomm.Get_size() > 1
+
         if mpi.COMM_WORLD.Get_rank() == 0:
             if not os.path.exists(path):
                 os.mkdir(path)
 
-            self.h5file = h5py.File(path + '/' + self.h5filename, "w")
+            if not self.parallel:
+                self.h5file = h5py.File(path + '/' + self.h5filename, "w")
 
         # All the processes wait for the creation of the output directory
         mpi.COMM_WORLD.Barrier()
 
+        if self.parallel:
+            self.h5file = h5py.File(path + '/' + self.h5filename, "w",
+                                    driver='mpio', comm=mpi_topo.cartcomm)
+
         self.mpi_topo = mpi_topo
         self.scalars = {}
         self.vectors = {}
         self._init_grid = True
         self._init_xdmf = init_xdmf
 
+        # the writings are done in this order by the background thread
+        # which communicates with its own communicator
+        self._comm = mpi_topo.cartcomm
+        self._tasks = None
+        if asynchronous:
+            if mpi_topo.cartcomm.Get_size() > 1 and mpi.Query_thread() < mpi.THREAD_MULTIPLE:
+                log.warning('asynchronous writing needs MPI_THREAD_MULTIPLE: the fields are written synchronously')
+            else:
+                self._comm = mpi_topo.cartcomm.Dup()
+                self._tasks = queue.Queue()
+                self._writer = threading.Thread(target=self._write_tasks)
+                self._writer.start()
+
+    def _write_tasks(self):
+        """
+        execute the writings of the queue until None is found.
+        """
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                self._tasks.task_done()
+                break
+            try:
+                task[0](*task[1:])
+            except Exception: #pylint: disable=broad-except
+                log.exception('writing of %s failed', self.h5filename)
+            self._tasks.task_done()
+
+    def _submit(self, function, *args):
+        """
+        write now or in the background thread.
+        """
+        if self._tasks is None:
+            function(*args)
+        else:
+            self._tasks.put((function,) + args)
+
+    def wait(self):
+        """
+        wait until all the fields given before are written.
+        """
+        if self._tasks is not None:
+            self._tasks.join()
+
     def set_grid(self, x, y=None, z=None):
         """
         create the hdf5 coordinate.
@@ -96,23 +180,28 @@ class H5File:
             sub = [False]*self.dim
             sub[i] = True
             comm = self.mpi_topo.cartcomm.Sub(sub)
-            self.n[i] = comm.allreduce(coords[i].size, op=mpi.SUM)
-            self.region.append(comm.gather(coords[i].size, root=0))
-            self.global_size.append(np.sum(np.asarray(self.region[i])))
-            coords[i] = np.asarray(comm.gather(coords[i], root=0))
+            sizes = comm.allgather(coords[i].size)
+            self.region.append([0] + list(np.cumsum(sizes)))
+            self.global_size.append(int(np.sum(sizes)))
+            self.n[i] = self.global_size[i]
+            coords[i] = comm.gather(coords[i], root=0)
             comm.Free()
 
         if mpi.COMM_WORLD.Get_rank() == 0:
-            for i in range(len(self.region)):
-                self.region[i].insert(0, 0)
-                for j in range(1, len(self.region[i])):
-                    self.region[i][j] += self.region[i][j-1]
-            #self.region = np.asarray(self.region, dtype=np.int)
-            #self.region = np.concatenate((np.zeros((self.dim, 1), dtype=np.int), np.cumsum(self.region, axis=1)), axis=1)
-            #print(self.region)
-            for i in range(self.dim):
+            coords = [np.concatenate(c) for c in coords]
+        else:
+            coords = None
+        self._submit(self._write_grid, coords)
+
+    def _write_grid(self, coords):
+        """
+        create the datasets of the coordinates.
+        """
+        for i in range(self.dim):
+            if self.parallel or mpi.COMM_WORLD.Get_rank() == 0:
                 dset = self.h5file.create_dataset("x_{}".format(i), [self.global_size[i]], dtype=np.double)
-                dset[:] = np.concatenate(coords[i])
+            if coords is not None:
+                dset[:] = coords[i]
 
     def _get_slice(self, rank):
         """
@@ -128,44 +217,56 @@ class H5File:
             buffer_size.append(self.region[i][mpi_coords[i]+1] - self.region[i][mpi_coords[i]])
         return ind[::-1], buffer_size[::-1]
 
-    def _set_dset(self, dset, comm, data, index=0, with_index=False):
+    def _write_dataset(self, name, data):
         """
-        Merge data from multiple sub domains into a dataset.
+        Write a field into its dataset.
 
         Parameters
         ----------
 
-        dset : dataset
-            hdf5 dataset where to store the data
-
-        comm : comm
-            mpi communicator
+        name : string
+            the name of the dataset
 
         data : array
-            data on the sub-domain
+            the field on the sub-domain with the axes in the order
+            of the dataset (the components of a vector are on the last axis)
 
-        index : int
-            use to store an index of a vector
-
-        with_index : bool
-            if we store a vector component
+        """
+        comm = self._comm
+        shape = self.global_size[::-1] + list(data.shape[self.dim:])
+        if self.parallel:
+            # each process writes its hyperslab
+            dset, index = self._get_dataset(name, shape, data.dtype)
+            ind, _ = self._get_slice(comm.Get_rank())
+            with dset.collective:
+                dset[index + tuple(ind)] = data
+        elif comm.Get_rank() == 0:
+            dset, index = self._get_dataset(name, shape, data.dtype)
+            ind, _ = self._get_slice(0)
+            dset[index + tuple(ind)] = data
+
+            for i in range(1, comm.Get_size()):
+                ind, buffer_size = self._get_slice(i)
+                rcv_buffer = np.empty(buffer_size + list(data.shape[self.dim:]), dtype=data.dtype)
+                comm.Recv([rcv_buffer, mpi._typedict[data.dtype.char]], source=i, tag=0) #pylint: disable=protected-access
+                dset[index + tuple(ind)] = rcv_buffer
+        else:
+            comm.Send([data, mpi._typedict[data.dtype.char]], dest=0, tag=0) #pylint: disable=protected-access
 
+    def _get_dataset(self, name, shape, dtype):
         """
-        ind, buffer_size = self._get_slice(0)
-        ind = tuple(ind)
-        if with_index:
-            ind = ind + (index,)
-        dset[ind] = data.T
+        create the dataset of a field and return it
+        with the index of the field in the dataset.
+        """
+        return self.h5file.create_dataset(name, shape, dtype=dtype), ()
 
-        for i in range(1, comm.Get_size()):
-            ind, buffer_size = self._get_slice(i)
-            #print(i, ind, buffer_size)
-            ind = tuple(ind)
-            if with_index:
-                ind = ind + (index,)
-            rcv_buffer = np.empty(buffer_size)
-            comm.Recv([rcv_buffer, mpi.DOUBLE], source=i, tag=index)
-            dset[ind] = rcv_buffer
+    @staticmethod
+    def _get_dtype(data):
+        """
+        the type of the dataset: the single precision data
+        are stored in single precision and the others in double precision.
+        """
+        return np.dtype(np.float32 if data.dtype == np.float32 else np.double)
 
     def add_scalar(self, name, f, *fargs):
         """
@@ -189,13 +290,11 @@ class H5File:
         else:
             data = f(*fargs)
 
-        comm = self.mpi_topo.cartcomm
-        if comm.Get_rank() == 0:
-            dset = self.h5file.create_dataset(name, self.global_size[::-1], dtype=np.double)
-            self._set_dset(dset, comm, data)
+        # the copy of the field can be written later
+        data = np.array(data.T, dtype=self._get_dtype(data), order='C')
+        if self.mpi_topo.cartcomm.Get_rank() == 0:
             self.scalars[name] = self.h5filename + ":/" + name
-        else:
-            comm.Send([np.ascontiguousarray(data.T, dtype=np.double), mpi.DOUBLE], dest=0, tag=0)
+        self._submit(self._write_dataset, name, data)
 
     def add_vector(self, name, f, *fargs):
         """
@@ -219,23 +318,33 @@ class H5File:
         else:
             datas = f(*fargs)
 
-        comm = self.mpi_topo.cartcomm
-        if comm.Get_rank() == 0:
-            dset = self.h5file.create_dataset(name, self.global_size[::-1] + [self.dim], dtype=np.double)
-            for i, data in enumerate(datas):
-                self._set_dset(dset, comm, data, i, with_index=True)
+        # the copy of the components can be written later
+        data = np.ascontiguousarray(np.stack([d.T for d in datas], axis=-1), dtype=self._get_dtype(datas[0]))
+        if self.mpi_topo.cartcomm.Get_rank() == 0:
             self.vectors[name] = self.h5filename + ":/" + name
-        else:
-            for i, data in enumerate(datas):
-                comm.Send([np.ascontiguousarray(data.T), mpi.DOUBLE], dest=0, tag=i)
+        self._submit(self._write_dataset, name, data)
 
     def save(self):
         """
         save the hdf5 and the xdmf files.
+
+        With asynchronous, the files are written after the fields
+        by the background thread which then stops.
+        """
+        self._submit(self._save)
+        if self._tasks is not None:
+            self._tasks.put(None)
+
+    def _save(self):
+        """
+        close the hdf5 file and write the xdmf file.
         """
+        if self.parallel:
+            self.h5file.close()
         comm = self.mpi_topo.cartcomm
         if comm.Get_rank() == 0:
-            self.h5file.close()
+            if not self.parallel:
+                self.h5file.close()
             self.xdmf_file = open(self.path + '/' + self.filename + '.xdmf', "w")
             self.xdmf_file.write("""<?xml version="1.0" ?>
 <!DOCTYPE Xdmf SYSTEM "Xdmf.dtd" []>
@@ -283,3 +392,199 @@ class H5File:
 
             self.xdmf_file.write("</Grid>\n</Domain>\n</Xdmf>\n")
             self.xdmf_file.close()
+
+        if self._comm is not self.mpi_topo.cartcomm:
+            self._comm.Free()
+
+
+class H5TimeSeries(H5File):
+    """
+    class to manage a time series in one hdf5 file and one xdmf file.
+
+    The grid is written once and each snapshot is appended to extendable
+    datasets whose first axis is the time. The xdmf file is a temporal
+    collection rewritten at each snapshot.
+
+    Parameters
+    ----------
+
+    mpi_topo : MpiTopology
+        the topology of the processes
+    filename : string
+        the name of the files without the suffix
+    path : string
+        the directory of the files (default is '')
+    compression : string, optional
+        the compression filter of the datasets, for instance 'gzip'
+        (default is None)
+    asynchronous : bool
+        if True, the snapshots are written by a background thread
+        (default is False)
+
+    Examples
+    --------
+
+    >>> h5 = pylbm.H5TimeSeries(sol.mpi_topo, 'cavity', './cavity')
+    >>> h5.set_grid(sol.domain.x, sol.domain.y)
+    >>> while sol.t < Tf:
+    ...     sol.run(100)
+    ...     h5.add_scalar('rho', sol.m[rho])
+    ...     h5.save(sol.t)
+    >>> h5.close()
+
+    Notes
+    -----
+
+    The same fields have to be added at each snapshot.
+    The compression is not used when the file is written in parallel
+    (see :py:class:`H5File<pylbm.hdf5.H5File>`).
+    """
+    def __init__(self, mpi_topo, filename, path='', compression=None, asynchronous=False):
+        super(H5TimeSeries, self).__init__(mpi_topo, filename, path, timestep=None, asynchronous=asynchronous)
+        self.compression = compression
+        if compression is not None and self.parallel:
+            log.warning('the compression is not available with the parallel writing')
+            self.compression = None
+        self.times = []
+
+    def set_grid(self, x, y=None, z=None):
+        """
+        create the hdf5 coordinate once.
+
+        Parameters
+        ----------
+
+        x : ndarray
+            x-coordinate
+
+        y : ndarray
+            y-coordinate
+            default is None
+
+        z : ndarray
+            z-coordinate
+            default is None
+
+        """
+        if not self._init_grid:
+            log.warning("h5 grid already defined: the new grid is not used.")
+            return
+        super(H5TimeSeries, self).set_grid(x, y, z)
+        self._init_grid = False
+
+    def _get_dataset(self, name, shape, dtype):
+        """
+        extend the dataset of a field by one snapshot and return it
+        with the index of the snapshot.
+        """
+        if name not in self.h5file:
+            # the chunks are parts of one snapshot of at most 4MB
+            chunks = list(shape)
+            points = int(np.prod(shape[1:]))*np.dtype(dtype).itemsize
+            chunks[0] = max(1, min(shape[0], 2**22//points))
+            self.h5file.create_dataset(name, [0] + list(shape), dtype=dtype,
+                                       maxshape=[None] + list(shape), chunks=tuple([1] + chunks),
+                                       compression=self.compression)
+        dset = self.h5file[name]
+        dset.resize(len(self.times) + 1, axis=0)
+        return dset, (len(self.times),)
+
+    def save(self, t=0.):
+        """
+        end the snapshot at the time t and update the xdmf file.
+        """
+        self._submit(self._save_snapshot, t)
+
+    def _save_snapshot(self, t):
+        """
+        append the time t and rewrite the xdmf file.
+        """
+        if self.parallel or self.mpi_topo.cartcomm.Get_rank() == 0:
+            if 'time' not in self.h5file:
+                self.h5file.create_dataset('time', [0], dtype=np.double, maxshape=[None])
+            dset = self.h5file['time']
+            dset.resize(len(self.times) + 1, axis=0)
+            if self.mpi_topo.cartcomm.Get_rank() == 0:
+                dset[len(self.times)] = t
+            self.h5file.flush()
+        self.times.append(t)
+        if self.mpi_topo.cartcomm.Get_rank() == 0:
+            self._write_xdmf()
+
+    def _write_xdmf(self):
+        """
+        write the temporal collection of the snapshots.
+        """
+        size = ' '.join(map(str, self.global_size[::-1]))
+        topology = '{}DRectMesh'.format(self.dim)
+        geometry = 'VXVY' if self.dim == 2 else 'VXVYVZ'
+        coords = ''.join("""
+                <DataItem Format="HDF" Dimensions="{0}">
+                    {1}:/x_{2}
+                </DataItem>""".format(self.global_size[i], self.h5filename, i) for i in range(self.dim))
+
+        def hyperslab(name, step, ncomp=None):
+            dims = size if ncomp is None else '{} {}'.format(size, ncomp)
+            rank = self.dim + (ncomp is not None)
+            count = dims.split()
+            return """
+                <DataItem ItemType="HyperSlab" Dimensions="{0}">
+                    <DataItem Dimensions="3 {1}" Format="XML">
+                        {2} {3}
+                        {4}
+                        1 {5}
+                    </DataItem>
+                    <DataItem Format="HDF" Dimensions="{6} {0}">
+                        {7}:/{8}
+                    </DataItem>
+                </DataItem>""".format(dims, rank + 1, step, ' '.join(['0']*rank), ' '.join(['1']*(rank + 1)),
+                                      ' '.join(count), len(self.times), self.h5filename, name)
+
+        with open(self.path + '/' + self.filename + '.xdmf', "w") as xdmf_file:
+            xdmf_file.write("""<?xml version="1.0" ?>
+<!DOCTYPE Xdmf SYSTEM "Xdmf.dtd" []>
+<Xdmf>
+ <Domain>
+  <Grid Name="Time Series" GridType="Collection" CollectionType="Temporal">""")
+            for step, t in enumerate(self.times):
+                xdmf_file.write("""
+            <Grid Name="Structured Grid" GridType="Uniform">
+                <Time Value="{0}"/>
+                <Topology TopologyType="{1}" NumberOfElements="{2}"/>
+                <Geometry GeometryType="{3}">{4}
+                </Geometry>""".format(t, topology, size, geometry, coords))
+                for k in self.scalars:
+                    xdmf_file.write("""
+                <Attribute Name="{0}" AttributeType="Scalar" Center="Node">{1}
+                </Attribute>""".format(k, hyperslab(k, step)))
+                for k in self.vectors:
+                    xdmf_file.write("""
+                <Attribute Name="{0}" AttributeType="Vector" Center="Node">{1}
+                </Attribute>""".format(k, hyperslab(k, step, self.dim)))
+                xdmf_file.write("""
+            </Grid>""")
+            xdmf_file.write("""
+  </Grid>
+ </Domain>
+</Xdmf>
+""")
+
+    def close(self):
+        """
+        close the hdf5 file.
+
+        With asynchronous, the file is closed after the snapshots
+        by the background thread which then stops.
+        """
+        self._submit(self._close)
+        if self._tasks is not None:
+            self._tasks.put(None)
+
+    def _close(self):
+        """
+        close the hdf5 file and free the communicator of the writings.
+        """
+        if self.parallel or self.mpi_topo.cartcomm.Get_rank() == 0:
+            self.h5file.close()
+        if self._comm is not self.mpi_topo.cartcomm:
+            self._comm.Free()
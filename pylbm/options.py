@@ -7,6 +7,7 @@
 """
 pylbm CLI options
 """
+import os
 from argparse import ArgumentParser
 
 def options():
@@ -25,5 +26,14 @@ def options():
                      help="Set the number of processes in y direction")
     mpi.add_argument("-npz", dest="npz", default=1, type=int,
                      help="Set the number of processes in z direction")
+    cache = parser.add_argument_group('generated code cache')
+    default_cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join('~', '.cache')), 'pylbm')
+    cache.add_argument("--cache-dir", dest="cache_dir",
+                       default=os.environ.get('PYLBM_CACHE_DIR', default_cache_dir),
+                       help="Set the directory where the compiled modules are stored")
+    cache.add_argument("--cache-size", dest="cache_size", default=512., type=float,
+                       help="Set the maximum size of the cache in MB")
+    cache.add_argument("--no-cache", dest="use_cache", action="store_false",
+                       help="Always regenerate and recompile the modules")
     args, _ = parser.parse_known_args()
     return args
@@ -9,10 +9,13 @@ Description of a LBM scheme
 """
 import sys
 import logging
+from collections import OrderedDict
+from fractions import Fraction
 from textwrap import dedent
 from six import string_types
 from six.moves import range
 
+import numpy as np
 import sympy as sp
 from sympy.parsing.sympy_parser import parse_expr
 from sympy import symbols, Eq
@@ -40,7 +43,9 @@ def alltogether(M):
     """
     for i in range(M.shape[0]):
         for j in range(M.shape[1]):
-            M[i, j] = M[i, j].expand().together().factor()
+            # the numbers do not need to be simplified
+            if M[i, j].free_symbols:
+                M[i, j] = M[i, j].expand().together().factor()
 
 def allfactor(M):
     """
@@ -57,6 +62,58 @@ def allfactor(M):
         for j in range(M.shape[1]):
             M[i, j] = M[i, j].factor()
 
+def exact_inverse(M):
+    """
+    Compute the exact inverse of a square sympy matrix
+
+    The floats are converted into rational numbers. A matrix of numbers
+    is inverted by a Gauss-Jordan elimination on fractions which skips
+    the zero entries, a matrix with symbols by a LU decomposition
+    where each entry of the inverse is then simplified by cancel.
+
+    Parameters
+    ----------
+
+    M : sympy matrix
+       matrix to invert
+
+    Returns
+    -------
+
+    sympy matrix
+        the inverse of M
+
+    """
+    M = M.applyfunc(lambda e: sp.nsimplify(e, rational=True))
+    if M.free_symbols:
+        return M.inv(method='LU').applyfunc(sp.cancel)
+
+    n = M.shape[0]
+    a = [[Fraction(int(M[i, j].p), int(M[i, j].q)) for j in range(n)] +
+         [Fraction(int(i == j)) for j in range(n)] for i in range(n)]
+    for j in range(n):
+        pivot = next((i for i in range(j, n) if a[i][j] != 0), None)
+        if pivot is None:
+            raise ValueError("Matrix det == 0; not invertible.")
+        a[j], a[pivot] = a[pivot], a[j]
+        row = a[j]
+        coef = row[j]
+        for k in range(j, 2*n):
+            row[k] /= coef
+        nonzero = [k for k in range(j + 1, 2*n) if row[k] != 0]
+        for i in range(n):
+            coef = a[i][j]
+            if i != j and coef != 0:
+                a[i][j] = Fraction(0)
+                for k in nonzero:
+                    a[i][k] -= coef*row[k]
+    return sp.Matrix(n, n, lambda i, j: sp.Rational(a[i][n + j].numerator, a[i][n + j].denominator))
+
+# the moments matrices already computed (see Scheme.create_moments_matrices):
+# the least recently used ones are removed beyond MAX_MOMENTS_MATRICES entries
+MAX_MOMENTS_MATRICES = 32
+_moments_matrices = OrderedDict() #pylint: disable=invalid-name
+
 def param_to_tuple(param):
     """
     Convert param dictionary to a list of keys and a list of values.
@@ -151,6 +208,9 @@ class Scheme:
       :py:class:`NumpyGenerator<pylbm.generator.NumpyGenerator>`,
       :py:class:`CythonGenerator<pylbm.generator.CythonGenerator>`,
       ...)
+    tile_sizes : list
+      the tile sizes along each axis of the loops generated with tiling
+      (None or 0 for an axis which is not tiled)
     ode_solver : :py:class:`ode_solver <pylbm.generator.ode_schemes.ode_solver>`,
       the used ODE solver (
       :py:class:`explicit_euler<pylbm.generator.explicit_euler>`,
@@ -317,6 +377,14 @@ class Scheme:
         for ic, c in enumerate(self.consm.keys()):
             self.consm[c] = ic
 
+        # the numerical matrices are built after the permutation
+        # of the conserved moments and are None if M depends on parameters without value
+        try:
+            self.Mnum = np.array(self.M.tolist(), dtype=np.float64)
+            self.invMnum = np.array(self.invM.tolist(), dtype=np.float64)
+        except TypeError:
+            self.Mnum, self.invMnum = None, None
+
         self.init = self.set_initialization(scheme)
 
         #self._source_terms = dico.get('source_terms', None)
@@ -345,6 +413,9 @@ class Scheme:
         log.info(ssss)
 
         self.bc_compute = True
+        # the arguments of the generated functions for an ensemble (see generate)
+        self._batch_args = {}
+        self.tile_sizes = [None]*self.dim
 
         if self.check_inverse:
             self._check_inverse_of_Tu()
@@ -439,13 +510,11 @@ class Scheme:
           - a sympy version M and invM for each scheme
           - a numerical version Mnum and invMnum for each scheme
           - a global numerical version MnumGlob and invMnumGlob for all the schemes
-        """
-        compt = 0
-        M = []
-        invM = []
-        Mu = []
-        Tu = []
 
+        The parameters which have a numerical value are substituted in M
+        which is then inverted exactly (see :py:func:`exact_inverse`).
+        The matrices are computed once for given velocities, polynomials and parameters.
+        """
         u_tild = sp.Matrix([rel_ux, rel_uy, rel_uz])
 
         if self.symb_la is not None:
@@ -453,43 +522,64 @@ class Scheme:
         else:
             LA = self.la
 
+        pk, pv = param_to_tuple(self.param)
+        subs_param = [(k, v) for k, v in zip(pk, pv) if sp.sympify(v).is_number]
+
+        key = (tuple(tuple(v.num for v in vs) for vs in self.stencil.v), tuple(self.P), LA,
+               tuple(subs_param), tuple(self.symb_coord[:self.dim]), tuple(self.rel_vel))
+        try:
+            # the entry is moved at the end of the most recently used ones
+            matrices = _moments_matrices.pop(key, None)
+        except TypeError:
+            # the parameters can not be hashed
+            key, matrices = None, None
+        if matrices is not None:
+            _moments_matrices[key] = matrices
+            self.M, self.invM, self.Tu, self.Tmu = [A.copy() for A in matrices]
+            return
+
+        M = []
+        invM = []
+        Mu = []
+        Tu = []
+
         for iv, v in enumerate(self.stencil.v):
             p = self.P[self.stencil.nv_ptr[iv] : self.stencil.nv_ptr[iv+1]]
-            compt += 1
             lv = len(v)
             M.append(sp.zeros(lv, lv))
             Mu.append(sp.zeros(lv, lv))
             for i in range(lv):
                 for j in range(lv):
                     sublist = [(str(self.symb_coord[d]), sp.Integer(v[j].v[d])*LA) for d in range(self.dim)]
-                    M[-1][i, j] = p[i].subs(sublist)
+                    M[-1][i, j] = p[i].subs(sublist).subs(subs_param)
 
                     if self.rel_vel != [0]*self.dim:
                         sublist = [(str(self.symb_coord[d]), v[j].v[d]*LA - u_tild[d]) for d in range(self.dim)]
-                        Mu[-1][i, j] = p[i].subs(sublist)
+                        Mu[-1][i, j] = p[i].subs(sublist).subs(subs_param)
 
-            invM.append(M[-1].inv())
-            Tu.append(Mu[-1]*invM[-1])
+            try:
+                invM.append(exact_inverse(M[-1]))
+            except ValueError:
+                log.error("The matrix of the moments of the scheme %d is not invertible:\n%s", iv, sp.pretty(M[-1]))
+                sys.exit()
+            if self.rel_vel != [0]*self.dim:
+                Tu.append(Mu[-1]*invM[-1])
 
         gshape = (self.stencil.nv_ptr[-1], self.stencil.nv_ptr[-1])
         self.Tu = sp.eye(gshape[0])
         self.M = sp.zeros(*gshape)
         self.invM = sp.zeros(*gshape)
 
-        try:
-            for k in range(self.nscheme):
-                nvk = self.stencil.nv[k]
-                for i in range(nvk):
-                    for j in range(nvk):
-                        index = self.stencil.nv_ptr[k] + i, self.stencil.nv_ptr[k] + j
-                        self.M[index] = M[k][i, j]
-                        self.invM[index] = invM[k][i, j]
-
-                        if self.rel_vel != [0]*self.dim:
-                            self.Tu[index] = Tu[k][i, j]
-        except TypeError:
-            log.error("Unable to convert to float the expression %s or %s.\nCheck the 'parameters' entry.", self.M[k][i, j], self.invM[k][i, j]) #pylint: disable=undefined-loop-variable
-            sys.exit()
+        for k in range(self.nscheme):
+            nvk = self.stencil.nv[k]
+            for i in range(nvk):
+                for j in range(nvk):
+                    index = self.stencil.nv_ptr[k] + i, self.stencil.nv_ptr[k] + j
+                    self.M[index] = sp.nsimplify(M[k][i, j], rational=True)
+                    self.invM[index] = invM[k][i, j]
+
+                    if self.rel_vel != [0]*self.dim:
+                        self.Tu[index] = Tu[k][i, j]
 
         alltogether(self.Tu)
         alltogether(self.M)
@@ -501,6 +591,11 @@ class Scheme:
         #     for l in range(gshape[0]):
         #         self.Tmu[k,l] = self.Tu[k,l].subs(list(zip(u_tild, -u_tild)))
 
+        if key is not None:
+            _moments_matrices[key] = [A.copy() for A in [self.M, self.invM, self.Tu, self.Tmu]]
+            while len(_moments_matrices) > MAX_MOMENTS_MATRICES:
+                _moments_matrices.popitem(last=False)
+
     def _check_inverse_of_Tu(self):
         # verification
         res = self.Tu*self.Tmu
@@ -556,7 +651,6 @@ class Scheme:
             the values their indices in the LBM schemes.
 
         """
-        from collections import OrderedDict
         consm_tmp = [s.get('conserved_moments', None) for s in scheme]
         consm = OrderedDict()
 
@@ -738,10 +832,58 @@ class Scheme:
         else:
             return source_terms
 
-    def generate(self, backend, sorder, valin):
+    def generate(self, backend, sorder, valin, skip_solid=False, sparse=False,
+                 nmembers=None, member_parameters=None, tiling=False, inplace=False,
+                 store_moments=None):
         """
         Generate the code by using the appropriated generator
 
+        Parameters
+        ----------
+
+        backend : str
+            the name of the generator
+        sorder : list
+            the storage order
+        valin : int
+            the value of in_or_out in the fluid part
+        skip_solid : bool
+            if True, the function one_time_step only loops over
+            a list of fluid points given by the arguments cells and ncells
+            instead of testing in_or_out on each point (default is False)
+        sparse : bool
+            if True, the code is generated for the sparse storage
+            :py:class:`Sparse<pylbm.storage.Sparse>` with sorder = [1, 0]:
+            the function one_time_step loops over the nfluid first points
+            and uses the table neighbors for the transport (default is False)
+        nmembers : int, optional
+            if given, the code is generated for an ensemble of nmembers
+            simulations stored one after the other along the axis of the velocities
+            (see :py:class:`Ensemble<pylbm.ensemble.Ensemble>`).
+            Only available with the Cython generators (default is None)
+        member_parameters : dict, optional
+            the parameters which take a value for each member of the ensemble:
+            the keys are the symbols and the values the arrays of their values
+            (default is None)
+        tiling : bool
+            if True, the loops over the space of the functions f2m, m2f,
+            equilibrium and one_time_step (if it loops over the whole domain)
+            are traversed by tiles of sizes tile_sizes.
+            Only available with the Cython generators (default is False)
+        inplace : bool
+            if True, the transport is done in place in a single array
+            (AA pattern): the function one_time_step is replaced by
+            the functions one_time_step_even and one_time_step_odd
+            which are called alternately on the array f.
+            Only available with the Cython generators and the dense storage
+            (default is False)
+        store_moments : list, optional
+            the indices of the moments written in the array m by the function
+            one_time_step after the relaxation: they are the moments of the
+            new distribution functions in the fluid points and
+            no separate f2m is needed to get them.
+            Not available with the numpy generator (default is None)
+
         Notes
         -----
 
@@ -767,9 +909,40 @@ class Scheme:
         #     dicoST = None
 
         ns = int(self.stencil.nv_ptr[-1])
-        mv = sp.MatrixSymbol('m', ns, 1)
+        mv = sp.MatrixSymbol('mv', ns, 1)
+
+        from .generator import For, If
 
         subs_param = list(zip(pk, pv))
+        self._batch_args = {}
+        if nmembers is not None:
+            # the functions loop over the members with the index ib:
+            # the varying parameters are read in the arrays p_<name>
+            # and the velocity index k of the member ib is k + ns*ib
+            nmembers_symb = sp.symbols('nmembers', integer=True)
+            ib = sp.Idx(sp.symbols('ib', integer=True), (0, nmembers_symb))
+            ivel = sorder[0]
+            member_parameters = {} if member_parameters is None else member_parameters
+            self._batch_args['nmembers'] = nmembers
+            for k, v in member_parameters.items():
+                self._batch_args['p_{}'.format(k)] = v
+            subs_param = [(k, sp.IndexedBase('p_{}'.format(k), [nmembers_symb])[ib]) if k in member_parameters else (k, v)
+                          for k, v in subs_param]
+
+            def member(array):
+                return array.applyfunc(lambda e: e.base[e.indices[:ivel] +
+                                                        (e.indices[ivel] + ns*ib,) +
+                                                        e.indices[ivel + 1:]])
+
+            def member_loop(instructions):
+                return [For(ib, instructions)]
+        else:
+            def member(array):
+                return array
+
+            def member_loop(instructions):
+                return instructions
+
         subs_moments = list(zip(self.consm.keys(), [mv[int(i), 0] for i in self.consm.values()]))
 
         eq = self.EQ.subs(subs_moments)
@@ -813,25 +986,42 @@ class Scheme:
         alltogether(Mu)
         alltogether(invMu)
 
-        from .generator import For, If
-        from .symbolic import nx, ny, nz, nv, indexed, space_loop
+        from .symbolic import nx, ny, nz, nv, ix, iy, iz, indexed, space_loop
 
         iloop = space_loop([(0, nx), (0, ny), (0, nz)], permutation=sorder) # loop over all spatial points
-        m = indexed('m', [ns, nx, ny, nz], index=[nv] + iloop, ranges=range(ns), permutation=sorder)
-        f = indexed('f', [ns, nx, ny, nz], index=[nv] + iloop, ranges=range(ns), permutation=sorder)
+        m = member(indexed('m', [ns, nx, ny, nz], index=[nv] + iloop, ranges=range(ns), permutation=sorder))
+        f = member(indexed('f', [ns, nx, ny, nz], index=[nv] + iloop, ranges=range(ns), permutation=sorder))
+
+        # the common subexpressions are computed once in local variables
+        # except with numpy where they would be temporary arrays
+        cse = backend.upper() != "NUMPY"
 
         # WARNING: (relative velocties)
         # the moments in the functions f2m, m2f, and equilibrium
         # are the real moments even if the scheme uses a relative velocity
 
         # add the function f2m as m = M f
-        generator.add_routine(('f2m', For(iloop, Eq(m, M*f))), settings={"prefetch":[f[0]]})
+        generator.add_routine(('f2m', For(iloop, member_loop(Eq(m, M*f)))), settings={"prefetch":[f[0]], "parallel":True, "cse":cse, "tiling":tiling})
         # add the function m2f as f = M^(-1) m
-        generator.add_routine(('m2f', For(iloop, Eq(f, invM*m))), settings={"prefetch":[m[0]]})
+        generator.add_routine(('m2f', For(iloop, member_loop(Eq(f, invM*m)))), settings={"prefetch":[m[0]], "parallel":True, "cse":cse, "tiling":tiling})
         # add the function equilibrium
         dummy = eq.subs(list(zip(mv, m)) + subs_param)
         alltogether(dummy)
-        generator.add_routine(('equilibrium', For(iloop, Eq(m, dummy))))
+        generator.add_routine(('equilibrium', For(iloop, member_loop(Eq(m, dummy)))), settings={"parallel":True, "cse":cse, "tiling":tiling})
+
+        if backend.upper() in ['CYTHON', 'CYTHON_OMP'] and not sparse:
+            # add the function f2m_row which computes the moment im on a box
+            # of the space from the distribution functions jf, ..., jf + ns - 1
+            # and the row of the matrix of the moments given in the array row
+            im, jf = sp.symbols('im, jf', integer=True)
+            row = sp.IndexedBase('row', [ns])
+            start = sp.symbols('start_ix, start_iy, start_iz', integer=True)
+            stop = sp.symbols('stop_ix, stop_iy, stop_iz', integer=True)
+            box = space_loop(list(zip(start, stop)), permutation=sorder)
+            m_row = indexed('m', [ns, nx, ny, nz], index=[im] + box, permutation=sorder)
+            f_box = indexed('f', [ns, nx, ny, nz], index=[nv] + box, ranges=[jf + k for k in range(ns)], permutation=sorder)
+            generator.add_routine(('f2m_row', For(box, Eq(m_row, sum(row[k]*f_box[k] for k in range(ns))))),
+                                  settings={"parallel":True})
 
         # fix: set loop with vmax -> DONE ?
         vmax = [0]*3
@@ -839,10 +1029,23 @@ class Scheme:
         iloop = space_loop([(vmax[0], nx-vmax[0]),
                             (vmax[1], ny-vmax[1]),
                             (vmax[2], nz-vmax[2])], permutation=sorder)
-        f = indexed('f', [ns, nx, ny, nz], index=[nv] + iloop, list_ind=self.stencil.get_all_velocities(), permutation=sorder)
-        f_new = indexed('f_new', [ns, nx, ny, nz], index=[nv] + iloop, ranges=range(ns), permutation=sorder)
+        if sparse:
+            # the points are numbered and the transport phase
+            # reads the distribution functions through the table neighbors
+            nfluid = sp.symbols('nfluid', integer=True)
+            neighbors = sp.IndexedBase(sp.symbols('neighbors', integer=True), [nfluid, ns])
+            ic = sp.Idx(sp.symbols('ic', integer=True), (0, nfluid))
+            f = member(sp.Matrix([sp.IndexedBase('f', [nx, ns])[neighbors[ic, k], k] for k in range(ns)]))
+            f_new = member(sp.Matrix([sp.IndexedBase('f_new', [nx, ns])[ic, k] for k in range(ns)]))
+        else:
+            f = member(indexed('f', [ns, nx, ny, nz], index=[nv] + iloop, list_ind=self.stencil.get_all_velocities(), permutation=sorder))
+            f_new = member(indexed('f_new', [ns, nx, ny, nz], index=[nv] + iloop, ranges=range(ns), permutation=sorder))
         in_or_out = indexed('in_or_out', [ns, nx, ny, nz], permutation=sorder, remove_ind=[0])
 
+        # the functions of the time step of a previous scheme are not compiled again
+        for name in ['one_time_step', 'one_time_step_even', 'one_time_step_odd']:
+            generator.routines.pop(name, None)
+
         if backend.upper() == "NUMPY":
             ################## FIX
             #log.error("NUMPY generator not allowed in this version with relative velocities")
@@ -893,40 +1096,73 @@ class Scheme:
             source_eq = source_eq.subs(subs_param).expand()
 
             if all([src_t is None for src_t in self._source_terms]):
-                generator.add_routine(('one_time_step',
-                                       For(iloop,
-                                           If((Eq(in_or_out, valin),
-                                               brv + # build relative velocity
-                                               [Eq(mv, sp.Matrix(Mu*f)), # relative non conserved moments
-                                                #pylint: disable=not-an-iterable
-                                                Eq(mv, (sp.ones(*s.shape) - s).multiply_elementwise(sp.Matrix(mv)) + s.multiply_elementwise(dummy)), # relaxation
-                                                Eq(f_new, invMu*mv), # m2f + update f_new
-                                               ]
-                                              )
-                                             )
-                                          )
-                                      ),
-                                      local_vars=[mv] + list_rel_vel,
-                                      settings={"prefetch":[f[0]]}
-                                     )
+                instructions = (brv + # build relative velocity
+                                [Eq(mv, sp.Matrix(Mu*f)), # relative non conserved moments
+                                 #pylint: disable=not-an-iterable
+                                 Eq(mv, (sp.ones(*s.shape) - s).multiply_elementwise(sp.Matrix(mv)) + s.multiply_elementwise(dummy)), # relaxation
+                                 Eq(f_new, invMu*mv), # m2f + update f_new
+                                ])
             else:
-                generator.add_routine(('one_time_step',
-                                       For(iloop,
-                                           If((Eq(in_or_out, valin),
-                                               brv + # build relative velocity
-                                               [Eq(mv, sp.Matrix(Mu*f)), # relative non conserved moments
-                                                Eq(mv, source_eq), # source terms
-                                                #pylint: disable=not-an-iterable
-                                                Eq(mv, (sp.ones(*s.shape) - s).multiply_elementwise(sp.Matrix(mv)) + s.multiply_elementwise(dummy)), # relaxation
-                                                Eq(mv, source_eq),  # source terms
-                                                Eq(f_new, invMu*mv), # m2f + update f_new
-                                               ]
-                                              )
-                                             )
-                                          )
-                                      ),
-                                      local_vars=[mv] + list_rel_vel,
-                                      settings={"prefetch":[f[0]]}
+                instructions = (brv + # build relative velocity
+                                [Eq(mv, sp.Matrix(Mu*f)), # relative non conserved moments
+                                 Eq(mv, source_eq), # source terms
+                                 #pylint: disable=not-an-iterable
+                                 Eq(mv, (sp.ones(*s.shape) - s).multiply_elementwise(sp.Matrix(mv)) + s.multiply_elementwise(dummy)), # relaxation
+                                 Eq(mv, source_eq),  # source terms
+                                 Eq(f_new, invMu*mv), # m2f + update f_new
+                                ])
+
+            if store_moments:
+                # the moments of f_new are the relaxed moments
+                # (transformed back if the scheme uses a relative velocity)
+                if sparse:
+                    m = member(sp.Matrix([sp.IndexedBase('m', [nx, ns])[ic, k] for k in range(ns)]))
+                else:
+                    m = member(indexed('m', [ns, nx, ny, nz], index=[nv] + iloop, ranges=range(ns), permutation=sorder))
+                if list_rel_vel:
+                    new_moments = self.Tmu.subs(subs_param)*sp.Matrix(mv)
+                else:
+                    new_moments = sp.Matrix(mv)
+                instructions += [Eq(m[k], new_moments[k]) for k in store_moments]
+
+            local_vars = [mv] + list_rel_vel
+            tiling_loop = False
+            if sparse:
+                loops = [('one_time_step', For(ic, member_loop(instructions)))]
+            elif skip_solid:
+                # loop only over the list of the fluid points:
+                # the spatial indices become local variables read in cells
+                # which is flattened: a size-1 axis would be dropped in 1D
+                ncells = sp.symbols('ncells', integer=True)
+                cells = sp.IndexedBase(sp.symbols('cells', integer=True), [self.dim*ncells])
+                ic = sp.Idx(sp.symbols('ic', integer=True), (0, ncells))
+                space_indices = [ix, iy, iz][:self.dim]
+                to_indices = {i: i.label for i in iloop}
+                loops = [('one_time_step', For(ic, [Eq(i, cells[self.dim*ic + k]) for k, i in enumerate(space_indices)] +
+                                               member_loop([instruction.xreplace(to_indices) for instruction in instructions])))]
+                local_vars += space_indices
+            else:
+                routines = [('one_time_step', instructions)]
+                if inplace:
+                    # AA pattern: the even steps read the incoming values by the
+                    # transport and write the value of the velocity k in the
+                    # symmetric velocity of the point x + c_k where the odd steps
+                    # read it back; the odd steps write in the natural order.
+                    # Each point reads and writes the same places of f.
+                    ksym = list(self.stencil.get_symmetric())
+                    f_local = member(indexed('f', [ns, nx, ny, nz], index=[nv] + iloop, ranges=range(ns), permutation=sorder))
+                    even = dict(zip(f_new, f.extract(ksym, [0])))
+                    odd = dict(list(zip(f, f_local.extract(ksym, [0]))) + list(zip(f_new, f_local)))
+                    routines = [(name, [instruction.xreplace(subs) for instruction in instructions])
+                                for name, subs in [('one_time_step_even', even), ('one_time_step_odd', odd)]]
+                loops = [(name, For(iloop, If((Eq(in_or_out, valin), member_loop(routine)))))
+                         for name, routine in routines]
+                tiling_loop = tiling
+
+            for name, loop in loops:
+                generator.add_routine((name, loop),
+                                      local_vars=local_vars,
+                                      settings={"prefetch":[f[0]], "parallel":True, "cse":True, "tiling":tiling_loop}
                                      )
 
             ## FIX: relative velocity
@@ -945,59 +1181,96 @@ class Scheme:
             #                           ), local_vars = [mv] + list_rel_vel, settings={"prefetch":[f[0]]})
 
 
-    #pylint: disable=possibly-unused-variable
+    def _get_sizes(self, mm):
+        sizes = {'nx': mm.nspace[0]}
+        if len(mm.nspace) > 1:
+            sizes['ny'] = mm.nspace[1]
+        if len(mm.nspace) > 2:
+            sizes['nz'] = mm.nspace[2]
+        # the tile sizes of the functions generated with tiling
+        # (an axis which is not tiled is a single tile)
+        for k, n in enumerate(mm.nspace):
+            size = self.tile_sizes[k] if k < len(self.tile_sizes) else None
+            sizes['tile_{}'.format(['ix', 'iy', 'iz'][k])] = size if size else n
+        sizes.update(self._batch_args)
+        return sizes
+
     def m2f(self, mm, ff):
         """ Compute the distribution functions f from the moments m """
-        from .symbolic import call_genfunction
+        self.bind_m2f(mm, ff)()
 
-        nx = mm.nspace[0]
-        if self.dim > 1:
-            ny = mm.nspace[1]
-        if self.dim > 2:
-            nz = mm.nspace[2]
-
-        m = mm.array
-        f = ff.array
+    def bind_m2f(self, mm, ff):
+        """
+        Return the function which computes the distribution functions f
+        from the moments m with all its arguments set.
+        """
+        from .symbolic import bind_genfunction
 
-        args = locals()
-        call_genfunction(generator.module.m2f, args)
+        args = self._get_sizes(mm)
+        args.update(m=mm.array, f=ff.array)
+        return bind_genfunction(generator.module.m2f, args)
 
-    #pylint: disable=possibly-unused-variable
     def f2m(self, ff, mm):
         """ Compute the moments m from the distribution functions f """
-        from .symbolic import call_genfunction
+        self.bind_f2m(ff, mm)()
 
-        nx = mm.nspace[0]
-        if self.dim > 1:
-            ny = mm.nspace[1]
-        if self.dim > 2:
-            nz = mm.nspace[2]
+    def bind_f2m(self, ff, mm):
+        """
+        Return the function which computes the moments m
+        from the distribution functions f with all its arguments set.
+        """
+        from .symbolic import bind_genfunction
 
-        m = mm.array
-        f = ff.array
+        args = self._get_sizes(mm)
+        args.update(m=mm.array, f=ff.array)
+        return bind_genfunction(generator.module.f2m, args)
 
-        args = locals()
-        call_genfunction(generator.module.f2m, args)
+    def f2m_row(self, ff, mm, im, box=None, module=None):
+        """
+        Compute the moment im from the distribution functions f
+        with only one row of the matrix of the moments.
+
+        box is the list of the first and the last + 1 indices of the points
+        along each axis (default is None which means the whole domain).
+        The moments of the member b of an ensemble follow the ones
+        of the previous members.
+        module is the compiled module of the simulation (default is
+        None which means the module of the generator).
+        """
+        from .symbolic import bind_genfunction
+
+        ns = self.stencil.nv_ptr[-1]
+        member, row = divmod(im, ns)
+        args = self._get_sizes(mm)
+        args.update(m=mm.array, f=ff.array, im=im, jf=member*ns,
+                    row=self.Mnum[row].astype(ff.array.dtype))
+        if box is None:
+            box = [(0, n) for n in mm.nspace]
+        for axis, (start, stop) in zip(['ix', 'iy', 'iz'], box):
+            args['start_' + axis] = start
+            args['stop_' + axis] = stop
+        if module is None:
+            module = generator.module
+        bind_genfunction(module.f2m_row, args)()
 
     # def transport(self, f):
     #     """ The transport phase on the distribution functions f """
     #     mod.transport(f.array)
 
-    #pylint: disable=possibly-unused-variable
     def equilibrium(self, mm):
         """ Compute the equilibrium """
-        from .symbolic import call_genfunction
+        self.bind_equilibrium(mm)()
 
-        nx = mm.nspace[0]
-        if self.dim > 1:
-            ny = mm.nspace[1]
-        if self.dim > 2:
-            nz = mm.nspace[2]
-
-        m = mm.array
+    def bind_equilibrium(self, mm):
+        """
+        Return the function which computes the equilibrium
+        with all its arguments set.
+        """
+        from .symbolic import bind_genfunction
 
-        args = locals()
-        call_genfunction(generator.module.equilibrium, args)
+        args = self._get_sizes(mm)
+        args.update(m=mm.array)
+        return bind_genfunction(generator.module.equilibrium, args)
 
     # def relaxation(self, m):
     #     """ The relaxation phase on the moments m """
@@ -1009,23 +1282,50 @@ class Scheme:
     #     mod = self.generator.get_module()
     #     mod.source_term(m.array, tn, dt, x, y, z)
 
-    #pylint: disable=possibly-unused-variable, unused-argument
     def onetimestep(self, mm, ff, ff_new, in_or_out, valin, tn=0., dt=0., x=0., y=0., z=0.):
         """ Compute one time step of the Lattice Boltzmann method """
-        from .symbolic import call_genfunction
+        self.bind_onetimestep(mm, ff, ff_new, in_or_out, valin, tn, dt, x, y, z)()
+
+    def bind_onetimestep(self, mm, ff, ff_new, in_or_out, valin, tn=0., dt=0., x=0., y=0., z=0.,
+                         cells=None, neighbors=None, parity=None):
+        """
+        Return the function which computes one time step of the
+        Lattice Boltzmann method from ff to ff_new with all its arguments set.
+
+        cells is the list of the fluid points used when the code
+        is generated with skip_solid and neighbors is the table
+        used when the code is generated for the sparse storage.
+        parity ('even' or 'odd') selects the function of the in-place
+        transport when the code is generated with inplace: ff_new is
+        then not used.
+        """
+        from .symbolic import bind_genfunction
 
-        nx = mm.nspace[0]
-        if self.dim > 1:
-            ny = mm.nspace[1]
-        if self.dim > 2:
-            nz = mm.nspace[2]
+        args = self.get_onetimestep_args(mm, ff, ff_new, in_or_out, valin, tn, dt, x, y, z,
+                                         cells, neighbors)
+        if parity is not None:
+            return bind_genfunction(getattr(generator.module, 'one_time_step_' + parity), args)
+        return bind_genfunction(generator.module.one_time_step, args)
 
-        m = mm.array
-        f = ff.array
-        f_new = ff_new.array
+    def get_onetimestep_args(self, mm, ff, ff_new, in_or_out, valin, tn=0., dt=0., x=0., y=0., z=0.,
+                             cells=None, neighbors=None):
+        """
+        Return the arguments of the function which computes one time step
+        (see :py:meth:`bind_onetimestep<pylbm.scheme.Scheme.bind_onetimestep>`).
 
-        args = locals()
-        call_genfunction(generator.module.one_time_step, args)
+        Returns
+        -------
+        dict
+            the arguments (name: value)
+        """
+        args = self._get_sizes(mm)
+        args.update(m=mm.array, f=ff.array, f_new=ff_new.array,
+                    in_or_out=in_or_out, valin=valin, tn=tn, dt=dt, x=x, y=y, z=z)
+        if cells is not None:
+            args.update(cells=cells.ravel(), ncells=cells.shape[0])
+        if neighbors is not None:
+            args.update(neighbors=neighbors, nfluid=neighbors.shape[0])
+        return args
 
     @staticmethod
     def set_boundary_conditions(f, m, bc, interface):
@@ -9,7 +9,9 @@ pylbm simulation
 """
 
 import sys
+import json
 import logging
+from collections import OrderedDict
 from six.moves import range
 from six import string_types
 import numpy as np
@@ -24,7 +26,7 @@ from .validator import validate
 from .context import set_queue
 from .generator import generator
 
-from .storage import Array, AOS, SOA
+from .storage import Array, AOS, SOA, Sparse
 
 log = logging.getLogger(__name__) #pylint: disable=invalid-name
 
@@ -38,15 +40,22 @@ class Simulation:
     dico : dictionary
     domain : object of class :py:class:`Domain<pylbm.domain.Domain>`, optional
     scheme : object of class :py:class:`Scheme<pylbm.scheme.Scheme>`, optional
-    type :   optional argument (default value is 'float64')
+    dtype : optional argument 'float64' or 'float32' (default value is 'float64')
+      the type of the distribution functions and of the computations
+    moments_dtype : optional argument 'float64' or 'float32'
+      the type of the moments and of the computations of the time step
+      (default value is dtype). The mixed precision is obtained with
+      dtype='float32' and moments_dtype='float64'.
 
     Attributes
     ----------
 
     dim : int
       spatial dimension
-    type : float64
-      the type of the values
+    type : numpy.dtype
+      the type of the distribution functions
+    moments_type : numpy.dtype
+      the type of the moments
     domain : :py:class:`Domain<pylbm.domain.Domain>`
       the domain given in argument
     scheme : :py:class:`Scheme<pylbm.scheme.Scheme>`
@@ -59,6 +68,29 @@ class Simulation:
       a numpy array that contains the values of the moments in each point
     F_halo : numpy array
       a numpy array that contains the values of the distribution functions in each point
+    fuse_time_loop : bool
+      if True (key 'fuse_time_loop' of the dictionary), the time steps of
+      :py:meth:`run<pylbm.simulation.Simulation.run>` are computed by one
+      generated function which applies the periodic copies, the boundary
+      conditions and the time step (only with the Cython generator on a single process)
+    cpu_time : dict
+      the computational time spent in each phase of the time loop on this process
+    fluid_cells : numpy array
+      the indices of the fluid points used by the time step
+      if the key 'skip_solid_cells' or 'mpi_overlap' of the dictionary is True, None otherwise
+    mpi_overlap : bool
+      if True (key 'mpi_overlap' of the dictionary), the halo exchange is
+      overlapped by the computations which do not need the ghost points
+    inplace : bool
+      if True (key 'inplace_streaming' of the dictionary), the transport
+      is done in place in a single array of distribution functions
+    store_moments : list
+      the indices of the moments of the scheme written in the array
+      of the moments by each time step (key 'store_moments' of the dictionary)
+    fuse_bc : bool
+      if True (key 'fuse_boundary_conditions' of the dictionary), all the
+      boundary methods are applied by one generated function called after
+      the halo update (only with the Cython generators)
 
     Examples
     --------
@@ -100,12 +132,57 @@ class Simulation:
     :py:meth:`one_time_step<pylbm.simulation.Simulation.one_time_step>`
     are just call of the methods of the class
     :py:class:`Scheme<pylbm.scheme.Scheme>`.
+
+    Use :py:meth:`run<pylbm.simulation.Simulation.run>` to compute
+    several time steps.
+
+    With the Cython generators, the key 'tiling' of the dictionary
+    traverses the loops over the space by tiles which improves the use
+    of the cache for the large 3D domains: the value is the list of
+    the tile sizes for each axis (None or 0 if the axis is not tiled) or True
+    to choose the tile sizes by measuring the time of one_time_step
+    at the end of the initialization. The tile sizes are stored in
+    the attribute tile_sizes of the scheme.
+
+    With the Cython generators and the dense storage, the key
+    'inplace_streaming' of the dictionary stores only one array of
+    distribution functions instead of two: the time steps alternately
+    call the functions one_time_step_even and one_time_step_odd
+    of the AA pattern. After an even step, the distribution functions
+    are not stored in the natural order: they are put back in the
+    natural order when F, m or the methods f2m and m2f are used
+    (the values in the solid points, which are not computed, can differ
+    from the ones obtained with two arrays).
+
+    With the Cython generators, the key 'store_moments' of the dictionary
+    writes moments in the array of the moments during the time step:
+    the value is the list of these moments (conserved moments or indices)
+    or True for all the conserved moments. They are then read by m
+    without computing them from the distribution functions
+    (the moments in the solid points, which are not computed,
+    are the ones of the previous time steps).
+
+    The boundary values can depend on the time: they are evaluated
+    again at the beginning of the time steps (every 'update_every'
+    time steps of the label) in the arrays prepared at the initialization
+    (see :py:class:`BoundaryMethod<pylbm.boundary.BoundaryMethod>`).
     """
+    # the number of simulations advanced together and their varying parameters
+    # (see :py:class:`Ensemble<pylbm.ensemble.Ensemble>`)
+    nmembers = 1
+    _member_parameters = None
+
     #pylint: disable=too-many-branches, too-many-statements, too-many-locals
-    def __init__(self, dico, domain=None, scheme=None, sorder=None, dtype='float64', check_inverse=False):
-        self.type = dtype
+    def __init__(self, dico, domain=None, scheme=None, sorder=None, dtype='float64', check_inverse=False,
+                 moments_dtype=None):
+        self.type = np.dtype(dtype)
+        self.moments_type = self.type if moments_dtype is None else np.dtype(moments_dtype)
         self.order = 'C'
-        self._update_m = True
+
+        for dtyp in [self.type, self.moments_type]:
+            if dtyp not in [np.float32, np.float64]:
+                log.error('Simulation: the type %s is not supported (only float32 and float64)', dtyp)
+                sys.exit()
 
         validate(dico, __class__.__name__)
 
@@ -140,11 +217,17 @@ class Simulation:
 
         self.dim = self.domain.dim
 
+        log.info('Build boundary conditions')
+
+        self.bc = Boundary(self.domain, dico)
+        for method in self.bc.methods:
+            method.set_iload()
+
         log.info('Build arrays')
 
         self.mpi_topo = self.domain.mpi_topo
 
-        nv = self.scheme.stencil.nv_ptr[-1]
+        nv = self.scheme.stencil.nv_ptr[-1]*self.nmembers
         nspace = self.domain.global_size
         vmax = self.domain.stencil.vmax
 
@@ -153,32 +236,132 @@ class Simulation:
         set_queue(self.generator)
         self.gpu_support = True if self.generator == "LOOPY" else False
 
-        if sorder is None:
-            if self.generator == "NUMPY":
-                self._m = SOA(nv, nspace, vmax, self.mpi_topo, gpu_support=self.gpu_support)
-                self._F = SOA(nv, nspace, vmax, self.mpi_topo, gpu_support=self.gpu_support)
-                #self._Fold = self._F
-                sorder = [i for i in range(self.dim + 1)]
-            else:
-                self._m = AOS(nv, nspace, vmax, self.mpi_topo, gpu_support=self.gpu_support)
-                self._F = AOS(nv, nspace, vmax, self.mpi_topo, gpu_support=self.gpu_support)
-                sorder = [self.dim] + [i for i in range(self.dim)]
-        else:
-            self._m = Array(nv, nspace, vmax, sorder, self.mpi_topo, gpu_support=self.gpu_support)
-            self._F = Array(nv, nspace, vmax, sorder, self.mpi_topo, gpu_support=self.gpu_support)
-
-        self._m.set_conserved_moments(self.scheme.consm)
-        self._F.set_conserved_moments(self.scheme.consm)
+        self.sparse = dico.get('storage', 'dense') == 'sparse'
 
-        if self.generator == "NUMPY":
-            self._Fold = self._F
+        # the distribution functions are stored in the single array _F
+        # which is alternately in the natural order and in the order
+        # of the odd steps of the AA pattern
+        self.inplace = dico.get('inplace_streaming', False)
+        self._inplace_odd = False
+        if self.inplace:
+            try:
+                self.scheme.stencil.get_symmetric()
+                symmetric = True
+            except ValueError:
+                symmetric = False
+            if self.generator not in ['CYTHON', 'CYTHON_OMP'] or self.sparse or not symmetric \
+               or dico.get('skip_solid_cells', False) or dico.get('mpi_overlap', False):
+                log.warning('inplace_streaming is only available with the Cython generators, the dense storage '
+                            'and a symmetric stencil without skip_solid_cells and mpi_overlap')
+                self.inplace = False
+        if self.sparse:
+            if self.generator not in ['CYTHON', 'CYTHON_OMP']:
+                log.error('The sparse storage is only available with the Cython generators')
+                sys.exit()
+            if self.mpi_topo.comm.Get_size() > 1:
+                log.error('The sparse storage can not be used with several processes')
+                sys.exit()
+            if sorder is not None:
+                log.warning('sorder is ignored with the sparse storage')
+
+            # the points used by the boundary conditions must be stored
+            extra_cells = [np.zeros((0, self.dim), dtype=np.int32)]
+            for method in self.bc.methods:
+                extra_cells.append(method.istore[1:].T)
+                extra_cells += [iload[1:].T for iload in method.iload]
+            cells, nfluid = self.domain.get_sparse_cells(np.concatenate(extra_cells))
+            shape_halo = self.domain.shape_halo
+
+            self._m = Sparse(nv, cells, shape_halo, vmax, dtype=self.moments_type)
+            self._F = Sparse(nv, cells, shape_halo, vmax, dtype=self.type)
+            self._Fold = Sparse(nv, cells, shape_halo, vmax, dtype=self.type)
+            self._neighbors = self._F.get_neighbors(self.scheme.stencil.get_all_velocities(), nfluid)
+            sorder = self._F.sorder
         else:
-            self._Fold = Array(nv, nspace, vmax, sorder, self.mpi_topo, gpu_support=self.gpu_support)
-            self._Fold.set_conserved_moments(self.scheme.consm)
-
-        self.scheme.generate(self.generator, sorder, self.domain.valin)
+            self._neighbors = None
+            if sorder is None:
+                if self.generator == "NUMPY":
+                    self._m = SOA(nv, nspace, vmax, self.mpi_topo, dtype=self.moments_type, gpu_support=self.gpu_support)
+                    self._F = SOA(nv, nspace, vmax, self.mpi_topo, dtype=self.type, gpu_support=self.gpu_support)
+                    #self._Fold = self._F
+                    sorder = [i for i in range(self.dim + 1)]
+                else:
+                    self._m = AOS(nv, nspace, vmax, self.mpi_topo, dtype=self.moments_type, gpu_support=self.gpu_support)
+                    self._F = AOS(nv, nspace, vmax, self.mpi_topo, dtype=self.type, gpu_support=self.gpu_support)
+                    sorder = [self.dim] + [i for i in range(self.dim)]
+            else:
+                self._m = Array(nv, nspace, vmax, sorder, self.mpi_topo, dtype=self.moments_type, gpu_support=self.gpu_support)
+                self._F = Array(nv, nspace, vmax, sorder, self.mpi_topo, dtype=self.type, gpu_support=self.gpu_support)
 
-        log.info('Build boundary conditions')
+            if self.generator == "NUMPY" or self.inplace:
+                self._Fold = self._F
+            else:
+                self._Fold = Array(nv, nspace, vmax, sorder, self.mpi_topo, dtype=self.type, gpu_support=self.gpu_support)
+
+        # the moments which are up to date on the whole domain
+        # and the ones written in the interior domain by the time step
+        self._valid_m = np.zeros(nv, dtype=bool)
+        self._stored_m = np.zeros(nv, dtype=bool)
+        self.store_moments = dico.get('store_moments', False)
+        if self.store_moments is True:
+            self.store_moments = list(self.scheme.consm.keys())
+        if self.store_moments:
+            if self.generator not in ['CYTHON', 'CYTHON_OMP']:
+                log.warning('store_moments is only available with the Cython generators')
+                self.store_moments = []
+            else:
+                self.store_moments = sorted(set(self.scheme.consm[k] if isinstance(k, sp.Symbol) else k
+                                                for k in self.store_moments))
+        else:
+            self.store_moments = []
+        ns = self.scheme.stencil.nv_ptr[-1]
+        self._stored_rows = np.array([k + b*ns for b in range(self.nmembers) for k in self.store_moments], dtype=int)
+
+        consm = self._get_conserved_moments()
+        self._m.set_conserved_moments(consm)
+        self._F.set_conserved_moments(consm)
+        self._Fold.set_conserved_moments(consm)
+
+        self.fluid_cells = None
+        if dico.get('skip_solid_cells', False) and not self.sparse:
+            if self.generator in ['CYTHON', 'CYTHON_OMP']:
+                self.fluid_cells = self.domain.get_fluid_cells()
+            else:
+                log.warning('skip_solid_cells is only available with the Cython generators')
+
+        # the time step loops over lists of fluid points to split the
+        # computations which need the ghost points from the others
+        self.mpi_overlap = dico.get('mpi_overlap', False)
+        if self.mpi_overlap:
+            if self.generator in ['CYTHON', 'CYTHON_OMP'] and not self.sparse:
+                self.fluid_cells = self.domain.get_fluid_cells()
+            else:
+                log.warning('mpi_overlap is only available with the Cython generators and the dense storage')
+                self.mpi_overlap = False
+
+        # all the boundary methods are applied by one generated function
+        self.fuse_bc = dico.get('fuse_boundary_conditions', False) and len(self.bc.methods) > 0
+        if self.fuse_bc and self.generator not in ['CYTHON', 'CYTHON_OMP']:
+            log.warning('fuse_boundary_conditions is only available with the Cython generators')
+            self.fuse_bc = False
+
+        # the loops over the space are traversed by tiles whose sizes are
+        # given for each axis or tuned at the end of the initialization
+        tiling = dico.get('tiling', False)
+        if tiling is not False:
+            if self.generator not in ['CYTHON', 'CYTHON_OMP'] or self.sparse:
+                log.warning('tiling is only available with the Cython generators and the dense storage')
+                tiling = False
+            elif tiling is not True:
+                self.scheme.tile_sizes = list(tiling) + [None]*(self.dim - len(tiling))
+
+        t_generation = mpi.Wtime()
+        self.scheme.generate(self.generator, sorder, self.domain.valin,
+                             skip_solid=self.fluid_cells is not None, sparse=self.sparse,
+                             nmembers=self.nmembers if self._member_parameters is not None else None,
+                             member_parameters=self._member_parameters,
+                             tiling=tiling is not False, inplace=self.inplace,
+                             store_moments=self.store_moments)
 
         if self.gpu_support:
             try:
@@ -189,69 +372,445 @@ class Simulation:
                 raise ImportError("Please install loo.py")
             self.domain.in_or_out = cl.array.to_device(queue, self.domain.in_or_out)
 
-        self.bc = Boundary(self.domain, dico)
         for method in self.bc.methods:
-            method.set_iload()
             method.generate(sorder)
-
-        generator.compile(backend=self.generator, verbose=self.show_code)
+            if self.nmembers == 1:
+                method.generate_values(self.scheme, self.dim)
+        if self.fuse_bc:
+            self.bc.generate(sorder)
+        else:
+            # the fused boundary conditions of a previous simulation are not compiled again
+            generator.routines.pop('boundary_conditions', None)
+        # the periodic ghost points of a single process are copied in memory
+        # (the copies of a previous simulation are not compiled again)
+        for axis in 'xyz':
+            generator.routines.pop('periodic_' + axis, None)
+        if self.generator in ['CYTHON', 'CYTHON_OMP'] and not self.sparse:
+            for array in [self._F, self._Fold]:
+                array.generate_periodic()
+
+        # the time loop of run is generated with the routines
+        # of the boundary conditions and of the time step
+        self.fuse_time_loop = dico.get('fuse_time_loop', False)
+        if self.fuse_time_loop:
+            self._generate_time_loop(sorder)
+        else:
+            # the time loop of a previous simulation is not compiled again
+            generator.routines.pop('time_loop', None)
+
+        # the moments and the local variables of the generated functions
+        # have the type moments_type, the other real arrays the type of
+        # the distribution functions except in_or_out given by the domain
+        dtypes = {'default': self.type.name,
+                  'local': self.moments_type.name,
+                  'm': self.moments_type.name,
+                  'in_or_out': self.domain.in_or_out.dtype.name}
+        t_compilation = mpi.Wtime()
+        generator.compile(backend=self.generator, verbose=self.show_code,
+                          settings={'openmp': dico.get('openmp', {}),
+                                    'dtype': dtypes})
+        t_end = mpi.Wtime()
+        # the functions called after the initialization are taken in the
+        # module of this simulation and not of the last compiled one
+        self._module = generator.module
+        if self.generator in ['CYTHON', 'CYTHON_OMP'] and not self.sparse:
+            for array in [self._F, self._Fold]:
+                array.bind_periodic(self._module)
+        for name, ops in generator.count_operations().items():
+            log.info('%s: %d floating point operations and %d bytes per point', name, ops['flops'], ops['bytes'])
 
         log.info('Initialization')
         self.initialization(dico)
         for method in self.bc.methods:
             method.prepare_rhs(self)
             method.set_rhs()
+            if self.nmembers > 1:
+                method.set_members(self.nmembers)
+            if self.inplace:
+                method.set_inplace()
+            if self.sparse:
+                method.set_sparse(self._F)
             method.fix_iload()
             method.move2gpu()
 
+        # the boundary conditions whose values depend on the time
+        self._time_bc = [method for method in self.bc.methods if method.time_dependent]
+        if self._time_bc and self.gpu_support:
+            log.warning('the boundary values which depend on the time are not available with loopy')
+            self._time_bc = []
+        if self._time_bc and self.fuse_time_loop:
+            log.warning('fuse_time_loop is not available with boundary values which depend on the time')
+            self.fuse_time_loop = False
+
+        if self.mpi_overlap:
+            self._set_overlap()
+
+        if self.inplace:
+            ns = self.scheme.stencil.nv_ptr[-1]
+            ksym = self.scheme.stencil.get_symmetric()
+            self._F.set_inplace(np.tile(self.scheme.stencil.get_all_velocities(), (self.nmembers, 1)),
+                                np.concatenate([ksym + b*ns for b in range(self.nmembers)]))
+
         #computational time measurement
         self.cpu_time = {
             'relaxation':0.,
             'source_term':0.,
             'transport':0.,
             'f2m_m2f':0.,
+            'halo_exchange':0.,
+            'halo_hidden':0.,
             'boundary_conditions':0.,
+            'boundary_methods':OrderedDict((method.name, 0.) for method in ([self.bc] if self.fuse_bc else self.bc.methods)),
+            'one_time_step':0.,
+            'callback':0.,
             'total':0.,
             'number_of_iterations':0,
             'MLUPS':0.,
+            'boundary_setup':self.bc.setup_time,
+            'code_generation':t_compilation - t_generation,
+            'compilation':t_end - t_compilation,
         }
 
+        self._bind()
+        if tiling is True:
+            self._tune_tiling()
+
+    def _get_conserved_moments(self):
+        """
+        return the indices of the conserved moments in the arrays _m and _F.
+        """
+        return self.scheme.consm
+
+    def _set_overlap(self):
+        """
+        split the fluid points and the boundary conditions between
+        the ones which can be computed during the halo exchange
+        and the ones which need the ghost points.
+
+        The conditions which can be applied during the exchange do not read
+        the ghost points and do not write in the ghost points and in the points
+        sent to the neighbors. The fluid points computed during the exchange
+        do not read the ghost points and the points written by the other conditions.
+
+        The persistent requests of the exchange are created for _F and _Fold.
+        """
+        for array in [self._F, self._Fold]:
+            array.set_overlap()
+
+        shape = self.domain.shape_halo
+        vmax = np.asarray(self.domain.stencil.vmax, dtype=np.int32)
+
+        ghost = np.ones(shape, dtype=bool)
+        ghost[tuple(slice(v, n - v) for n, v in zip(shape, vmax))] = False
+        exchanged = np.ones(shape, dtype=bool)
+        exchanged[tuple(slice(2*v, n - 2*v) for n, v in zip(shape, vmax))] = False
+
+        dirty = ghost.copy()
+        self._bc_overlap = []
+        for method in self.bc.methods:
+            istore = tuple(method.istore[:, 1:].T)
+            inside = np.logical_not(exchanged[istore])
+            for iload in method.iload:
+                inside &= np.logical_not(ghost[tuple(iload[:, 1:].T)])
+            dirty[istore] |= np.logical_not(inside)
+            self._bc_overlap.append((np.where(inside)[0], np.where(np.logical_not(inside))[0]))
+
+        cells = self.fluid_cells
+        v = self.domain.stencil.get_all_velocities()
+        # the points read by the transport phase on each fluid point
+        points = np.moveaxis(cells[:, np.newaxis, :] - v[np.newaxis, :, :], -1, 0)
+        inside = np.logical_not(np.any(dirty[tuple(points)], axis=1))
+        self._cells_overlap = (np.ascontiguousarray(cells[inside]), np.ascontiguousarray(cells[np.logical_not(inside)]))
+
+    def _bind(self):
+        """
+        prepare the generated functions with all their arguments set
+        for the two possible states of the arrays _F and _Fold.
+
+        self._kernels[0] contains the functions which use the current
+        array _F and is swapped with self._kernels[1] at each time step.
+
+        With mpi_overlap, the functions with the suffix _strip
+        are called after the halo exchange.
+
+        With the in-place transport, the two states are the parities
+        of the next step of the AA pattern.
+        """
+        from .symbolic import bind_genfunction
+
+        self._kernels = []
+        if self.inplace:
+            states = [(self._F, self._F, parity) for parity in ['even', 'odd']]
+            if self._inplace_odd:
+                states.reverse()
+        else:
+            states = [(self._F, self._Fold, None), (self._Fold, self._F, None)]
+        for ff, ff_new, parity in states:
+            def one_time_step(cells, ff=ff, ff_new=ff_new, parity=parity):
+                return self.scheme.bind_onetimestep(self._m, ff, ff_new,
+                                                    self.domain.in_or_out, self.domain.valin,
+                                                    self.t, self.dt, *self.domain.coords,
+                                                    cells=cells,
+                                                    neighbors=self._neighbors,
+                                                    parity=parity)
+            kernels = {
+                'parity': parity,
+                'f2m': self.scheme.bind_f2m(ff, self._m),
+                'm2f': self.scheme.bind_m2f(self._m, ff),
+            }
+            if self.mpi_overlap:
+                inside = [conditions for conditions, _ in self._bc_overlap]
+                outside = [conditions for _, conditions in self._bc_overlap]
+                if self.fuse_bc:
+                    kernels['boundary_conditions'] = [(self.bc.name, self.bc.bind(ff, inside))]
+                    kernels['boundary_conditions_strip'] = [(self.bc.name, self.bc.bind(ff, outside))]
+                else:
+                    kernels['boundary_conditions'] = [(method.name, method.bind(ff, conditions))
+                                                      for method, conditions in zip(self.bc.methods, inside)
+                                                      if conditions.size > 0]
+                    kernels['boundary_conditions_strip'] = [(method.name, method.bind(ff, conditions))
+                                                            for method, conditions in zip(self.bc.methods, outside)
+                                                            if conditions.size > 0]
+                kernels['one_time_step'] = one_time_step(self._cells_overlap[0])
+                kernels['one_time_step_strip'] = one_time_step(self._cells_overlap[1])
+            elif self.fuse_bc:
+                kernels['boundary_conditions'] = [(self.bc.name, self.bc.bind(ff, parity=parity))]
+                kernels['one_time_step'] = one_time_step(self.fluid_cells)
+            else:
+                kernels['boundary_conditions'] = [(method.name, method.bind(ff, parity=parity)) for method in self.bc.methods]
+                kernels['one_time_step'] = one_time_step(self.fluid_cells)
+            if self.fuse_time_loop:
+                # the number of loops is given at each call
+                args = ff.get_periodic_args()
+                args.update(self.bc.get_args(ff))
+                args.update(self.scheme.get_onetimestep_args(self._m, ff, ff_new,
+                                                             self.domain.in_or_out, self.domain.valin,
+                                                             self.t, self.dt, *self.domain.coords,
+                                                             cells=self.fluid_cells))
+                kernels['time_loop'] = bind_genfunction(generator.module.time_loop, args, unbound=['nloops'])
+            self._kernels.append(kernels)
+        self._equilibrium = self.scheme.bind_equilibrium(self._m)
+
+    def _tune_tiling(self, candidates=(4, 8, 16, 32, 64), repeat=3):
+        """
+        choose the tile sizes which minimize the time of the function one_time_step.
+
+        The axes are tuned one after the other by trying the tile sizes
+        given by candidates. The axis of the points which are contiguous
+        in memory is not tiled. The function one_time_step only writes in the
+        array _Fold: the computation of the next time step is not modified.
+        With the in-place transport, the array _F is saved and restored.
+        """
+        if self.fluid_cells is not None:
+            # one_time_step loops over a list of points
+            return
+        saved = self._F.array.copy() if self.inplace else None
+
+        sorder = self._F.sorder
+        contiguous = max(range(self.dim), key=lambda k: sorder[k + 1])
+        nspace = self._F.nspace
+
+        def measure():
+            # the best time of several calls is less sensitive to the noise
+            self._bind()
+            kernel = self._kernels[0]['one_time_step']
+            kernel()
+            times = []
+            for _ in range(repeat):
+                t_begin = mpi.Wtime()
+                kernel()
+                times.append(mpi.Wtime() - t_begin)
+            return min(times)
+
+        best = measure()
+        for k in range(self.dim):
+            if k == contiguous:
+                continue
+            best_size = self.scheme.tile_sizes[k]
+            for size in candidates:
+                if size >= nspace[k]:
+                    break
+                self.scheme.tile_sizes[k] = size
+                time = measure()
+                if time < best:
+                    best, best_size = time, size
+            self.scheme.tile_sizes[k] = best_size
+        if saved is not None:
+            self._F.array[...] = saved
+        self._bind()
+        log.info('Tile sizes: %s', self.scheme.tile_sizes)
+
+    def _swap(self):
+        """
+        swap the arrays _F and _Fold and their prepared functions.
+        """
+        self._F, self._Fold = self._Fold, self._F
+        self._kernels.reverse()
+        if self.inplace:
+            self._inplace_odd = not self._inplace_odd
+
+    def _natural_layout(self):
+        """
+        put the distribution functions back in the natural order
+        after an even step of the in-place transport.
+
+        The next step is then an even step.
+        """
+        if self._inplace_odd:
+            self._F.swap_layout()
+            self._kernels.reverse()
+            self._inplace_odd = False
+
+    def _generate_time_loop(self, sorder):
+        """
+        generate the function time_loop which computes two time steps
+        by loop: the arrays f and f_new are exchanged in the second one.
+
+        Each time step copies the periodic ghost points
+        (see :py:meth:`generate_periodic<pylbm.storage.Array.generate_periodic>`), applies the
+        fused boundary conditions and calls one_time_step: the boundary
+        conditions are then always fused
+        (see :py:meth:`generate<pylbm.boundary.Boundary.generate>`).
+        """
+        time = [str(self.scheme.symb_t), 'tn']
+        if self.generator != 'CYTHON' or self.sparse or self.inplace or len(self._F.local_directions) < self.dim:
+            log.warning('fuse_time_loop is only available with the Cython generator, the dense storage '
+                        'and two arrays of distribution functions on a single process')
+            self.fuse_time_loop = False
+        elif any(str(arg.name) in time for arg in generator.routines['one_time_step'].arguments):
+            log.warning('fuse_time_loop is not available with source terms which depend on the time')
+            self.fuse_time_loop = False
+        if not self.fuse_time_loop:
+            generator.routines.pop('time_loop', None)
+            return
+
+        if self.bc.methods and not self.fuse_bc:
+            self.fuse_bc = True
+            self.bc.generate(sorder)
+
+        names = ['periodic_' + 'xyz'[d] for d in self._F.local_directions]
+        if self.fuse_bc:
+            names.append('boundary_conditions')
+        names.append('one_time_step')
+        steps = [(name, {}) for name in names] + [(name, {'f': 'f_new', 'f_new': 'f'}) for name in names]
+        generator.add_loop('time_loop', steps, sp.symbols('nloops', integer=True))
+
     @utils.itemproperty
     def m_halo(self, i):
         """
         get the moment i on the whole domain with halo points.
+
+        i can be followed by the indices of a region: m_halo[i, 2:5]
+        only computes the moment on this region.
         """
-        if self._update_m:
-            self._update_m = False
-            self.f2m()
-        return self._m[i]
+        return self._get_moments(i, halo=True)
 
     @m_halo.setter
     def m_halo(self, i, value):
-        self._update_m = False
         self._m[i] = value
+        self._valid_m[self._moment_rows(i)] = True
 
     @utils.itemproperty
     def m(self, i):
         """
         get the moment i in the interior domain.
+
+        i can be followed by the indices of a region of the interior
+        domain: m[i, 2:5] only computes the moment on this region.
+        """
+        return self._get_moments(i, halo=False)
+
+    def _moment_rows(self, key):
+        """
+        return the indices in the array _m of the moments given by key.
+        """
+        if isinstance(key, tuple):
+            key = key[0]
+        if isinstance(key, sp.Symbol):
+            key = self._m.consm[key]
+        return np.atleast_1d(np.arange(self._m.nv)[key])
+
+    def _get_box(self, region, halo):
+        """
+        return the first and the last + 1 indices along each axis
+        of a box of the array _m which contains the region.
+        """
+        if Ellipsis in region:
+            return None
+        box = []
+        for axis, n in enumerate(self._m.nspace):
+            offset = 0 if halo else self.domain.stencil.vmax[axis]
+            size = n - 2*offset
+            key = region[axis] if axis < len(region) else slice(None)
+            if isinstance(key, slice):
+                start, stop, step = key.indices(size)
+                if step < 0:
+                    start, stop = stop + 1, start + 1
+            elif isinstance(key, (int, np.integer)):
+                start = key + size if key < 0 else key
+                stop = start + 1
+            else:
+                start, stop = 0, size
+            box.append((offset + start, offset + max(start, stop)))
+        return box
+
+    def _get_moments(self, key, halo):
         """
-        if self._update_m:
-            self._update_m = False
+        return the moments given by key computed from the distribution functions
+        if they are not up to date.
+
+        key is the moment (index, slice or conserved moment) optionally
+        followed by the indices of a region (with the halo points if halo
+        is True, in the interior domain otherwise). Only the rows of the
+        matrix of the moments which are needed are used and only
+        the region is computed. The moments computed on the whole domain
+        are kept until the distribution functions are modified.
+        """
+        self._natural_layout()
+        rows = self._moment_rows(key)
+        if halo:
+            stale = [k for k in rows if not self._valid_m[k]]
+        else:
+            stale = [k for k in rows if not (self._valid_m[k] or self._stored_m[k])]
+        region = key[1:] if isinstance(key, tuple) else ()
+        if isinstance(key, tuple):
+            key = key[0]
+        if isinstance(key, sp.Symbol):
+            key = self._m.consm[key]
+
+        if self.sparse or self.generator not in ['CYTHON', 'CYTHON_OMP'] or self.scheme.Mnum is None:
+            if stale:
+                self.f2m()
+            moments = self._m[key] if halo else self._m._in(key) #pylint: disable=protected-access
+            return moments[(slice(None),)*(moments.ndim - self.dim) + region]
+
+        if stale and not region and len(stale) == self._m.nv:
             self.f2m()
+        else:
+            box = self._get_box(region, halo) if region else None
+            for k in stale:
+                self.scheme.f2m_row(self._F, self._m, k, box, self._module)
+                if box is None:
+                    self._valid_m[k] = True
 
-        return self._m._in(i) #pylint: disable=protected-access
+        m = self._m.swaparray
+        if not halo:
+            m = m[(slice(None),) + tuple(slice(v, n - v) for v, n in zip(self.domain.stencil.vmax, self._m.nspace))]
+        return m[(key,) + region]
 
     @utils.itemproperty
     def F_halo(self, i):
         """
         get the distribution function i on the whole domain with halo points.
         """
+        self._natural_layout()
         return self._F[i]
 
     @F_halo.setter
     def F_halo(self, i, value):
-        self._update_m = True
+        self._natural_layout()
+        self._valid_m[:] = False
+        self._stored_m[:] = False
         self._F[i] = value
 
     @utils.itemproperty
@@ -259,6 +818,7 @@ class Simulation:
         """
         get the distribution function i in the interior domain.
         """
+        self._natural_layout()
         return self._F._in(i) #pylint: disable=protected-access
 
     def __str__(self):
@@ -270,15 +830,103 @@ class Simulation:
         s += self.scheme.__str__()
         return s
 
-    #pylint: disable=too-many-locals
-    def time_info(self):
+    def time_report(self, filename=None):
         """
         get performance information about the simulation
+
+        The computational times of each phase are reduced over
+        all the processes. This function must therefore be called
+        by all the processes.
+
+        Parameters
+        ----------
+
+        filename : str, optional
+            if given, the report is also written in this file
+            using the JSON format (by the process 0)
+
+        Returns
+        -------
+
+        dict
+            the performance information with the keys
+
+            - number_of_processes
+            - number_of_points: the number of interior points of the whole domain
+            - number_of_iterations
+            - MLUPS: the million of lattice updates per second of the whole domain
+              (the updates of all the members for an ensemble)
+            - total: the time of the time loop (min, max and avg over the processes)
+            - phases: the time of each phase (min, max and avg over the processes)
+            - boundary_methods: the time of each boundary method (min, max and avg over the processes)
+            - halo_exchange_per_step: the exposed time of the halo exchange per time step and,
+              with mpi_overlap, the hidden time (the time of the computations done during the
+              exchange which is an upper bound of the hidden communication time)
+              averaged over the processes
+
         """
+        comm = self.mpi_topo.comm
         t = self.cpu_time
+        if t['total'] > 0:
+            t['MLUPS'] = self.nmembers*np.prod(self.domain.shape_in)*t['number_of_iterations']/t['total']/1e6
+
+        phases = ['halo_exchange', 'boundary_conditions', 'one_time_step',
+                  'relaxation', 'source_term', 'transport', 'f2m_m2f', 'callback']
+        bc_names = []
+        for names in comm.allgather(list(t['boundary_methods'].keys())):
+            bc_names += [name for name in names if name not in bc_names]
+
+        values = np.array([t['total'], t['MLUPS']] +
+                          [t[k] for k in phases] +
+                          [t['boundary_methods'].get(k, 0.) for k in bc_names] +
+                          [t['halo_hidden']])
+        vmin = np.empty_like(values)
+        vmax = np.empty_like(values)
+        vsum = np.empty_like(values)
+        comm.Allreduce(values, vmin, op=mpi.MIN)
+        comm.Allreduce(values, vmax, op=mpi.MAX)
+        comm.Allreduce(values, vsum, op=mpi.SUM)
+        size = comm.Get_size()
+
+        def stats(i):
+            return {'min': float(vmin[i]), 'max': float(vmax[i]), 'avg': float(vsum[i]/size)}
+
+        npoints = int(comm.allreduce(int(np.prod(self.domain.shape_in)), op=mpi.SUM))
+        report = {'number_of_processes': size,
+                  'number_of_points': npoints,
+                  'number_of_iterations': int(t['number_of_iterations']),
+                  'MLUPS': self.nmembers*npoints*t['number_of_iterations']/vmax[0]/1e6 if vmax[0] > 0 else 0.,
+                  'MLUPS_per_process': stats(1),
+                  'total': stats(0),
+                  'phases': OrderedDict((k, stats(i + 2)) for i, k in enumerate(phases)),
+                  'boundary_methods': OrderedDict((k, stats(i + 2 + len(phases))) for i, k in enumerate(bc_names)),
+                 }
+        niter = max(t['number_of_iterations'], 1)
+        report['halo_exchange_per_step'] = {'exposed': report['phases']['halo_exchange']['avg']/niter,
+                                            'hidden': float(vsum[-1]/size)/niter}
+
+        if filename is not None and comm.Get_rank() == 0:
+            with open(filename, 'w') as f:
+                json.dump(report, f, indent=4)
+        return report
+
+    #pylint: disable=too-many-locals
+    def time_info(self):
+        """
+        print performance information about the simulation
+
+        The computational times are averaged over the processes
+        (see :py:meth:`time_report<pylbm.simulation.Simulation.time_report>`)
+        and printed by the process 0.
+        """
+        report = self.time_report()
+        if self.mpi_topo.comm.Get_rank() != 0:
+            return
+
+        total = report['total']['avg']
         # tranform the seconds into days, hours, minutes, seconds
-        ttot = int(t['total'])
-        tms = int(1000*(t['total'] - ttot))
+        ttot = int(total)
+        tms = int(1000*(total - ttot))
         second = 1 # 1 second
         minute = 60*second # 1 minute
         hour = 60*minute # 1 hour
@@ -289,44 +937,182 @@ class Simulation:
         for unit in unity:
             tcut.append(ttot//unit)
             ttot -= tcut[-1]*unit
+        def line(text):
+            return '\n* ' + text.ljust(46) + ' *'
+
         #computational time measurement
         s = '*'*50
-        s += '\n* Time informations' + ' '*30 + '*'
-        s += '\n* ' + '-'*46 + ' *'
-        s += '\n* MLUPS {0:5.1f}'.format(t['MLUPS']) + ' '*36 + '*'
-        s += '\n* Nminuteber of iterations {0:10.3e}'.format(t['number_of_iterations'])
-        s += ' '*16 + '*'
-        s += '\n* Total time   '
+        s += line('Time informations')
+        s += line('-'*46)
+        s += line('MLUPS {0:10.3e}'.format(report['MLUPS']))
+        s += line('Number of iterations {0:10.3e}'.format(report['number_of_iterations']))
+        if report['number_of_processes'] > 1:
+            s += line('Number of processes  {0:10d}'.format(report['number_of_processes']))
+        stime = 'Total time   '
         test_dummy = True
         for k in range(len(unity)-1):
             if (test_dummy and tcut[k] == 0):
-                s += ' '*4
+                stime += ' '*4
             else:
                 test_dummy = False
-                s += '{0:2d}{1} '.format(int(tcut[k]), unity_name[k])
-        s += '{0:2d}{1} '.format(int(tcut[-1]), unity_name[-1])
+                stime += '{0:2d}{1} '.format(int(tcut[k]), unity_name[k])
+        stime += '{0:2d}{1} '.format(int(tcut[-1]), unity_name[-1])
         if test_dummy:
-            s += '{0:3d}ms'.format(tms) + ' '*13 + '*'
-        else:
-            s += ' '*18 + '*'
-        if t['total'] == 0:
-            ttotal = 1.e-15
-        else:
-            ttotal = t['total']
-        s += '\n* ' + '-'*46 + ' *'
-        s += '\n* relaxation         : {0:2d}%'.format(int(100*t['relaxation']/ttotal))
-        s += ' '*23 + '*'
-        s += '\n* source term        : {0:2d}%'.format(int(100*t['source_term']/ttotal))
-        s += ' '*23 + '*'
-        s += '\n* transport          : {0:2d}%'.format(int(100*t['transport']/ttotal))
-        s += ' '*23 + '*'
-        s += '\n* f2m_m2f            : {0:2d}%'.format(int(100*t['f2m_m2f']/ttotal))
-        s += ' '*23 + '*'
-        s += '\n* boundary conditions: {0:2d}%'.format(int(100*t['boundary_conditions']/ttotal))
-        s += ' '*23 + '*'
+            stime += '{0:3d}ms'.format(tms)
+        s += line(stime)
+        if total == 0:
+            total = 1.e-15
+        s += line('-'*46)
+        for name, value in report['phases'].items():
+            s += line('{0:19}: {1:3d}%'.format(name.replace('_', ' '), int(100*value['avg']/total)))
+            if name == 'boundary_conditions':
+                for bc_name, bc_value in report['boundary_methods'].items():
+                    s += line('  {0:34}: {1:3d}%'.format(bc_name[:34], int(100*bc_value['avg']/total)))
+        if self.mpi_overlap:
+            s += line('-'*46)
+            s += line('halo exchange per step')
+            s += line('  exposed  {0:10.3e}s'.format(report['halo_exchange_per_step']['exposed']))
+            s += line('  hidden  <{0:10.3e}s'.format(report['halo_exchange_per_step']['hidden']))
         s += '\n' + '*'*50
         print(s)
 
+    def generator_report(self, peak_gflops=None, peak_bandwidth=None, filename=None):
+        """
+        get the floating point operations and the memory traffic
+        of the generated routines and the performance achieved
+
+        The floating point operations, the loads and the stores of one
+        point are statically counted in the generated code (the index arithmetic,
+        the caches and the write-allocate traffic are not taken into account).
+        They are combined with the computational times of
+        :py:meth:`time_report<pylbm.simulation.Simulation.time_report>`
+        (the maximum over the processes) for the routines called in the
+        time loop. This function must therefore be called by all the processes.
+
+        Parameters
+        ----------
+
+        peak_gflops : float, optional
+            the peak performance of the machine in GFLOP/s
+        peak_bandwidth : float, optional
+            the peak memory bandwidth of the machine in GB/s
+        filename : str, optional
+            if given, the report is also written in this file
+            using the JSON format (by the process 0)
+
+        Returns
+        -------
+
+        dict
+            the keys are the names of the routines (the names of the boundary
+            methods for the boundary conditions) and the values the dictionaries with
+            the keys
+
+            - routine: the name of the generated routine
+            - flops, loads, stores, bytes: the counts for one point
+            - arithmetic_intensity: the number of flops per byte
+            - number_of_points: the number of points updated by the time loop
+              (the fluid points for one_time_step)
+            - time: the time spent in the routine
+            - GFLOPS, GBps: the performance achieved
+            - attainable_GFLOPS: the roofline bound min(peak_gflops, intensity*peak_bandwidth)
+              if the two peaks are given
+            - bound: 'memory' or 'compute' if the two peaks are given
+            - efficiency: GFLOPS/attainable_GFLOPS if the two peaks are given
+
+            The routines which are not called in the time loop
+            (f2m, m2f, equilibrium) only have the static counts.
+
+        """
+        comm = self.mpi_topo.comm
+        operations = generator.count_operations()
+        times = self.time_report()
+        niter = times['number_of_iterations']
+
+        # one_time_step only updates the fluid points
+        nfluid = int(comm.allreduce(int(self.domain.get_fluid_cells().shape[0]), op=mpi.SUM))
+        kernels = OrderedDict()
+        kernels['one_time_step'] = ('one_time_step_even' if self.inplace else 'one_time_step',
+                                    self.nmembers*nfluid*niter,
+                                    times['phases']['one_time_step']['max'])
+        for method in self.bc.methods:
+            npoints = int(comm.allreduce(int(method.rhs.size), op=mpi.SUM))
+            kernels[method.name] = (getattr(method.function, '__name__', None),
+                                    npoints*niter,
+                                    times['boundary_methods'].get(method.name, {'max': 0.})['max'])
+        for name in ['f2m', 'm2f', 'equilibrium']:
+            kernels[name] = (name, None, None)
+
+        report = OrderedDict()
+        for name, (routine, npoints, time) in kernels.items():
+            if routine not in operations:
+                continue
+            ops = operations[routine]
+            value = OrderedDict([('routine', routine)])
+            value.update(ops)
+            value['arithmetic_intensity'] = ops['flops']/ops['bytes'] if ops['bytes'] > 0 else 0.
+            if npoints is not None:
+                value['number_of_points'] = npoints
+                value['time'] = time
+                value['GFLOPS'] = ops['flops']*npoints/time/1e9 if time > 0 else 0.
+                value['GBps'] = ops['bytes']*npoints/time/1e9 if time > 0 else 0.
+                if peak_gflops is not None and peak_bandwidth is not None:
+                    memory_bound = value['arithmetic_intensity']*peak_bandwidth
+                    value['attainable_GFLOPS'] = min(peak_gflops, memory_bound)
+                    value['bound'] = 'memory' if memory_bound < peak_gflops else 'compute'
+                    if value['attainable_GFLOPS'] > 0:
+                        value['efficiency'] = value['GFLOPS']/value['attainable_GFLOPS']
+                    else:
+                        value['efficiency'] = 0.
+            report[name] = value
+
+        if filename is not None and comm.Get_rank() == 0:
+            with open(filename, 'w') as f:
+                json.dump(report, f, indent=4)
+        return report
+
+    def generator_info(self, peak_gflops=None, peak_bandwidth=None):
+        """
+        print the roofline information of the generated routines
+
+        The report of
+        :py:meth:`generator_report<pylbm.simulation.Simulation.generator_report>`
+        is printed by the process 0.
+
+        Parameters
+        ----------
+
+        peak_gflops : float, optional
+            the peak performance of the machine in GFLOP/s
+        peak_bandwidth : float, optional
+            the peak memory bandwidth of the machine in GB/s
+
+        """
+        report = self.generator_report(peak_gflops, peak_bandwidth)
+        if self.mpi_topo.comm.Get_rank() != 0:
+            return
+
+        def line(text):
+            return '\n* ' + text.ljust(62) + ' *'
+
+        s = '*'*66
+        s += line('Generated routines (per point)')
+        if peak_gflops is not None and peak_bandwidth is not None:
+            s += line('Peak {0:10.3e} GFLOP/s {1:10.3e} GB/s'.format(peak_gflops, peak_bandwidth))
+        for name, value in report.items():
+            s += line('-'*62)
+            s += line(name[:62])
+            s += line('  flops {0:6d}  bytes {1:6d}  intensity {2:8.3f}'.format(value['flops'], value['bytes'],
+                                                                            value['arithmetic_intensity']))
+            if 'time' in value:
+                s += line('  GFLOP/s {0:10.3e}  GB/s {1:10.3e}'.format(value['GFLOPS'], value['GBps']))
+            if 'bound' in value:
+                s += line('  {0} bound: {1:5.1f}% of {2:10.3e} GFLOP/s'.format(value['bound'],
+                                                                            100*value['efficiency'],
+                                                                            value['attainable_GFLOPS']))
+        s += '\n' + '*'*66
+        print(s)
+
     def initialization(self, dico):
         """
         initialize all the numy array with the initial conditions
@@ -364,7 +1150,7 @@ class Simulation:
             log.error(sss)
             sys.exit()
 
-        for k, v in self.scheme.init.items():
+        for k, v in self._get_initial_values():
             if isinstance(v, tuple):
                 f = v[0]
                 extraargs = v[1] if len(v) == 2 else ()
@@ -381,6 +1167,12 @@ class Simulation:
 
         self._Fold.array[:] = self._F.array[:]
 
+    def _get_initial_values(self):
+        """
+        return the pairs (index in the array to initialize, initial value).
+        """
+        return self.scheme.init.items()
+
     def transport(self):
         """
         compute the transport phase on distribution functions
@@ -414,7 +1206,9 @@ class Simulation:
         (the array _m is modified)
         """
         t = mpi.Wtime()
-        self.scheme.f2m(self._F, self._m)
+        self._natural_layout()
+        self._kernels[0]['f2m']()
+        self._valid_m[:] = True
         self.cpu_time['f2m_m2f'] += mpi.Wtime() - t
 
     def m2f(self):
@@ -423,7 +1217,8 @@ class Simulation:
         (the array _F is modified)
         """
         t = mpi.Wtime()
-        self.scheme.m2f(self._m, self._F)
+        self._natural_layout()
+        self._kernels[0]['m2f']()
         self.cpu_time['f2m_m2f'] += mpi.Wtime() - t
 
     def equilibrium(self):
@@ -437,7 +1232,7 @@ class Simulation:
         Another moments vector can be set to equilibrium values:
         use directly the method of the class Scheme
         """
-        self.scheme.equilibrium(self._m)
+        self._equilibrium()
 
     def boundary_condition(self):
         """
@@ -449,9 +1244,36 @@ class Simulation:
         The array _F is modified in the phantom array (outer points)
         according to the specified boundary conditions.
         """
-        t = mpi.Wtime()
-        self.scheme.set_boundary_conditions(self._F, self._m, self.bc, self.mpi_topo)
-        self.cpu_time['boundary_conditions'] += mpi.Wtime() - t
+        t_begin = mpi.Wtime()
+        self._F.update(self._kernels[0]['parity'])
+        t_end = mpi.Wtime()
+        self.cpu_time['halo_exchange'] += t_end - t_begin
+        self._apply_boundary_conditions(self._kernels[0]['boundary_conditions'], t_end)
+
+    def _update_boundary_values(self):
+        """
+        evaluate again the boundary values which depend on the time.
+        """
+        t_begin = mpi.Wtime()
+        updated = [method.update_rhs(self.scheme, self.t, self.nt) for method in self._time_bc]
+        if any(updated) and self.mpi_overlap:
+            # the functions on a part of the conditions use copies of rhs
+            self._bind()
+        self.cpu_time['boundary_conditions'] += mpi.Wtime() - t_begin
+
+    def _apply_boundary_conditions(self, functions, t_begin):
+        """
+        call the prepared functions of the boundary conditions,
+        measure their time from t_begin and return the final time.
+        """
+        t_end = t_begin
+        for name, function in functions:
+            function()
+            t = mpi.Wtime()
+            self.cpu_time['boundary_methods'][name] += t - t_end
+            t_end = t
+        self.cpu_time['boundary_conditions'] += t_end - t_begin
+        return t_end
 
     def one_time_step(self):
         """
@@ -469,16 +1291,143 @@ class Simulation:
         - relaxation
         - m2f
         """
-        self._update_m = True # we recompute f so m will be not correct
-
-        self.boundary_condition()
+        self._valid_m[:] = False # we recompute f so m will be not correct
+        self._stored_m[:] = False
+
+        t_begin = mpi.Wtime()
+        if self._time_bc:
+            self._update_boundary_values()
+        if self.mpi_overlap:
+            t_end = self._one_time_step_overlap()
+        else:
+            self.boundary_condition()
 
-        self.scheme.onetimestep(self._m, self._F, self._Fold, self.domain.in_or_out, self.domain.valin, self.t, self.dt,
-                                *self.domain.coords)
-        self._F, self._Fold = self._Fold, self._F
+            t = mpi.Wtime()
+            self._kernels[0]['one_time_step']()
+            t_end = mpi.Wtime()
+            self.cpu_time['one_time_step'] += t_end - t
+        self.cpu_time['total'] += t_end - t_begin
+        self.cpu_time['number_of_iterations'] += 1
+        self._swap()
+        self._stored_m[self._stored_rows] = True
 
         self.t += self.dt
         self.nt += 1
 
+    def _one_time_step_overlap(self):
+        """
+        compute one time step where the halo exchange is overlapped
+        by the computations which do not need the ghost points
+        and return the final time.
+
+        The time of these computations is added to cpu_time['halo_hidden']:
+        it is an upper bound of the hidden communication time.
+        """
+        kernels = self._kernels[0]
+
+        t_begin = mpi.Wtime()
+        self._F.start_update()
+        t_start = mpi.Wtime()
+
+        t = self._apply_boundary_conditions(kernels['boundary_conditions'], t_start)
+        kernels['one_time_step']()
+        t_end = mpi.Wtime()
+        self.cpu_time['one_time_step'] += t_end - t
+        self.cpu_time['halo_hidden'] += t_end - t_start
+
+        self._F.wait_update()
+        t = mpi.Wtime()
+        self.cpu_time['halo_exchange'] += t - t_end + t_start - t_begin
+
+        t = self._apply_boundary_conditions(kernels['boundary_conditions_strip'], t)
+        kernels['one_time_step_strip']()
+        t_end = mpi.Wtime()
+        self.cpu_time['one_time_step'] += t_end - t
+        return t_end
+
+    def run(self, nsteps, callback=None, callback_every=None):
+        """
+        compute several time steps
+
+        Parameters
+        ----------
+
+        nsteps : int
+            the number of time steps
+        callback : function, optional
+            function called as callback(simulation) during the time loop
+        callback_every : int, optional
+            the callback is called every callback_every time steps.
+            Default is None which means that the callback is only
+            called after the last time step.
+
+        Notes
+        -----
+
+        This function is equivalent to call nsteps times
+        :py:meth:`one_time_step<pylbm.simulation.Simulation.one_time_step>`.
+        With the key 'fuse_time_loop' of the dictionary, the time steps
+        between two calls of the callback are computed by a generated function.
+        """
+        if callback_every is not None and callback_every <= 0:
+            log.error('callback_every must be a positive integer')
+            sys.exit()
+
+        it = 0
+        while it < nsteps:
+            if callback is not None and callback_every is not None:
+                n = min(nsteps - it, callback_every - it % callback_every)
+            else:
+                n = nsteps - it
+            self._time_steps(n)
+            it += n
+
+            if callback is not None and callback_every is not None and it % callback_every == 0:
+                self._call(callback)
+
+        if callback is not None and callback_every is None:
+            self._call(callback)
+
+    def _call(self, callback):
+        """
+        call the user function and measure its computational time
+        """
+        t = mpi.Wtime()
+        callback(self)
+        self.cpu_time['callback'] += mpi.Wtime() - t
+
+    def _time_steps(self, nsteps):
+        """
+        compute nsteps time steps with the generated time loop
+        if it is available, with one_time_step otherwise.
+
+        The generated time loop computes the time steps by pairs:
+        its time is added to cpu_time['one_time_step'].
+        """
+        if not self.fuse_time_loop:
+            for _ in range(nsteps):
+                self.one_time_step()
+            return
+
+        if nsteps % 2 == 1:
+            self.one_time_step()
+        npairs = nsteps//2
+        if npairs == 0:
+            return
+
+        self._valid_m[:] = False # we recompute f so m will be not correct
+        self._stored_m[:] = False
+        t_begin = mpi.Wtime()
+        self._kernels[0]['time_loop'](nloops=npairs)
+        t_end = mpi.Wtime()
+        self.cpu_time['one_time_step'] += t_end - t_begin
+        self.cpu_time['total'] += t_end - t_begin
+        self.cpu_time['number_of_iterations'] += 2*npairs
+        self._stored_m[self._stored_rows] = True
+
+        for _ in range(2*npairs):
+            self.t += self.dt
+        self.nt += 2*npairs
+
 if __name__ == "__main__":
     pass
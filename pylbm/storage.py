@@ -17,6 +17,7 @@ import sympy as sp
 import mpi4py.MPI as mpi
 
 from .generator import generator, For
+from .mpi_topology import get_directions
 
 log = logging.getLogger(__name__) #pylint: disable=invalid-name
 
@@ -105,6 +106,11 @@ class Array:
 
         self.swaparray = np.transpose(self.array_cpu, self.index)
 
+        self._update_functions = None
+        self.local_directions = []
+        self._periodic_functions = {}
+        self.overlap_requests = []
+        self._overlap_types = []
         if mpi_topo is not None:
             self._set_subarray()
 
@@ -124,13 +130,8 @@ class Array:
         else:
             self.swaparray[key] = values
         if self.gpu_support:
-            try:
-                import pyopencl as cl
-                import pyopencl.array #pylint: disable=unused-variable
-                from .context import queue
-            except ImportError:
-                raise ImportError("Please install loo.py")
-            self.array = cl.array.to_device(queue, self.array_cpu)
+            # copy in place to keep the device buffer used by the bound kernels
+            self.array.set(self.array_cpu)
 
     def _in(self, key):
         ind = []
@@ -141,8 +142,8 @@ class Array:
         if self.gpu_support:
             self.array_cpu[...] = self.array.get()
         if isinstance(key, sp.Symbol):
-            return self.swaparray[self.consm[key]][tuple(ind)]
-        return self.swaparray[key][tuple(ind)]
+            return self.swaparray[self.consm[key]][(Ellipsis,) + tuple(ind)]
+        return self.swaparray[key][(Ellipsis,) + tuple(ind)]
 
 
     def set_conserved_moments(self, consm):
@@ -228,9 +229,16 @@ class Array:
             direction[i] += 1
             self.neighbors.append(self.mpi_topo.cartcomm.Get_cart_rank(direction))
 
+        # the periodic directions with a single process: the process is its own
+        # neighbor and the exchanges can be copies in memory (see generate_periodic)
+        self.local_directions = [d for d in range(dim) if self.neighbors[2*d] == rank and self.neighbors[2*d + 1] == rank]
+
         self.send_tag = [0, 1, 2, 3, 4, 5]
         self.recv_tag = [1, 0, 3, 2, 5, 4]
 
+        # the MPI datatype corresponding to the type of the array
+        mpi_type = mpi._typedict[self.array_cpu.dtype.char] #pylint: disable=protected-access
+
         self.send_type = []
         self.recv_type = []
 
@@ -244,8 +252,8 @@ class Array:
             sstart = swap(sstart)
             rstart = [0]*(dim+1)
 
-            self.send_type.append(mpi.DOUBLE.Create_subarray(sizes, subsizes, sstart))
-            self.recv_type.append(mpi.DOUBLE.Create_subarray(sizes, subsizes, rstart))
+            self.send_type.append(mpi_type.Create_subarray(sizes, subsizes, sstart))
+            self.recv_type.append(mpi_type.Create_subarray(sizes, subsizes, rstart))
 
             log.info("[%d] send to %d with tag %d subarray:%s", rank, self.neighbors[2*d], self.send_tag[2*d], (sizes, subsizes, sstart))
             log.info("[%d] recv from %d with tag %d subarray:%s", rank, self.neighbors[2*d], self.recv_tag[2*d], (sizes, subsizes, rstart))
@@ -257,8 +265,8 @@ class Array:
             rstart[d+1] = nspace[d] - vmax[d]
             rstart = swap(rstart)
 
-            self.send_type.append(mpi.DOUBLE.Create_subarray(sizes, subsizes, sstart))
-            self.recv_type.append(mpi.DOUBLE.Create_subarray(sizes, subsizes, rstart))
+            self.send_type.append(mpi_type.Create_subarray(sizes, subsizes, sstart))
+            self.recv_type.append(mpi_type.Create_subarray(sizes, subsizes, rstart))
 
             log.info("[%d] send to %d with tag %d subarray:%s", rank, self.neighbors[2*d+1], self.send_tag[2*d+1], (sizes, subsizes, sstart))
             log.info("[%d] recv from %d with tag %d subarray:%s", rank, self.neighbors[2*d+1], self.recv_tag[2*d+1], (sizes, subsizes, rstart))
@@ -267,43 +275,298 @@ class Array:
             send.Commit()
             recv.Commit()
 
-    #pylint: disable=possibly-unused-variable
-    def update(self):
+        # persistent requests: the communications are set once
+        # and only started at each update
+        self.requests = []
+        for d in range(dim): #pylint: disable=invalid-name
+            req = []
+            for i in [2*d, 2*d + 1]:
+                req.append(self.comm.Recv_init([self.array, self.recv_type[i]], source=self.neighbors[i], tag=self.recv_tag[i]))
+            for i in [2*d, 2*d + 1]:
+                req.append(self.comm.Send_init([self.array, self.send_type[i]], dest=self.neighbors[i], tag=self.send_tag[i]))
+            self.requests.append(req)
+
+    def update(self, parity=None):
         """
         update ghost points on the interface with the datas of the neighbors.
+
+        Parameters
+        ----------
+        parity : str, optional
+            'odd' if the array is in the layout of the odd steps of the
+            in-place transport (see
+            :py:meth:`set_inplace<pylbm.storage.Array.set_inplace>`):
+            the values needed by the interior points are exchanged
+            in the natural layout (default is None)
         """
-        if self.gpu_support:
-            from .symbolic import call_genfunction
+        if parity == 'odd':
+            self._swap_ghost_places()
+            self.update()
+            self._swap_ghost_places()
+        elif self.gpu_support:
+            if self._update_functions is None:
+                self._update_functions = self._bind_update()
+            for function in self._update_functions:
+                function()
+        else:
+            periodic = self._periodic_functions
+            for d, req in enumerate(self.requests): #pylint: disable=invalid-name
+                if d in periodic:
+                    periodic[d]()
+                else:
+                    mpi.Prequest.Startall(req)
+                    mpi.Request.Waitall(req)
+
+    def set_overlap(self):
+        """
+        create the persistent requests used by
+        :py:meth:`start_update<pylbm.storage.Array.start_update>`.
+
+        The ghost points are exchanged with all the neighbors at once
+        (the diagonal ones included): the communications can therefore
+        be started before the computations and finished after.
+        The requests are not created when the process is its own neighbor
+        in all the directions (the ghost points are copied in memory) and
+        are released by :py:meth:`free_overlap<pylbm.storage.Array.free_overlap>`.
+        """
+        if self.overlap_requests or len(self._periodic_functions) == self.dim:
+            return
 
-            dim = len(self.nspace)
-            nx = self.nspace[0]
-            if dim > 1:
-                ny = self.nspace[1]
-            if dim > 2:
-                nz = self.nspace[2]
-            nv = self.nv
+        nspace = list(self.nspace)
+        nv = self.nv
+        vmax = self.vmax
 
-            f = self.array
+        def swap(array_in):
+            array_out = [0]*(self.dim + 1)
+            for i in range(self.dim + 1):
+                array_out[self.index[i]] = array_in[i]
+            return array_out
 
-            args = locals()
-            call_genfunction(generator.module.update_x, args)
+        sizes = swap([nv] + nspace)
+        coords = self.mpi_topo.cartcomm.Get_coords(self.mpi_topo.cartcomm.Get_rank())
+
+        # the MPI datatype corresponding to the type of the array
+        mpi_type = mpi._typedict[self.array_cpu.dtype.char] #pylint: disable=protected-access
+
+        for tag, direction in enumerate(get_directions(self.dim)):
+            if not np.any(direction):
+                continue
+            subsizes, sstart, rstart = [nv], [0], [0]
+            for d, n, v in zip(direction, nspace, vmax): #pylint: disable=invalid-name
+                subsizes.append(v if d != 0 else n - 2*v)
+                sstart.append({-1: v, 0: v, 1: n - 2*v}[d])
+                rstart.append({1: 0, 0: v, -1: n - v}[d])
+            send_type = mpi_type.Create_subarray(sizes, swap(subsizes), swap(sstart))
+            recv_type = mpi_type.Create_subarray(sizes, swap(subsizes), swap(rstart))
+            send_type.Commit()
+            recv_type.Commit()
+            self._overlap_types += [send_type, recv_type]
+            dest = self.mpi_topo.cartcomm.Get_cart_rank(list(np.asarray(coords) + direction))
+            source = self.mpi_topo.cartcomm.Get_cart_rank(list(np.asarray(coords) - direction))
+            self.overlap_requests.append(self.comm.Recv_init([self.array, recv_type], source=source, tag=tag))
+            self.overlap_requests.append(self.comm.Send_init([self.array, send_type], dest=dest, tag=tag))
+
+    def free_overlap(self):
+        """
+        release the persistent requests created by
+        :py:meth:`set_overlap<pylbm.storage.Array.set_overlap>`
+        and their MPI datatypes.
+        """
+        for request in self.overlap_requests:
+            request.Free()
+        for mpi_type in self._overlap_types:
+            mpi_type.Free()
+        self.overlap_requests = []
+        self._overlap_types = []
+
+    def __del__(self):
+        # the MPI objects are not released by the garbage collector
+        if not mpi.Is_finalized():
+            self.free_overlap()
+
+    def start_update(self):
+        """
+        start the update of the ghost points with the datas of all the neighbors.
+
+        The ghost points can not be used and the interior points
+        near the interfaces can not be modified until
+        :py:meth:`wait_update<pylbm.storage.Array.wait_update>` is called.
+        On a single process, the ghost points are copied at once,
+        otherwise :py:meth:`set_overlap<pylbm.storage.Array.set_overlap>`
+        must be called before.
+        """
+        periodic = self._periodic_functions
+        if len(periodic) == self.dim:
+            for d in range(self.dim): #pylint: disable=invalid-name
+                periodic[d]()
+        else:
+            mpi.Prequest.Startall(self.overlap_requests)
 
-            if dim > 1:
-                call_genfunction(generator.module.update_y, args)
-            if dim > 2:
-                call_genfunction(generator.module.update_z, args)
+    def wait_update(self):
+        """
+        wait the end of the update of the ghost points started by
+        :py:meth:`start_update<pylbm.storage.Array.start_update>`.
+        """
+        if len(self._periodic_functions) < self.dim:
+            mpi.Request.Waitall(self.overlap_requests)
 
-        else:
-            for d in range(self.dim): #pylint: disable=invalid-name
-                req = []
+    def set_inplace(self, velocities, ksym):
+        """
+        prepare the changes of layout of the in-place transport.
+
+        After an even step of the in-place transport, the value of the velocity
+        k at the point x is stored in the symmetric velocity ksym[k] at
+        the point x + c_k. The two places are exchanged to go back to
+        the natural layout.
+
+        Parameters
+        ----------
+        velocities : ndarray
+            the velocity c_k of each distribution function
+        ksym : ndarray
+            the index of the symmetric velocity of each distribution function
+        """
+        nspace = self.nspace
+        vmax = np.asarray(self.vmax)
+
+        # the pairs of places of the whole array as slices
+        self._inplace_pairs = [] #pylint: disable=attribute-defined-outside-init
+        for k, (v, kk) in enumerate(zip(velocities, ksym)):
+            if kk <= k:
+                continue
+            self._inplace_pairs.append(((k,) + tuple(slice(max(0, -c), n - max(0, c)) for c, n in zip(v, nspace)),
+                                        (kk,) + tuple(slice(max(0, c), n + min(0, c)) for c, n in zip(v, nspace))))
+
+        # the pairs of places between an interior point and a ghost point
+        # updated by the exchange with a neighbor (the other ones are not modified)
+        interior = np.zeros(nspace, dtype=bool)
+        interior[tuple(slice(v, n - v) for v, n in zip(vmax, nspace))] = True
+        exchanged = np.zeros(nspace, dtype=bool)
+        for d in range(self.dim): #pylint: disable=invalid-name
+            for i, side in enumerate([slice(0, vmax[d]), slice(nspace[d] - vmax[d], nspace[d])]):
+                if self.neighbors[2*d + i] != mpi.PROC_NULL:
+                    exchanged[(slice(None),)*d + (side,)] = True
+        points = np.argwhere(interior)
+        first, second = [], []
+        for k, (v, kk) in enumerate(zip(velocities, ksym)):
+            neighbors = points + v
+            ghost = exchanged[tuple(neighbors.T)] & np.logical_not(interior[tuple(neighbors.T)])
+            first.append(np.concatenate([np.full((ghost.sum(), 1), k), points[ghost]], axis=1))
+            second.append(np.concatenate([np.full((ghost.sum(), 1), kk), neighbors[ghost]], axis=1))
+
+        def flat_index(indices):
+            # the index in the memory of the places given as [k, x, y, z]
+            return np.ravel_multi_index(tuple(indices[:, self.index.index(i)] for i in range(self.dim + 1)),
+                                        self.array_cpu.shape)
+        self._ghost_pairs = (flat_index(np.concatenate(first)), flat_index(np.concatenate(second))) #pylint: disable=attribute-defined-outside-init
+
+    def swap_layout(self):
+        """
+        go from the layout of the odd steps of the in-place transport
+        to the natural layout and conversely.
+        """
+        for first, second in self._inplace_pairs:
+            values = self.swaparray[first].copy()
+            self.swaparray[first] = self.swaparray[second]
+            self.swaparray[second] = values
+
+    def _swap_ghost_places(self):
+        """
+        exchange the places of the pairs which have a ghost point
+        (the values read by the interior points are then in the natural layout).
+        """
+        first, second = self._ghost_pairs
+        array = self.array_cpu.reshape(-1)
+        values = array[first]
+        array[first] = array[second]
+        array[second] = values
+
+    def _bind_update(self):
+        """
+        prepare the generated functions which update the ghost points
+        (loo.py backend).
+        """
+        from .symbolic import bind_genfunction
+
+        args = {'nx': self.nspace[0], 'nv': self.nv, 'f': self.array}
+        functions = [generator.module.update_x]
+        if self.dim > 1:
+            args['ny'] = self.nspace[1]
+            functions.append(generator.module.update_y)
+        if self.dim > 2:
+            args['nz'] = self.nspace[2]
+            functions.append(generator.module.update_z)
+        return [bind_genfunction(function, args) for function in functions]
+
+    def get_periodic_args(self):
+        """
+        return the arguments of the functions generated by
+        :py:meth:`generate_periodic<pylbm.storage.Array.generate_periodic>`
+        (dictionary name: value).
+        """
+        args = {'nv': self.nv, 'f': self.array}
+        args.update(zip(['nx', 'ny', 'nz'], self.nspace))
+        return args
+
+    def bind_periodic(self, module):
+        """
+        set the arguments of the functions generated by
+        :py:meth:`generate_periodic<pylbm.storage.Array.generate_periodic>`.
+
+        The ghost points are then copied in memory by
+        :py:meth:`update<pylbm.storage.Array.update>` and
+        :py:meth:`start_update<pylbm.storage.Array.start_update>`.
+
+        Parameters
+        ----------
+        module : module
+            the compiled module which contains the functions
+        """
+        from .symbolic import bind_genfunction
+
+        args = self.get_periodic_args()
+        self._periodic_functions = {d: bind_genfunction(getattr(module, 'periodic_' + 'xyz'[d]), args)
+                                    for d in self.local_directions}
+
+    def generate_periodic(self):
+        """
+        generate the functions which copy the ghost points in the periodic
+        directions where the process is its own neighbor (Cython generators).
+
+        The functions periodic_x, periodic_y and periodic_z are called in
+        this order to have the right corners. Once bound by
+        :py:meth:`bind_periodic<pylbm.storage.Array.bind_periodic>`, the copies
+        replace the exchanges of the process with itself in
+        :py:meth:`update<pylbm.storage.Array.update>` and, on a single process,
+        in :py:meth:`start_update<pylbm.storage.Array.start_update>`.
+        They are also used by the generated time loop of
+        :py:meth:`Simulation.run<pylbm.simulation.Simulation.run>`.
+        """
+        nx, ny, nz, nv = sp.symbols('nx, ny, nz, nv', integer=True)
+        sizes = [nv, nx, ny, nz][:self.dim + 1]
+
+        def in_memory_order(array):
+            out = [None]*len(array)
+            for i, k in enumerate(self.index):
+                out[k] = array[i]
+            return out
 
-                req.append(self.comm.Irecv([self.array, self.recv_type[2*d]], source=self.neighbors[2*d], tag=self.recv_tag[2*d]))
-                req.append(self.comm.Irecv([self.array, self.recv_type[2*d + 1]], source=self.neighbors[2*d + 1], tag=self.recv_tag[2*d + 1]))
+        fi = sp.IndexedBase('f', in_memory_order(sizes)) #pylint: disable=invalid-name
+        for d in self.local_directions: #pylint: disable=invalid-name
+            vmax = self.vmax[d]
+            loops = [sp.Idx(name, (0, n)) for name, n in zip(['s', 'i', 'j', 'k'], sizes)]
+            loops[d + 1] = sp.Idx('g', (0, vmax))
+            n = sizes[d + 1]
 
-                req.append(self.comm.Isend([self.array, self.send_type[2*d]], dest=self.neighbors[2*d], tag=self.send_tag[2*d]))
-                req.append(self.comm.Isend([self.array, self.send_type[2*d + 1]], dest=self.neighbors[2*d + 1], tag=self.send_tag[2*d + 1]))
+            def place(ghost, loops=loops, d=d):
+                index = list(loops)
+                index[d + 1] = ghost
+                return fi[in_memory_order(index)]
 
-                mpi.Request.Waitall(req)
+            g = loops[d + 1]
+            f_store = sp.Matrix([place(g), place(n - vmax + g)])
+            f_load = sp.Matrix([place(n - 2*vmax + g), place(vmax + g)])
+            generator.add_routine(('periodic_' + 'xyz'[d], For(in_memory_order(loops), sp.Eq(f_store, f_load))))
 
     #pylint: disable=too-many-locals
     def generate(self):
@@ -421,3 +684,159 @@ class AOS(Array):
         reshape
         """
         return self.array.reshape((np.prod(self.nspace), self.nv))
+
+class Sparse(Array):
+    """
+    This class defines a sparse storage of the unknowns of the
+    lattice Boltzmann schemes: only the points given by cells are stored.
+
+    The values are stored in an array of shape (number of points, nv)
+    which is seen by the generated functions as an array of structures
+    in one dimension (the storage order is [1, 0]).
+
+    Parameters
+    ----------
+    nv: int
+        number of velocities
+    cells: ndarray
+        the indices in the whole domain (with the fictitious points)
+        of the stored points, array of shape (number of points, dim)
+    shape_halo: list
+        number of points in each direction including the fictitious point
+    vmax: list
+        the size of the fictitious points in each direction
+    dtype: type
+        the type of the array. Default is numpy.double
+
+    Attributes
+    ----------
+    array
+    cells
+    nspace
+    nv
+    shape
+    size
+
+    Notes
+    -----
+
+    The periodic conditions are applied by copying the stored fictitious
+    points from their periodic images which must also be stored.
+    This storage can not be used with several processes.
+
+    The access with [] returns and sets the values on the whole domain:
+    the points which are not stored are set to 0.
+
+    """
+    #pylint: disable=super-init-not-called
+    def __init__(self, nv, cells, shape_halo, vmax, dtype=np.double):
+        self.comm = mpi.COMM_WORLD
+        self.sorder = [1, 0]
+        self.index = [1, 0]
+        self.dim = len(shape_halo)
+        self.consm = {}
+        self.gpu_support = False
+        self.overlap_requests = []
+        self._overlap_types = []
+        self.vmax = vmax
+        self.shape_halo = list(shape_halo)
+        self.cells = np.ascontiguousarray(cells, dtype=np.int32)
+
+        self.array_cpu = np.zeros((self.cells.shape[0], nv), dtype=dtype)
+        self.array = self.array_cpu
+        self.swaparray = self.array.T
+
+        # the fictitious points are copied from their periodic images
+        shape = np.asarray(self.shape_halo)
+        vmax = np.asarray(vmax, dtype=np.int32)
+        halo = np.any((self.cells < vmax) | (self.cells >= shape - vmax), axis=1)
+        images = (self.cells[halo] - vmax) % (shape - 2*vmax) + vmax
+        self.halo_dst = np.where(halo)[0]
+        self.halo_src = self.get_index(images)
+        if np.any(self.halo_src < 0):
+            log.error("the periodic images of the fictitious points must be stored in the sparse storage")
+
+    def get_index(self, points):
+        """
+        Get the indices of points in the sparse storage.
+
+        Parameters
+        ----------
+        points: ndarray
+            the indices of the points in the whole domain,
+            array of shape (..., dim)
+
+        Returns
+        -------
+        ndarray
+            the indices of the points in the storage (-1 if the point is not stored)
+
+        """
+        index = -np.ones(self.shape_halo, dtype=np.int32)
+        index[tuple(self.cells.T)] = np.arange(self.cells.shape[0], dtype=np.int32)
+        points = np.asarray(points)
+        return index[tuple(np.moveaxis(points, -1, 0))]
+
+    def get_neighbors(self, velocities, ncells=None):
+        """
+        Get the table used by the transport phase.
+
+        Parameters
+        ----------
+        velocities: ndarray
+            the velocities of the stencil, array of shape (nv, dim)
+        ncells: int
+            the table is computed for the ncells first points.
+            Default is None which means all the points
+
+        Returns
+        -------
+        ndarray
+            the array neighbors of shape (ncells, nv) where neighbors[i, k]
+            is the index of the point cells[i] - velocities[k]
+
+        """
+        cells = self.cells[:ncells]
+        points = cells[:, np.newaxis, :] - np.asarray(velocities)[np.newaxis, :, :]
+        neighbors = self.get_index(points)
+        if np.any(neighbors < 0):
+            log.error("the neighbors of the points must be stored in the sparse storage")
+        return np.ascontiguousarray(neighbors, dtype=np.int32)
+
+    def _get_key(self, key):
+        if isinstance(key, sp.Symbol):
+            return self.consm[key]
+        return key
+
+    def __getitem__(self, key):
+        values = self.swaparray[self._get_key(key)]
+        out = np.zeros(values.shape[:-1] + tuple(self.shape_halo), dtype=values.dtype)
+        out[(Ellipsis,) + tuple(self.cells.T)] = values
+        return out
+
+    def __setitem__(self, key, values):
+        values = np.asarray(values)
+        if values.ndim > 0:
+            shape = values.shape[:max(values.ndim - self.dim, 0)] + tuple(self.shape_halo)
+            values = np.broadcast_to(values, shape)[(Ellipsis,) + tuple(self.cells.T)]
+        self.swaparray[self._get_key(key)] = values
+
+    def _in(self, key):
+        ind = tuple([slice(vmax, -vmax) for vmax in self.vmax])
+        return self[key][(Ellipsis,) + ind]
+
+    #pylint: disable=unused-argument
+    def update(self, parity=None):
+        """
+        update the fictitious points with the periodic conditions.
+
+        parity is not used: the in-place transport is not available
+        with the sparse storage.
+        """
+        self.array[self.halo_dst] = self.array[self.halo_src]
+
+    def reshape(self):
+        """
+        reshape
+        """
+        return self.array
@@ -10,6 +10,7 @@ Symbolic module
 
 import sys
 import inspect
+from functools import partial
 import sympy as sp
 
 nx, ny, nz, nv = sp.symbols("nx, ny, nz, nv", integer=True) #pylint: disable=invalid-name
@@ -89,13 +90,87 @@ if PY3:
 else:
     getargspec = getargspec_permissive #pylint: disable=invalid-name
 
-def call_genfunction(function, args):
-    from .context import queue
-    try:
-        func_args = function.arg_dict.keys()
+def get_genfunction_args(function):
+    """
+    Return the names of the arguments of a generated function.
+
+    The names are computed once for each function of the
+    module of the generator and are forgotten when it is compiled again.
+
+    Parameters
+    ----------
+
+    function : function
+        the generated function
+
+    Returns
+    -------
+
+    list
+        the names of the arguments in the order of the signature
+
+    """
+    from .generator import generator
+
+    name = getattr(function, '__name__', getattr(function, 'name', None))
+    # only the functions of the current module are kept
+    in_module = name is not None and getattr(generator.module, name, None) is function
+    func_args = generator.arguments.get(name, None) if in_module else None
+    if func_args is None:
+        if hasattr(function, 'arg_dict'):
+            func_args = list(function.arg_dict.keys())
+        else:
+            func_args = getargspec(function).args
+        if in_module:
+            generator.arguments[name] = func_args
+    return func_args
+
+def bind_genfunction(function, args, unbound=()):
+    """
+    Set the arguments of a generated function.
+
+    The arguments are bound by position, except for loo.py
+    kernels which only accept keyword arguments.
+
+    Parameters
+    ----------
+
+    function : function
+        the generated function
+    args : dict
+        the available arguments (name: value)
+    unbound : list, optional
+        the names of the last arguments of the function which are
+        given by keyword at each call (default is no argument)
+
+    Returns
+    -------
+
+    functools.partial
+        the generated function with all its arguments set
+        except the unbound ones
+
+    """
+    func_args = get_genfunction_args(function)
+    func_args = func_args[:len(func_args) - len(unbound)]
+    if hasattr(function, 'arg_dict'):
+        from .context import queue
         d = {k:args[k] for k in func_args} #pylint: disable=invalid-name
         d['queue'] = queue
-    except: #pylint: disable=bare-except
-        func_args = getargspec(function).args
-        d = {k:args[k] for k in func_args} #pylint: disable=invalid-name
-    function(**d)
+        return partial(function, **d)
+    return partial(function, *[args[k] for k in func_args])
+
+def call_genfunction(function, args):
+    """
+    Call a generated function with the arguments found in args.
+
+    Parameters
+    ----------
+
+    function : function
+        the generated function
+    args : dict
+        the available arguments (name: value)
+
+    """
+    bind_genfunction(function, args)()
@@ -180,7 +180,7 @@ def validate(dico, name):
                               'required': name in ['Scheme', 'Simulation']
                              },
               'relaxation_parameters': {'type': 'list',
-                                        'schema': {'type': 'number'},
+                                        'schema': {'type': ['number', 'expr']},
                                         'required': name in ['Scheme', 'Simulation']
                                        },
               'equilibrium': {'type': 'list',
@@ -208,9 +208,17 @@ def validate(dico, name):
                            'keyschema': {'type': 'integer'},
                            'valueschema': {'isboundary': True}
                           },
-                'value': {'type': ['function', 'list'],
-                          'items': [{'type': 'function'}, {'type': 'list'}]
-                         }
+                'value': {'anyof': [{'type': 'function'},
+                                    {'type': 'list',
+                                     'items': [{'type': 'function'}, {'type': 'list'}]
+                                    },
+                                    {'type': 'dict',
+                                     'keyschema': {'type': 'symbol'},
+                                     'valueschema': {'type': ['number', 'expr']}
+                                    }
+                                   ]
+                         },
+                'update_every': {'type': 'integer', 'min': 1}
                }
 
     simulation = {'dim': {'type': 'integer',
@@ -265,8 +273,30 @@ def validate(dico, name):
                                           'valueschema': {'schema': boundary},
                                          },
                   'generator': {'type': 'string',
-                                'allowed':['numpy', 'cython', 'loopy']
-                               }
+                                'allowed':['numpy', 'cython', 'cython_omp', 'loopy']
+                               },
+                  'skip_solid_cells': {'type': 'boolean'},
+                  'mpi_overlap': {'type': 'boolean'},
+                  'inplace_streaming': {'type': 'boolean'},
+                  'fuse_boundary_conditions': {'type': 'boolean'},
+                  'store_moments': {'type': ['boolean', 'list'],
+                                    'schema': {'type': ['symbol', 'integer']}
+                                   },
+                  'storage': {'type': 'string',
+                              'allowed': ['dense', 'sparse']
+                             },
+                  'tiling': {'type': ['boolean', 'list'],
+                             'schema': {'type': 'integer', 'min': 0, 'nullable': True}
+                            },
+                  'fuse_time_loop': {'type': 'boolean'},
+                  'openmp': {'type': 'dict',
+                             'schema': {'num_threads': {'type': 'integer', 'min': 1},
+                                        'schedule': {'type': 'string',
+                                                     'allowed': ['static', 'dynamic', 'guided', 'runtime']
+                                                    },
+                                        'chunksize': {'type': 'integer', 'min': 1}
+                                       }
+                            }
                  }
 
     v = MyValidator(simulation)
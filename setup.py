@@ -50,6 +50,9 @@ setup(
     classifiers    = CLASSIFIERS,
     packages       = find_packages(exclude=['demo', 'doc', 'tests*']),
     include_package_data=True,
+    entry_points={
+        'console_scripts': ['pylbm-benchmark = pylbm.benchmark:main'],
+    },
     install_requires=[
                       'numpy>=1.9.2',
                       'sympy>=1.1.1<1.2',
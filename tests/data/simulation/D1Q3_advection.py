@@ -0,0 +1,27 @@
+# D1Q3 scheme for the advection of u on [0, 1]
+# with a Bouzidi bounce-back condition on the label 0
+import sympy as sp
+import pylbm
+
+u, X, LA, S = sp.symbols('u, X, LA, S')
+
+def inflow(f, m, x):
+    m[u] = 0.5
+
+def dico(label=0, s=1.5, uo=1., value=(inflow, ()), **kwargs):
+    d = {'box': {'x': [0., 1.], 'label': label},
+         'space_step': 1./32,
+         'scheme_velocity': 1.,
+         'parameters': {LA: 1., S: s},
+         'schemes': [{'velocities': list(range(3)),
+                      'conserved_moments': [u],
+                      'polynomials': [1, LA*X, LA**2*X**2/2],
+                      'relaxation_parameters': [0., S, S],
+                      'equilibrium': [u, 0.5*u, LA**2*u/2],
+                      'init': {u: uo},
+                     }],
+         'boundary_conditions': {0: {'method': {0: pylbm.bc.BouzidiBounceBack},
+                                     'value': value}},
+        }
+    d.update(kwargs)
+    return d
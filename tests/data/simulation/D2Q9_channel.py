@@ -0,0 +1,38 @@
+# D2Q9 scheme in a channel [0, 2]x[0, 1] around a circular obstacle:
+# Bouzidi bounce-back condition on the inlet and the walls (label 0),
+# Neumann condition on the outlet (label 1) and bounce-back condition
+# on the obstacle (label 2)
+import sympy as sp
+import pylbm
+
+rho, qx, qy, X, Y, LA, S = sp.symbols('rho, qx, qy, X, Y, LA, S')
+
+def inflow(f, m, x, y):
+    m[qx] = 0.05
+
+def dico(s=1.1, qo=0.05, **kwargs):
+    d = {'box': {'x': [0., 2.], 'y': [0., 1.], 'label': [0, 1, 0, 0]},
+         'elements': [pylbm.Circle([0.5, 0.5], 0.2, label=2)],
+         'space_step': 1./16,
+         'scheme_velocity': LA,
+         'parameters': {LA: 1., S: s},
+         'schemes': [{'velocities': list(range(9)),
+                      'conserved_moments': [rho, qx, qy],
+                      'polynomials': [1, LA*X, LA*Y,
+                                      3*(X**2 + Y**2) - 4,
+                                      (9*(X**2 + Y**2)**2 - 21*(X**2 + Y**2) + 8)/2,
+                                      3*X*(X**2 + Y**2) - 5*X, 3*Y*(X**2 + Y**2) - 5*Y,
+                                      X**2 - Y**2, X*Y],
+                      'relaxation_parameters': [0., 0., 0., S, S, S, S, 1.8, 1.8],
+                      'equilibrium': [rho, qx, qy,
+                                      -2*rho + 3*(qx**2 + qy**2), rho - 3*(qx**2 + qy**2),
+                                      -qx/LA, -qy/LA, qx**2 - qy**2, qx*qy],
+                      'init': {rho: 1., qx: qo, qy: 0.},
+                     }],
+         'boundary_conditions': {0: {'method': {0: pylbm.bc.BouzidiBounceBack},
+                                     'value': (inflow, ())},
+                                 1: {'method': {0: pylbm.bc.NeumannX}},
+                                 2: {'method': {0: pylbm.bc.BounceBack}}},
+        }
+    d.update(kwargs)
+    return d
@@ -40,6 +40,32 @@ class test_domain2D(object):
         assert(np.all(dom.x_halo == [np.linspace(-.125, 1.125, 6)]))
         assert(np.all(dom.y_halo == [np.linspace(-.125, 2.125, 10)]))
 
+    def test_fluid_cells(self):
+        dom2d = copy.deepcopy(self.dom2d)
+        dom2d['elements'] = [pylbm.Parallelogram([0.23, 0.73], [0.5, 0], [0., .5], label=10)]
+        dom = pylbm.Domain(dom2d)
+
+        cells = dom.get_fluid_cells()
+        assert(cells.dtype == np.int32)
+        assert(np.all(dom.in_or_out[cells[:, 0], cells[:, 1]] == self.valin))
+        assert(cells.shape[0] == np.sum(dom.in_or_out[1:-1, 1:-1] == self.valin))
+
+    def test_sparse_cells(self):
+        dom2d = copy.deepcopy(self.dom2d)
+        dom2d['elements'] = [pylbm.Parallelogram([0.23, 0.73], [0.5, 0], [0., .5], label=10)]
+        dom = pylbm.Domain(dom2d)
+
+        cells, nfluid = dom.get_sparse_cells()
+        assert(np.all(cells[:nfluid] == dom.get_fluid_cells()))
+
+        f = pylbm.storage.Sparse(5, cells, dom.shape_halo, dom.stencil.vmax)
+        neighbors = f.get_neighbors(dom.stencil.get_all_velocities(), nfluid)
+        assert(neighbors.shape == (nfluid, 5))
+        assert(np.all(cells[neighbors[:, 1]] == cells[:nfluid] - dom.stencil.get_all_velocities()[1]))
+
+        f[0] = dom.in_or_out
+        assert(np.all(f[0][tuple(cells.T)] == dom.in_or_out[tuple(cells.T)]))
+
     def test_domain_with_one_scheme(self):
         fname = 'simple_domain.npz'
         dom = pylbm.Domain(self.dom2d)
@@ -0,0 +1,15 @@
+import json
+from pylbm import benchmark
+
+def test_benchmark(tmpdir):
+    filename = str(tmpdir.join('bench.json'))
+    report = benchmark.run(cases=['D1Q2_advection'], sizes=[64], generators=['numpy'],
+                           storages=['soa', 'aos', '0,1,2'], nsteps=2, filename=filename)
+    assert [r['storage'] for r in report['results']] == ['soa', 'aos']
+    assert report['results'][0]['number_of_points'] == 64
+    assert report['results'][0]['MLUPS'] > 0
+
+    with open(filename) as f:
+        reference = json.load(f)
+    comparison, _ = benchmark.compare(reference, report)
+    assert len(comparison) == 2
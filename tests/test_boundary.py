@@ -0,0 +1,64 @@
+import numpy as np
+import sympy as sp
+import pylbm
+
+def test_boundary_tables():
+    dico = {'box': {'x': [0, 2], 'y': [0, 1], 'label': [0, 1, -1, -1]},
+            'elements': [pylbm.Circle([0.5, 0.5], 0.2, label=2)],
+            'space_step': 1./32,
+            'schemes': [{'velocities': list(range(9))}, {'velocities': list(range(5))}],
+            'boundary_conditions': {0: {'method': {0: pylbm.bc.BouzidiBounceBack, 1: pylbm.bc.AntiBounceBack}},
+                                    1: {'method': {0: pylbm.bc.NeumannX, 1: pylbm.bc.NeumannX}},
+                                    2: {'method': {0: pylbm.bc.AntiBounceBack, 1: pylbm.bc.BouzidiBounceBack}}},
+           }
+    domain = pylbm.Domain(dico)
+    bc = pylbm.boundary.Boundary(domain, dico)
+    assert bc.nbytes == sum(m.istore.nbytes + m.ilabel.nbytes + m.distance.nbytes for m in bc.methods)
+
+    # the points of a search of each label for each velocity sorted by their Morton index
+    stencil = domain.stencil
+    for method in bc.methods:
+        istore, distance = [], []
+        for label in domain.list_of_labels():
+            if label >= 0:
+                for k, v in dico['boundary_conditions'][label]['method'].items():
+                    if v is type(method):
+                        for inumk, numk in enumerate(stencil.num[k]):
+                            bv = pylbm.boundary.BoundaryVelocity(domain, label, stencil.unum2index[numk])
+                            istore.append(np.concatenate([np.full((1, bv.indices.shape[1]), inumk + stencil.nv_ptr[k]),
+                                                          bv.indices]))
+                            distance.append(bv.distance)
+        istore = np.concatenate(istore, axis=1)
+        order = pylbm.boundary.morton_order(istore[1:])
+        assert method.istore.dtype == np.int32
+        assert np.array_equal(method.istore, istore[:, order])
+        assert np.array_equal(method.distance, np.concatenate(distance)[order])
+
+def test_fused_boundary_conditions():
+    u, X, LA = sp.symbols('u, X, LA')
+    def dico(**kwargs):
+        d = {'box': {'x': [0., 1.], 'label': [0, 1]},
+             'space_step': 1./32,
+             'scheme_velocity': 1.,
+             'parameters': {LA: 1.},
+             'schemes': [{'velocities': list(range(3)),
+                          'conserved_moments': [u],
+                          'polynomials': [1, LA*X, LA**2*X**2/2],
+                          'relaxation_parameters': [0., 1.5, 1.5],
+                          'equilibrium': [u, 0.5*u, LA**2*u/2],
+                          'init': {u: 1.},
+                         }],
+             'boundary_conditions': {0: {'method': {0: pylbm.bc.BouzidiBounceBack},
+                                         'value': (lambda f, m, x: m.__setitem__(u, 0.5), ())},
+                                     1: {'method': {0: pylbm.bc.Neumann}}},
+            }
+        d.update(kwargs)
+        return d
+
+    for inplace in [False, True]:
+        ref = pylbm.Simulation(dico(inplace_streaming=inplace))
+        ref.run(9)
+        sol = pylbm.Simulation(dico(inplace_streaming=inplace, fuse_boundary_conditions=True))
+        sol.run(9)
+        assert list(sol.cpu_time['boundary_methods']) == [sol.bc.name]
+        assert np.allclose(sol.m[u], ref.m[u], rtol=0, atol=1e-14)
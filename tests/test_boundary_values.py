@@ -0,0 +1,33 @@
+import os
+import sys
+import numpy as np
+import sympy as sp
+import pylbm
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'data', 'simulation'))
+import D1Q3_advection
+
+u = D1Q3_advection.u
+t, x = sp.symbols('t, x')
+
+def pulse(f, m, x, t):
+    m[u] = 0.5 + 0.1*np.sin(10*t) + x
+
+def pulse_at(f, m, x, time):
+    pulse(f, m, x, time)
+
+def test_time_dependent_values():
+    ref = pylbm.Simulation(D1Q3_advection.dico(value=pulse))
+    ref.run(20)
+    assert ref.bc.methods[0].time_dependent
+
+    # the additional terms are the ones of the value at this time
+    ref._update_boundary_values()
+    sol = pylbm.Simulation(D1Q3_advection.dico(value=(pulse_at, (ref.t,))))
+    assert np.allclose(ref.bc.methods[0].rhs, sol.bc.methods[0].rhs, rtol=0, atol=1e-14)
+
+    # the sympy expressions with the generated function and with numpy
+    for generator in ['cython', 'numpy']:
+        sol = pylbm.Simulation(D1Q3_advection.dico(value={u: 0.5 + 0.1*sp.sin(10*t) + x}, generator=generator))
+        sol.run(20)
+        assert np.allclose(sol.m[u], ref.m[u], rtol=0, atol=1e-13)
@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import sympy as sp
+from pylbm.generator import For, make_routine, autowrap
+from pylbm.generator.cache import ModuleCache, cache_key
+
+def routines():
+    n = sp.Symbol('n', integer=True)
+    i = sp.Idx('i', (0, n))
+    a = sp.IndexedBase('a', [n])
+    b = sp.IndexedBase('b', [n])
+    return make_routine(('twice', For(i, sp.Eq(b[i], 2*a[i]))))
+
+def test_cache_key():
+    key = cache_key('source', 'cython', ['-O3'])
+    assert key == cache_key('source', 'cython', ['-O3'])
+    assert key != cache_key('source', 'numpy', ['-O3'])
+    assert key != cache_key('source', 'cython', ['-O2'])
+    assert key != cache_key('other source', 'cython', ['-O3'])
+
+def test_autowrap_with_cache(tmpdir):
+    cache = ModuleCache(str(tmpdir))
+    mod = autowrap(routines(), 'numpy', cache=cache)
+    assert len(cache.entries()) == 1
+
+    a = np.arange(5.)
+    b = np.zeros(5)
+    mod.twice(a=a, b=b, n=5)
+    assert np.all(b == 2*a)
+
+    # the module is reused
+    assert autowrap(routines(), 'numpy', cache=cache) is mod
+    assert len(cache.entries()) == 1
+
+def test_lookup(tmpdir):
+    cache = ModuleCache(str(tmpdir))
+    module = tmpdir.join('mod_test.py')
+    module.write('value = 1\n')
+    cache.store('abc', [str(module)])
+    assert cache.lookup('abc', 'mod_test') == os.path.join(str(tmpdir), 'abc', 'mod_test.py')
+    assert cache.lookup('def', 'mod_test') is None
+
+def test_eviction(tmpdir):
+    cache = ModuleCache(str(tmpdir.join('cache')), max_size=25)
+    for i in range(4):
+        module = tmpdir.join('mod_{}.py'.format(i))
+        module.write('value = 1\n')
+        cache.store('key{}'.format(i), [str(module)])
+        os.utime(os.path.join(cache.path, 'key{}'.format(i)), (i, i))
+    keys = [key for key, _ in cache.entries()]
+    assert 'key3' in keys
+    assert cache.size <= 25
+    cache.clear()
+    assert cache.entries() == []
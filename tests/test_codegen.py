@@ -0,0 +1,49 @@
+import numpy as np
+import sympy as sp
+from pylbm.generator import For, make_routine, autowrap
+
+def routines(cse):
+    n = sp.symbols('n', integer=True)
+    i = sp.Idx('i', (1, n - 1))
+    f = sp.IndexedBase('f', [n, 3])
+    g = sp.IndexedBase('g', [n, 3])
+    m = sp.MatrixSymbol('m', 3, 1)
+    M = sp.Matrix([[1, 1, 1], [0, 1, -1], [-2, 1, 1]])
+    s = sp.Matrix([0, 1.5, 1.2])
+    eq = sp.Matrix([m[0], 0.5*m[0], m[0]**2])
+    expr = For(i, [sp.Eq(m, M*sp.Matrix([f[i, 0], f[i - 1, 1], f[i + 1, 2]])),
+                   sp.Eq(m, (sp.ones(3, 1) - s).multiply_elementwise(sp.Matrix(m)) + s.multiply_elementwise(eq)),
+                   sp.Eq(sp.Matrix([g[i, k] for k in range(3)]), M.inv()*m)])
+    return make_routine(('kernel', expr), local_vars=[m], settings={'cse': cse})
+
+def test_cse():
+    f = np.random.rand(20, 3)
+    g = []
+    for cse in [False, True]:
+        mod = autowrap(routines(cse), 'cython')
+        g.append(np.zeros(f.shape))
+        mod.kernel(f=f, g=g[-1], n=f.shape[0])
+    assert np.allclose(g[0], g[1], rtol=1e-14, atol=1e-14)
+    assert sp.count_ops(routines(True)[0].instructions) < sp.count_ops(routines(False)[0].instructions)
+    assert routines(True)[0].flops < routines(False)[0].flops
+
+def test_memory_accesses():
+    accesses = routines(True)[0].memory_accesses
+    assert accesses['f'] == {'loads': 3, 'stores': 0, 'integer': False}
+    assert accesses['g'] == {'loads': 0, 'stores': 3, 'integer': False}
+
+def test_tiling():
+    nx, ny = sp.symbols('nx, ny', integer=True)
+    i = sp.Idx(sp.symbols('i', integer=True), (1, nx - 1))
+    j = sp.Idx(sp.symbols('j', integer=True), (0, ny))
+    f = sp.IndexedBase('f', [nx, ny])
+    g = sp.IndexedBase('g', [nx, ny])
+    expr = For([i, j], sp.Eq(g[i, j], f[i - 1, j] + 2*f[i + 1, j]))
+    f = np.random.rand(23, 17)
+    g = []
+    for tiling, tiles in [(False, {}), (True, {'tile_i': 4, 'tile_j': 5}), (True, {'tile_i': 30, 'tile_j': 1})]:
+        mod = autowrap(make_routine(('kernel', expr), settings={'tiling': tiling}), 'cython')
+        g.append(np.zeros(f.shape))
+        mod.kernel(f=f, g=g[-1], nx=f.shape[0], ny=f.shape[1], **tiles)
+        assert np.all(g[-1] == g[0])
+    assert np.all(g[0][1:-1] == f[:-2] + 2*f[2:])
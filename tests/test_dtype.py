@@ -0,0 +1,48 @@
+import os
+import sys
+import numpy as np
+import sympy as sp
+import pylbm
+from pylbm.generator import For, make_routine, autowrap
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'data', 'simulation'))
+import D2Q9_channel
+
+def routines():
+    n = sp.symbols('n', integer=True)
+    i = sp.Idx('i', (0, n))
+    a = sp.IndexedBase('a', [n])
+    b = sp.IndexedBase('b', [n])
+    m = sp.MatrixSymbol('m', 2, 1)
+    expr = For(i, [sp.Eq(m, sp.Matrix([0.5*a[i], a[i]])),
+                   sp.Eq(b[i], m[0] + m[1])])
+    return make_routine(('kernel', expr), local_vars=[m])
+
+def test_float32():
+    a = np.random.rand(20).astype(np.float32)
+    for backend in ['cython', 'cython_omp']:
+        mod = autowrap(routines(), backend, settings={'dtype': {'default': 'float32'}})
+        b = np.zeros(a.shape, dtype=np.float32)
+        mod.kernel(a=a, b=b, n=a.size)
+        assert np.allclose(b, 1.5*a)
+
+def test_mixed_precision():
+    a = np.random.rand(20).astype(np.float32)
+    mod = autowrap(routines(), 'cython', settings={'dtype': {'default': 'float32',
+                                                             'local': 'float64',
+                                                             'b': 'float64'}})
+    b = np.zeros(a.shape)
+    mod.kernel(a=a, b=b, n=a.size)
+    assert np.all(b == 1.5*a.astype(np.float64))
+
+def test_simulation_precision():
+    # the 2D channel in single and in mixed precision against double precision
+    ref = pylbm.Simulation(D2Q9_channel.dico())
+    ref.run(20)
+    for moments_dtype in [None, 'float64']:
+        sol = pylbm.Simulation(D2Q9_channel.dico(), dtype='float32', moments_dtype=moments_dtype)
+        assert sol._F.array.dtype == np.float32
+        sol.run(20)
+        for k in [D2Q9_channel.rho, D2Q9_channel.qx, D2Q9_channel.qy]:
+            assert sol.m[k].dtype == sol.moments_type
+            assert np.allclose(sol.m[k], ref.m[k], rtol=0, atol=1e-6)
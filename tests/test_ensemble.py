@@ -0,0 +1,33 @@
+import os
+import sys
+import numpy as np
+import pylbm
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'data', 'simulation'))
+import D1Q3_advection
+import D2Q9_channel
+
+def test_ensemble():
+    u, S = D1Q3_advection.u, D1Q3_advection.S
+    members = [{'parameters': {S: 1.2}},
+               {'parameters': {S: 1.8}, 'init': {u: 2.}}]
+    ens = pylbm.Ensemble(D1Q3_advection.dico(s=1., uo=1.), members)
+    ens.run(20)
+    assert ens.m[u].shape == (2, 32)
+
+    for b, (s, uo) in enumerate([(1.2, 1.), (1.8, 2.)]):
+        sol = pylbm.Simulation(D1Q3_advection.dico(s=s, uo=uo))
+        sol.run(20)
+        assert np.allclose(ens.m[u][b], sol.m[u], rtol=0, atol=1e-14)
+
+def test_ensemble_2d():
+    qx, S = D2Q9_channel.qx, D2Q9_channel.S
+    members = [{'parameters': {S: 1.2}},
+               {'parameters': {S: 1.6}, 'init': {qx: 0.02}}]
+    ens = pylbm.Ensemble(D2Q9_channel.dico(), members)
+    ens.run(20)
+
+    for b, (s, qo) in enumerate([(1.2, 0.05), (1.6, 0.02)]):
+        sol = pylbm.Simulation(D2Q9_channel.dico(s=s, qo=qo))
+        sol.run(20)
+        assert np.allclose(ens.m[qx][b], sol.m[qx], rtol=0, atol=1e-14)
@@ -0,0 +1,54 @@
+from xml.etree import ElementTree
+import numpy as np
+import h5py
+import pylbm
+
+def test_asynchronous_write(tmpdir):
+    dom = pylbm.Domain({'box': {'x': [0, 1], 'y': [0, 2], 'label': 0},
+                        'space_step': 0.25,
+                        'schemes': [{'velocities': list(range(9))}],
+                       })
+    x, y = dom.x, dom.y
+    rho = np.add.outer(x, 10*y)
+    path = str(tmpdir)
+    for asynchronous in [False, True]:
+        h5 = pylbm.H5File(dom.mpi_topo, 'test{}'.format(int(asynchronous)), path,
+                          asynchronous=asynchronous)
+        h5.set_grid(x, y)
+        h5.add_scalar('rho', rho)
+        h5.add_vector('q', [rho, 2*rho])
+        # the fields are copied before the writing
+        rho += 1
+        h5.save()
+        h5.wait()
+        rho -= 1
+
+    for asynchronous in [False, True]:
+        with h5py.File(path + '/test{}_0.h5'.format(int(asynchronous)), 'r') as h5:
+            assert np.all(h5['rho'][...] == rho.T)
+            assert np.all(h5['q'][..., 1] == 2*rho.T)
+            assert np.all(h5['x_1'][...] == y)
+
+def test_time_series(tmpdir):
+    dom = pylbm.Domain({'box': {'x': [0, 1], 'y': [0, 2], 'label': 0},
+                        'space_step': 0.25,
+                        'schemes': [{'velocities': list(range(9))}],
+                       })
+    rho = np.add.outer(dom.x, 10*dom.y)
+    path = str(tmpdir)
+    h5 = pylbm.H5TimeSeries(dom.mpi_topo, 'series', path, compression='gzip')
+    h5.set_grid(dom.x, dom.y)
+    for n in range(3):
+        h5.set_grid(dom.x, dom.y)
+        h5.add_scalar('rho', n*rho)
+        h5.add_vector('q', [rho, n*rho])
+        h5.save(0.5*n)
+    h5.close()
+
+    with h5py.File(path + '/series.h5', 'r') as h5:
+        assert h5['rho'].shape == (3,) + rho.T.shape
+        assert np.all(h5['rho'][2] == 2*rho.T)
+        assert np.all(h5['q'][1, ..., 1] == rho.T)
+        assert np.all(h5['time'][...] == [0., 0.5, 1.])
+    xdmf = ElementTree.parse(path + '/series.xdmf')
+    assert [float(t.get('Value')) for t in xdmf.iter('Time')] == [0., 0.5, 1.]
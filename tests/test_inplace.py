@@ -0,0 +1,46 @@
+import os
+import sys
+import numpy as np
+import pylbm
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'data', 'simulation'))
+import D1Q3_advection
+import D2Q9_channel
+
+u, S = D1Q3_advection.u, D1Q3_advection.S
+
+def test_inplace_streaming():
+    for label in [0, -1]:
+        for nsteps in [7, 8]:
+            ref = pylbm.Simulation(D1Q3_advection.dico(label))
+            ref.run(nsteps)
+            sol = pylbm.Simulation(D1Q3_advection.dico(label, inplace_streaming=True))
+            sol.run(nsteps)
+            assert sol._F is sol._Fold
+            assert np.allclose(sol.F[1], ref.F[1], rtol=0, atol=1e-14)
+            assert np.allclose(sol.m[u], ref.m[u], rtol=0, atol=1e-14)
+
+            # the time steps go on after the access to the moments
+            ref.run(3)
+            sol.run(3)
+            assert np.allclose(sol.m[u], ref.m[u], rtol=0, atol=1e-14)
+
+def test_inplace_ensemble():
+    members = [{'parameters': {S: 1.2}}, {'parameters': {S: 1.8}}]
+    ens = pylbm.Ensemble(D1Q3_advection.dico(inplace_streaming=True), members)
+    ens.run(9)
+    for b, s in enumerate([1.2, 1.8]):
+        sol = pylbm.Simulation(D1Q3_advection.dico(s=s))
+        sol.run(9)
+        assert np.allclose(ens.m[u][b], sol.m[u], rtol=0, atol=1e-14)
+
+def test_inplace_streaming_2d():
+    qx = D2Q9_channel.qx
+    for nsteps in [7, 8]:
+        ref = pylbm.Simulation(D2Q9_channel.dico())
+        ref.run(nsteps)
+        sol = pylbm.Simulation(D2Q9_channel.dico(inplace_streaming=True))
+        sol.run(nsteps)
+        # the values in the obstacle are not the ones of the two arrays
+        fluid = ref.domain.in_or_out[1:-1, 1:-1] == ref.domain.valin
+        assert np.allclose(sol.m[qx][fluid], ref.m[qx][fluid], rtol=0, atol=1e-14)
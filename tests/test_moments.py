@@ -0,0 +1,72 @@
+import os
+import sys
+import numpy as np
+import sympy as sp
+import pylbm
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'data', 'simulation'))
+import D1Q3_advection
+
+u, X, LA = D1Q3_advection.u, D1Q3_advection.X, D1Q3_advection.LA
+
+def test_lazy_moments():
+    sol = pylbm.Simulation(D1Q3_advection.dico())
+    sol.run(5)
+    F = sol._F.swaparray
+    M = sol.scheme.Mnum
+    m = np.einsum('kj,j...->k...', M, F)
+
+    assert np.allclose(sol.m[u, 3:7], m[0, 4:8], rtol=0, atol=1e-14)
+    assert not np.any(sol._valid_m)
+    assert np.allclose(sol.m[u], m[0, 1:-1], rtol=0, atol=1e-14)
+    assert np.all(sol._valid_m == [True, False, False])
+    assert np.allclose(sol.m_halo[2], m[2], rtol=0, atol=1e-14)
+    assert np.allclose(sol.m[1:], m[1:, 1:-1], rtol=0, atol=1e-14)
+    assert np.all(sol._valid_m)
+
+    sol.one_time_step()
+    assert not np.any(sol._valid_m)
+
+    # the moments are computed with the functions of the simulation
+    # and not with the ones of the last compiled simulation
+    other = pylbm.Simulation(D1Q3_advection.dico(), sorder=[0, 1])
+    other.run(5)
+    sol.one_time_step()
+    F = sol._F.swaparray
+    m = np.einsum('kj,j...->k...', M, F)
+    assert np.allclose(sol.m[u, 3:7], m[0, 4:8], rtol=0, atol=1e-14)
+    assert np.allclose(sol.m[1:], m[1:, 1:-1], rtol=0, atol=1e-14)
+
+def test_store_moments():
+    ref = pylbm.Simulation(D1Q3_advection.dico())
+    ref.run(5)
+    for inplace in [False, True]:
+        sol = pylbm.Simulation(D1Q3_advection.dico(store_moments=True, inplace_streaming=inplace))
+        sol.run(5)
+        assert np.all(sol._stored_m == [True, False, False])
+        assert np.allclose(sol.m[u], ref.m[u], rtol=0, atol=1e-14)
+        assert not np.any(sol._valid_m)
+
+def test_lazy_moments_two_schemes():
+    # the conserved moments are permuted at the beginning of the moments
+    v = sp.Symbol('v')
+    d = {'box': {'x': [0., 1.], 'label': -1},
+         'space_step': 1./32,
+         'scheme_velocity': 1.,
+         'parameters': {LA: 1.},
+         'schemes': [{'velocities': [1, 2],
+                      'conserved_moments': [c],
+                      'polynomials': [1, LA*X],
+                      'relaxation_parameters': [0., 1.5],
+                      'equilibrium': [c, 0.5*c],
+                      'init': {c: value},
+                     } for c, value in [(u, 1.), (v, 2.)]],
+        }
+    sol = pylbm.Simulation(d)
+    sol.run(3)
+    assert sol.scheme.consm == {u: 0, v: 1}
+    assert np.allclose(sol.m[v], 2., rtol=0, atol=1e-14)
+    assert np.allclose(sol.m[u], 1., rtol=0, atol=1e-14)
+    F = sol._F.swaparray
+    m = np.einsum('kj,j...->k...', np.array(sol.scheme.M.tolist(), dtype=np.float64), F)
+    assert np.allclose(sol.m_halo[:], m, rtol=0, atol=1e-14)
@@ -0,0 +1,42 @@
+import os
+import sys
+import numpy as np
+import sympy as sp
+import pylbm
+from pylbm.generator import For, make_routine, autowrap
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'data', 'simulation'))
+import D2Q9_channel
+
+def routines():
+    nx, ny = sp.symbols('nx, ny', integer=True)
+    i = sp.Idx('i', (0, nx))
+    j = sp.Idx('j', (0, ny))
+    a = sp.IndexedBase('a', [nx, ny])
+    b = sp.IndexedBase('b', [nx, ny])
+    m = sp.MatrixSymbol('m', 2, 1)
+    expr = For([i, j], [sp.Eq(m, sp.Matrix([a[i, j]**2, 3*a[i, j]])),
+                        sp.Eq(b[i, j], m[0] - m[1])])
+    return make_routine(('kernel', expr), local_vars=[m], settings={'parallel': True})
+
+def test_openmp():
+    a = np.random.rand(50, 40)
+    res = []
+    for backend in ['cython', 'cython_omp']:
+        mod = autowrap(routines(), backend, settings={'openmp': {'num_threads': 2}})
+        b = np.zeros(a.shape)
+        mod.kernel(a=a, b=b, nx=a.shape[0], ny=a.shape[1])
+        res.append(b)
+    assert np.all(res[0] == a**2 - 3*a)
+    assert np.all(res[0] == res[1])
+
+def test_openmp_simulation():
+    # the boundary conditions and the time step with several threads
+    rho, qx, qy = D2Q9_channel.rho, D2Q9_channel.qx, D2Q9_channel.qy
+    ref = pylbm.Simulation(D2Q9_channel.dico(generator='cython'))
+    ref.run(20)
+    sol = pylbm.Simulation(D2Q9_channel.dico(generator='cython_omp', openmp={'num_threads': 2}))
+    assert sol.generator == 'CYTHON_OMP'
+    sol.run(20)
+    for k in [rho, qx, qy]:
+        assert np.allclose(sol.m[k], ref.m[k], rtol=0, atol=1e-14)
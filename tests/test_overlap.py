@@ -0,0 +1,79 @@
+import numpy as np
+import sympy as sp
+import pylbm
+
+rho, qx, qy, X, Y, LA = sp.symbols('rho, qx, qy, X, Y, LA')
+
+def dico(**kwargs):
+    d = {'box': {'x': [0., 1.], 'y': [0., 1.], 'label': -1},
+         'space_step': 1./16,
+         'scheme_velocity': LA,
+         'parameters': {LA: 1.},
+         'schemes': [{'velocities': list(range(9)),
+                      'conserved_moments': [rho, qx, qy],
+                      'polynomials': [1, LA*X, LA*Y,
+                                      3*(X**2 + Y**2) - 4,
+                                      (9*(X**2 + Y**2)**2 - 21*(X**2 + Y**2) + 8)/2,
+                                      3*X*(X**2 + Y**2) - 5*X, 3*Y*(X**2 + Y**2) - 5*Y,
+                                      X**2 - Y**2, X*Y],
+                      'relaxation_parameters': [0., 0., 0., 1.5, 1.5, 1.5, 1.5, 1.2, 1.2],
+                      'equilibrium': [rho, qx, qy,
+                                      -2*rho + 3*(qx**2 + qy**2), rho - 3*(qx**2 + qy**2),
+                                      -qx/LA, -qy/LA, qx**2 - qy**2, qx*qy],
+                      'init': {rho: 1., qx: 0.05, qy: 0.},
+                     }],
+        }
+    d.update(kwargs)
+    return d
+
+def perturb(sol):
+    noise = np.random.RandomState(0)
+    for k in range(9):
+        f = sol.F_halo[k]
+        sol.F_halo[k] = f*(1. + 0.1*noise.random_sample(f.shape))
+
+def test_overlap_periodic():
+    # no boundary condition: all the ghost points come from the exchange
+    ref = pylbm.Simulation(dico())
+    perturb(ref)
+    ref.run(10)
+    sol = pylbm.Simulation(dico(mpi_overlap=True))
+    assert sol.mpi_overlap and not sol.bc.methods
+    perturb(sol)
+    sol.run(10)
+    for k in [rho, qx, qy]:
+        assert np.allclose(sol.m[k], ref.m[k], rtol=0, atol=1e-14)
+
+def dico1d(**kwargs):
+    d = {'box': {'x': [0., 1.], 'label': 0},
+         'space_step': 1./32,
+         'scheme_velocity': LA,
+         'parameters': {LA: 1.},
+         'schemes': [{'velocities': list(range(3)),
+                      'conserved_moments': [rho],
+                      'polynomials': [1, LA*X, LA**2*X**2/2],
+                      'relaxation_parameters': [0., 1.5, 1.5],
+                      'equilibrium': [rho, 0.5*rho, LA**2*rho/2],
+                      'init': {rho: 1.},
+                     }],
+         'boundary_conditions': {0: {'method': {0: pylbm.bc.BounceBack}}},
+        }
+    d.update(kwargs)
+    return d
+
+def test_fluid_cells_1d():
+    # the list of the fluid points has a size-1 axis in 1D
+    ref = pylbm.Simulation(dico1d())
+    ref.F_halo[1] = 1.1*ref.F_halo[1]
+    ref.run(10)
+    for option in ['skip_solid_cells', 'mpi_overlap']:
+        sol = pylbm.Simulation(dico1d(**{option: True}))
+        assert sol.fluid_cells is not None
+        # the requests of the exchange with all the neighbors are only created
+        # with mpi_overlap when the ghost points are not copied in memory
+        for array in [sol._F, sol._Fold]:
+            needed = option == 'mpi_overlap' and len(array.local_directions) < sol.dim
+            assert bool(array.overlap_requests) == needed
+        sol.F_halo[1] = 1.1*sol.F_halo[1]
+        sol.run(10)
+        assert np.allclose(sol.m[rho], ref.m[rho], rtol=0, atol=1e-14)
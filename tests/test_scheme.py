@@ -0,0 +1,41 @@
+import sympy as sp
+from pylbm.scheme import exact_inverse
+
+def test_exact_inverse():
+    LA = sp.symbols('LA')
+    M = sp.Matrix([[1, 1, 1], [0, 1, -1], [-4, 0.5, 0.5]])
+    invM = exact_inverse(M)
+    assert invM.free_symbols == set()
+    assert M.applyfunc(lambda e: sp.nsimplify(e, rational=True))*invM == sp.eye(3)
+
+    M = sp.Matrix([[1, 1, 1], [0, LA, -LA], [-4, LA**2 - 4, LA**2 - 4]])
+    invM = exact_inverse(M)
+    assert (M*invM).applyfunc(sp.cancel) == sp.eye(3)
+
+def test_moments_matrices_cache():
+    import pylbm
+    u, X, LA = sp.symbols('u, X, LA')
+    def dico(la):
+        return {'box': {'x': [0., 1.], 'label': 0},
+                'space_step': 0.1,
+                'scheme_velocity': LA,
+                'parameters': {LA: la},
+                'schemes': [{'velocities': [1, 2],
+                             'conserved_moments': [u],
+                             'polynomials': [1, LA*X],
+                             'relaxation_parameters': [0., 1.5],
+                             'equilibrium': [u, 0.5*u],
+                            }],
+               }
+
+    max_size = pylbm.scheme.MAX_MOMENTS_MATRICES
+    pylbm.scheme.MAX_MOMENTS_MATRICES = 2
+    try:
+        pylbm.scheme._moments_matrices.clear()
+        schemes = [pylbm.Scheme(dico(la)) for la in [1., 2., 1., 3.]]
+        # the matrices of LA=1 are used again and those of LA=2 are removed
+        assert len(pylbm.scheme._moments_matrices) == 2
+        assert [list(key[3]) for key in pylbm.scheme._moments_matrices] == [[(LA, 1.)], [(LA, 3.)]]
+        assert schemes[2].M == schemes[0].M
+    finally:
+        pylbm.scheme.MAX_MOMENTS_MATRICES = max_size
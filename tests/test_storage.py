@@ -0,0 +1,120 @@
+import numpy as np
+import pylbm
+
+def test_overlap_update():
+    dom = pylbm.Domain({'box': {'x': [0, 1], 'y': [0, 2], 'label': 0},
+                        'space_step': 0.25,
+                        'schemes': [{'velocities': list(range(9))}],
+                       })
+    arrays = []
+    for sorder in [[2, 0, 1], [0, 1, 2]]:
+        for i in range(2):
+            f = pylbm.storage.Array(9, dom.global_size, dom.stencil.vmax, sorder, dom.mpi_topo)
+            f.array[...] = np.arange(f.size).reshape(f.shape)
+            arrays.append(f)
+
+    for f, g in zip(arrays[::2], arrays[1::2]):
+        f.update()
+        g.set_overlap()
+        g.start_update()
+        g.wait_update()
+        assert np.all(f.array == g.array)
+        g.free_overlap()
+        assert not g.overlap_requests
+
+def test_periodic_update():
+    from pylbm.generator import generator
+    dom = pylbm.Domain({'box': {'x': [0, 1], 'y': [0, 2], 'label': -1},
+                        'space_step': 0.25,
+                        'schemes': [{'velocities': list(range(13))}],
+                       })
+    for sorder in [[2, 0, 1], [0, 1, 2]]:
+        f, g = [pylbm.storage.Array(13, dom.global_size, dom.stencil.vmax, sorder, dom.mpi_topo) for _ in range(2)]
+        generator.routines.clear()
+        f.generate_periodic()
+        generator.compile(backend='CYTHON')
+        f.bind_periodic(generator.module)
+        # the copies in memory give the exchanges of the process with itself
+        assert f.local_directions == [0, 1]
+        g.array[...] = np.arange(g.size).reshape(g.shape)
+        g.update()
+        for start in [False, True]:
+            f.array[...] = np.arange(f.size).reshape(f.shape)
+            if start:
+                f.start_update()
+                f.wait_update()
+            else:
+                f.update()
+            assert np.all(f.array == g.array)
+
+def test_sparse_storage():
+    import sympy as sp
+    rho, qx, qy, X, Y, LA = sp.symbols('rho, qx, qy, X, Y, LA')
+    def dico(**kwargs):
+        d = {'box': {'x': [0., 2.], 'y': [0., 1.], 'label': [-1, -1, 0, 0]},
+             'elements': [pylbm.Circle([0.5, 0.5], 0.2, label=1)],
+             'space_step': 1./16,
+             'scheme_velocity': LA,
+             'parameters': {LA: 1.},
+             'schemes': [{'velocities': list(range(9)),
+                          'conserved_moments': [rho, qx, qy],
+                          'polynomials': [1, LA*X, LA*Y,
+                                          3*(X**2 + Y**2) - 4,
+                                          (9*(X**2 + Y**2)**2 - 21*(X**2 + Y**2) + 8)/2,
+                                          3*X*(X**2 + Y**2) - 5*X, 3*Y*(X**2 + Y**2) - 5*Y,
+                                          X**2 - Y**2, X*Y],
+                          'relaxation_parameters': [0., 0., 0., 1.5, 1.5, 1.5, 1.5, 1.2, 1.2],
+                          'equilibrium': [rho, qx, qy,
+                                          -2*rho + 3*(qx**2 + qy**2), rho - 3*(qx**2 + qy**2),
+                                          -qx/LA, -qy/LA, qx**2 - qy**2, qx*qy],
+                          'init': {rho: 1., qx: 0.05, qy: 0.},
+                         }],
+             'boundary_conditions': {0: {'method': {0: pylbm.bc.BouzidiBounceBack}},
+                                     1: {'method': {0: pylbm.bc.BounceBack}}},
+            }
+        d.update(kwargs)
+        return d
+
+    # the moments of the fluid points after a few time steps
+    ref = pylbm.Simulation(dico())
+    ref.run(10)
+    sol = pylbm.Simulation(dico(storage='sparse'))
+    assert sol.sparse
+    sol.run(10)
+    fluid = ref.domain.in_or_out[1:-1, 1:-1] == ref.domain.valin
+    for k in [rho, qx, qy]:
+        assert np.allclose(sol.m[k][fluid], ref.m[k][fluid], rtol=0, atol=1e-14)
+
+    # only the fluid points are counted in the performance of one_time_step
+    for s in [ref, sol]:
+        assert s.generator_report()['one_time_step']['number_of_points'] == 10*np.count_nonzero(fluid)
+
+def test_periodic_simulations():
+    import sympy as sp
+    u, X, Y, LA = sp.symbols('u, X, Y, LA')
+    dico = {'box': {'x': [0., 1.], 'y': [0., 1.], 'label': -1},
+            'space_step': 1./16,
+            'scheme_velocity': LA,
+            'parameters': {LA: 1.},
+            'schemes': [{'velocities': list(range(5)),
+                         'conserved_moments': [u],
+                         'polynomials': [1, LA*X, LA*Y, LA**2*(X**2 + Y**2), LA**2*(X**2 - Y**2)],
+                         'relaxation_parameters': [0., 1.5, 1.5, 1.2, 1.2],
+                         'equilibrium': [u, 0.5*u, 0.2*u, 0.5*u, 0.],
+                         'init': {u: 1.},
+                        }],
+           }
+    def run(sim):
+        sim.F_halo[1] = sim.F_halo[1]*(1 + np.random.RandomState(0).rand(*sim.F_halo[1].shape))
+        sim.run(20)
+
+    ref = pylbm.Simulation(dico, sorder=[0, 1, 2])
+    run(ref)
+    ref_values = [ref.F_halo[k].copy() for k in range(5)]
+    # the periodic copies of a simulation are not the ones of the last compiled simulation
+    sol = pylbm.Simulation(dico, sorder=[0, 1, 2])
+    other = pylbm.Simulation(dico, sorder=[2, 0, 1])
+    for sim in [sol, other]:
+        run(sim)
+        for k in range(5):
+            assert np.allclose(sim.F_halo[k], ref_values[k], rtol=0, atol=1e-14)
@@ -0,0 +1,46 @@
+import os
+import sys
+import numpy as np
+import sympy as sp
+import pylbm
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'data', 'simulation'))
+import D1Q3_advection
+import D2Q9_channel
+
+u = D1Q3_advection.u
+
+def test_time_loop():
+    for label, options in [(0, {}), (-1, {}), (0, {'store_moments': True}), (0, {'skip_solid_cells': True})]:
+        ref = pylbm.Simulation(D1Q3_advection.dico(label, **options))
+        ref.F_halo[1] = 1.1*ref.F_halo[1]
+        ref_values = []
+        ref.run(11, callback=lambda s: ref_values.append(s.m[u].copy()), callback_every=5)
+
+        sol = pylbm.Simulation(D1Q3_advection.dico(label, fuse_time_loop=True, **options))
+        assert sol.fuse_time_loop
+        sol.F_halo[1] = 1.1*sol.F_halo[1]
+        values = []
+        sol.run(11, callback=lambda s: values.append(s.m[u].copy()), callback_every=5)
+        assert sol.nt == 11 and sol.cpu_time['number_of_iterations'] == 11
+        for value, ref_value in zip(values + [sol.m[u]], ref_values + [ref.m[u]]):
+            assert np.allclose(value, ref_value, rtol=0, atol=1e-14)
+
+def test_time_loop_fallback():
+    # the values on the boundary which depend on the time are evaluated at each time step
+    value = {u: 0.5 + 0.1*sp.sin(10*sp.Symbol('t'))}
+    for options in [{'generator': 'numpy'}, {'value': value}]:
+        sol = pylbm.Simulation(D1Q3_advection.dico(0, fuse_time_loop=True, **options))
+        assert not sol.fuse_time_loop
+        sol.run(3)
+        assert sol.nt == 3
+
+def test_time_loop_2d():
+    qx = D2Q9_channel.qx
+    for options in [{}, {'mpi_overlap': True}]:
+        ref = pylbm.Simulation(D2Q9_channel.dico(**options))
+        ref.run(21)
+        sol = pylbm.Simulation(D2Q9_channel.dico(fuse_time_loop=True, **options))
+        assert sol.fuse_time_loop and sol.fuse_bc
+        sol.run(21)
+        assert np.allclose(sol.m[qx], ref.m[qx], rtol=0, atol=1e-14)